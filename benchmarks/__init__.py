@@ -0,0 +1,44 @@
+"""Microbenchmarks for the hot paths of each stage
+
+Run from the repository root with python -m benchmarks.  Each benchmark is
+timed on its own and compared against the numbers in baseline.json, failing if
+it is slower by more than the tolerance.  Baselines depend on the host, so save
+new ones (--save) when moving to different hardware.
+"""
+import time
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark
+
+    The decorated function does any setup and returns the callable to time.
+    """
+    def _benchmark_impl(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return _benchmark_impl
+
+
+def measure(fn, repeat=5, min_time=0.2):
+    """Return the best time per call, in seconds"""
+    fn()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed) + 1)
+
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best
@@ -0,0 +1,81 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import platform
+
+from . import BENCHMARKS, measure
+from . import stages  # noqa: F401 - registers the benchmarks
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time each stage's hot path against a baseline")
+    parser.add_argument('-b', '--baseline', default=BASELINE, help="Baseline file")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25, help="Allowed slowdown over the baseline, as a fraction")
+    parser.add_argument('-s', '--save', action='store_true', help="Save the results as the new baseline")
+    parser.add_argument('-k', '--filter', help="Only run benchmarks whose name contains this")
+    return parser.parse_args()
+
+
+def host():
+    return f'{platform.machine()} {platform.python_implementation()} {platform.python_version()}'
+
+
+def main(args):
+    # The example config logs errors for some directives, which would just be timing the logging
+    logging.disable(logging.ERROR)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        if baseline.get('host') != host():
+            print(f"Warning: baseline is from {baseline.get('host')}, this is {host()}")
+    base_results = baseline.get('results', {})
+
+    results = {}
+    failed = []
+    print(f"{'Benchmark':40} {'Time':>12} {'Baseline':>12} {'Ratio':>7}")
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        fn = setup()
+        t = measure(fn)
+        base = base_results.get(name)
+        if args.save:
+            # Settle on the median of a few runs so one lucky run doesn't set the bar
+            t = sorted([t, measure(fn), measure(fn)])[1]
+        elif base and t / base > 1 + args.tolerance:
+            # Give anything that looks slower another couple of tries before failing it, timings are noisy
+            t = min(t, measure(fn), measure(fn))
+        results[name] = t
+        if base:
+            ratio = t / base
+            status = ''
+            if ratio > 1 + args.tolerance:
+                status = 'SLOWER'
+                failed.append(name)
+            print(f"{name:40} {t * 1e6:10.1f}us {base * 1e6:10.1f}us {ratio:6.2f}x {status}")
+        else:
+            print(f"{name:40} {t * 1e6:10.1f}us {'-':>12}")
+
+    if args.save:
+        base_results.update(results)
+        with open(args.baseline, 'w') as fp:
+            json.dump({'host': host(), 'results': base_results}, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if failed:
+        print(f"{len(failed)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
@@ -0,0 +1,157 @@
+"""Synthetic rig configs for scale testing
+
+generate_rig() builds the LightTypes, Lights and Mapping sections for a rig of
+any size, in the same shape as config-example: fixtures are spread across DMX
+devices (a universe each), every group has a leader with a program and state
+effects, and the rest of the group is linked to it or shares its program.
+"""
+import os
+import copy
+
+from lib.config import load_config
+
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'config-example', 'main.yaml')
+
+LIGHT_TYPES = {
+    'SynthMovingHead': {
+        'RawType': 'dmx',
+        'Channels': 12,
+        'Functions': {
+            'pan': {'channel': 1, 'speed': [25, 1]},
+            'pan_fine': {'channel': 2},
+            'tilt': {'channel': 3, 'speed': [10, 0.5]},
+            'tilt_fine': {'channel': 4},
+            'color': {
+                'channel': 5,
+                'type': 'static',
+                'map': {name: [i * 16, i * 16 + 15] for i, name in enumerate(
+                    ['white', 'red', 'green', 'blue', 'yellow', 'orange', 'cyan', 'pink'])},
+            },
+            'gobo': {
+                'channel': 6,
+                'type': 'static',
+                'map': {f'gobo_{i}': [i * 8, i * 8 + 7] for i in range(16)},
+            },
+            'strobe': {'channel': 7, 'invert': True},
+            'dim': {'channel': 8},
+            'speed': {'channel': 9, 'invert': True},
+            'mode': {'channel': 10, 'type': 'static', 'map': {'manual': [0, 59], 'auto': [60, 255]}},
+            'dim_mode': {'channel': 11, 'type': 'static', 'map': {'standard': [0, 100], 'reset': [101, 255]}, 'resets': [101, 255]},
+            'reset': {'channel': 12, 'type': 'boolean', 'resets': True},
+        },
+        'Initialize': {'speed': 255},
+    },
+    'SynthPar': {
+        'RawType': 'dmx',
+        'Channels': 8,
+        'Functions': {
+            'dim': {'channel': 1},
+            'red': {'channel': 2},
+            'green': {'channel': 3},
+            'blue': {'channel': 4},
+            'white': {'channel': 5},
+            'amber': {'channel': 6},
+            'uv': {'channel': 7},
+            'strobe': {'channel': 8},
+        },
+    },
+}
+
+PROGRAMS = {
+    'SynthMovingHead': [
+        {'trigger': 'onset', 'function': 'pan', 'value': 'random', 'range': 'scaled', 'scale_src': 'frequency'},
+        {'trigger': 'onset', 'function': 'tilt', 'value': 'random', 'range': 'scaled', 'scale_src': 'frequency'},
+        {'trigger': 'frequency', 'bins': [[13, 20]], 'function': 'gobo', 'value': 'random', 'threshold': 0.5},
+        {'trigger': 'frequency', 'bins': [[0, 23]], 'function': 'color', 'value': 'random', 'threshold': 0.9},
+        {'trigger': 'frequency', 'bins': [[0, 23]], 'function': 'dim', 'range': 'scaled', 'threshold': 0.15},
+    ],
+    'SynthPar': [
+        {'trigger': 'frequency', 'bins': [[0, 23]], 'function': 'dim', 'range': 'scaled', 'threshold': 0.15},
+        {'trigger': 'frequency', 'bins': [[0, 3]], 'function': 'red', 'range': 'scaled', 'threshold': 0.1, 'duration': 0.25},
+        {'trigger': 'frequency', 'bins': [[4, 12]], 'function': 'green', 'range': 'scaled', 'threshold': 0.1, 'duration': 0.25},
+        {'trigger': 'frequency', 'bins': [[13, 23]], 'function': 'blue', 'range': 'scaled', 'threshold': 0.1, 'duration': 0.25},
+        {'trigger': 'beat', 'function': 'white', 'value': 255},
+        {'trigger': 'frequency', 'bins': [[0, 23]], 'function': 'uv', 'value': 255, 'threshold': -0.1, 'duration': 0.125},
+    ],
+}
+
+STATE_EFFECTS = {
+    'SynthMovingHead': {
+        'IdleFadeout': {
+            'when': "audio['idle_for'] and audio['idle_for'] > 0.25",
+            'effects': {'dim': {'end_value': 0, 'duration': 0.5}},
+        },
+        'IdleCoast': {
+            'when': "audio['audio_v_sum'] and time.perf_counter() - max(prop_last_update.get('pan', 0), prop_last_update.get('tilt', 0)) >= 2",
+            'reset': [],
+            'effects': {'pan': {'end_value': 'random', 'duration': 5}, 'tilt': {'end_value': 'random', 'duration': 5}},
+        },
+        'DeadCoast': {
+            'when': "audio['dead_for'] and audio['dead_for'] > 2",
+            'reset': ['dim'],
+            'effects': {
+                'dim': {'end_value': 20, 'duration': 1},
+                'pan': {'end_value': 'random', 'duration': 8},
+                'tilt': {'end_value': 'random', 'duration': 8},
+            },
+        },
+    },
+    'SynthPar': {
+        'IdleFadeout': {
+            'when': "audio['idle_for'] and audio['idle_for'] > 0.25",
+            'effects': {fn: {'end_value': 0, 'duration': 0.5} for fn in ('red', 'green', 'blue', 'white', 'amber')},
+        },
+    },
+}
+
+COOLDOWN = {'pan': 0.75, 'tilt': 0.75, 'gobo': 0.25, 'color': 0.25, 'strobe': 10, 'dim': 0.125,
+            'red': 0.125, 'green': 0.125, 'blue': 0.125, 'white': 0.125, 'amber': 0.125, 'uv': 0.125}
+
+
+def generate_rig(fixtures, devices=1, group_size=4, linked=0.5, base_config=None):
+    """Build a config for a rig of fixtures spread over devices
+
+    Fixtures alternate between moving heads and pars, and come in groups of
+    group_size of the same type.  The first fixture of a group has the program,
+    of the rest a fraction linked are Links of the leader, and the others
+    reference its program by name.  Everything else (capture, processors, ...)
+    comes from base_config, config-example by default.
+    """
+    config = copy.deepcopy(base_config) if base_config else load_config(EXAMPLE_CONFIG)
+    config['DMXDevices'] = {'default': 'sink'}
+    config['DMXDevices'].update({f'dev{i}': 'sink' for i in range(1, devices)})
+    config['LightTypes'] = copy.deepcopy(LIGHT_TYPES)
+    config['Lights'] = {}
+    config['Mapping'] = {}
+
+    device_names = list(config['DMXDevices'])
+    next_address = {d: 1 for d in device_names}
+    types = list(LIGHT_TYPES)
+    for i in range(fixtures):
+        group, member = divmod(i, group_size)
+        type_name = types[group % len(types)]
+        device = device_names[i * len(device_names) // fixtures]
+        address = next_address[device]
+        next_address[device] += LIGHT_TYPES[type_name]['Channels']
+        if next_address[device] > 513:
+            raise ValueError(f"{fixtures} fixtures don't fit in {devices} DMX universe(s)")
+
+        name = f'{type_name.lower()}_{i}'
+        config['Lights'][name] = {'Type': type_name, 'Address': address, 'Device': device, 'Initialize': {'dim': 255}}
+
+        if member == 0:
+            leader = name
+            config['Mapping'][name] = {
+                'Program': copy.deepcopy(PROGRAMS[type_name]),
+                'StateEffects': copy.deepcopy(STATE_EFFECTS[type_name]),
+                'Cooldown': dict(COOLDOWN),
+                'Links': {},
+            }
+        elif member < 1 + (group_size - 1) * linked:
+            config['Mapping'][leader]['Links'][name] = {'Invert': ['pan']} if member % 2 else True
+            config['Mapping'][name] = {'StateEffects': leader, 'Cooldown': leader}
+        else:
+            config['Mapping'][name] = {'Program': leader, 'StateEffects': leader, 'Cooldown': leader}
+
+    return config
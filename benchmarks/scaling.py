@@ -0,0 +1,126 @@
+"""Frame time vs. fixture count for synthetic rigs
+
+Run from the repository root with python -m benchmarks.scaling.  For every rig
+size this simulates a run of frames on a virtual clock (so cooldowns and
+effects progress as they would live) and reports the mean and p95 time spent
+in each part of mapping and light output per frame.
+"""
+import sys
+import time
+import logging
+import argparse
+import functools
+
+import numpy as np
+
+from lib import clock
+from lib.frame import Frame
+from lib.light.models import DMXLight
+from components.lights import LightOutputTask
+from components.mapper import MapperTask
+
+from .rig import generate_rig
+
+
+STAGES = ['_run_mapping', '_run_effects', '_render_state_queue', 'send_batch', 'frame']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Report frame time vs. fixture count")
+    parser.add_argument('-f', '--fixtures', default='10,25,50,100,200,400', help="Comma separated fixture counts")
+    parser.add_argument('-d', '--devices', type=int, default=8, help="Number of DMX devices")
+    parser.add_argument('-n', '--frames', type=int, default=600, help="Frames to simulate per rig")
+    parser.add_argument('--csv', action='store_true', help="Output CSV instead of a table")
+    return parser.parse_args()
+
+
+def _timed(fn, totals, name):
+    @functools.wraps(fn)
+    def _timed_impl(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            totals[name] += time.perf_counter() - start
+    return _timed_impl
+
+
+def make_frames(config, count, seed=0):
+    """A mix of loud, quiet and silent frames, so both programs and state effects get exercised"""
+    rng = np.random.RandomState(seed)
+    frames = []
+    for i in range(count):
+        frame = Frame.from_config(config)
+        phase = (i // 120) % 4
+        if phase < 2:
+            frame.audio = rng.rand(len(frame._audio))
+            frame.is_onset = rng.rand() < 0.2
+            frame.is_beat = rng.rand() < 0.1
+        elif phase == 2:
+            frame.audio = rng.rand(len(frame._audio)) * 0.05
+            frame.idle_for = (i % 120) / 60.0
+        else:
+            frame.audio = np.zeros(len(frame._audio))
+            frame.idle_for = frame.dead_for = (i % 120) / 60.0
+        frame.audio_v_sum = float(np.sum(frame.audio))
+        frame.audio_v_avg = frame.audio_v_sum / len(frame._audio)
+        frames.append(frame)
+    return frames
+
+
+def run_rig(fixtures, devices, num_frames):
+    config = generate_rig(fixtures, devices)
+    tasks = {}
+    tasks['mapper'] = mapper = MapperTask(tasks, config)
+    tasks['lights'] = lights = LightOutputTask(tasks, config)
+    lights.setup()
+    mapper.setup()
+
+    totals = dict.fromkeys(STAGES, 0.0)
+    mapper._run_mapping = _timed(mapper._run_mapping, totals, '_run_mapping')
+    mapper._run_effects = _timed(mapper._run_effects, totals, '_run_effects')
+    lights._render_state_queue = _timed(lights._render_state_queue, totals, '_render_state_queue')
+    orig_send_batch = DMXLight.send_batch
+    DMXLight.send_batch = _timed(orig_send_batch, totals, 'send_batch')
+
+    vclock = clock.VirtualClock()
+    orig_clock = clock.get_clock()
+    clock.set_clock(vclock)
+    samples = {k: [] for k in STAGES}
+    try:
+        for frame in make_frames(config, num_frames):
+            for k in totals:
+                totals[k] = 0.0
+            start = time.perf_counter()
+            mapper.run(frame)
+            lights.run(frame)
+            totals['frame'] = time.perf_counter() - start
+            for k, v in totals.items():
+                samples[k].append(v)
+            vclock.advance(1 / config['Capture']['FPS'])
+    finally:
+        DMXLight.send_batch = orig_send_batch
+        clock.set_clock(orig_clock)
+
+    return {k: (np.mean(v), np.percentile(v, 95)) for k, v in samples.items()}
+
+
+def main(args):
+    logging.disable(logging.ERROR)
+    counts = [int(v) for v in args.fixtures.split(',')]
+    if args.csv:
+        print('fixtures,' + ','.join(f'{s}_mean_us,{s}_p95_us' for s in STAGES))
+    else:
+        print(f"{'Fixtures':>8} " + ' '.join(f'{s:>24}' for s in STAGES))
+        print(f"{'':>8} " + ' '.join(f"{'mean / p95 (us)':>24}" for s in STAGES))
+    for count in counts:
+        res = run_rig(count, args.devices, args.frames)
+        if args.csv:
+            print(f'{count},' + ','.join(f'{res[s][0] * 1e6:.1f},{res[s][1] * 1e6:.1f}' for s in STAGES))
+        else:
+            print(f'{count:>8} ' + ' '.join(f'{res[s][0] * 1e6:>11.1f} / {res[s][1] * 1e6:>10.1f}' for s in STAGES))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
@@ -0,0 +1,223 @@
+import os
+import json
+import socket
+import random
+
+import numpy as np
+
+from lib.config import load_config
+from lib.frame import Frame
+from lib.audio import fft, melbank, processor
+from lib.audio.stft import STFT
+from lib.light.models import DMXLight
+from components.lights import LightOutputTask
+from components.mapper import MapperTask
+from components.network import NetworkClient
+
+from . import benchmark
+
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'config-example', 'main.yaml')
+
+
+def example_config():
+    config = load_config(EXAMPLE_CONFIG)
+    # Never touch real hardware
+    config['DMXDevices'] = {k: 'sink' for k in config['DMXDevices']}
+    return config
+
+
+def make_tasks(config):
+    tasks = {}
+    tasks['mapper'] = MapperTask(tasks, config)
+    tasks['lights'] = LightOutputTask(tasks, config)
+    tasks['lights'].setup()
+    tasks['mapper'].setup()
+    return tasks
+
+
+def audio_hop(config, seed=0):
+    # A chord with some noise on top, at a realistic level
+    rng = np.random.RandomState(seed)
+    n = int(config['Capture']['SampleRate'] / config['Capture']['FPS'])
+    t = np.arange(n) / config['Capture']['SampleRate']
+    y = sum(np.sin(2 * np.pi * f * t) for f in (110, 220, 330, 880)) * 4000
+    y += rng.randn(n) * 500
+    return y.astype(np.float32)
+
+
+def busy_frame(config, seed=0):
+    rng = np.random.RandomState(seed)
+    frame = Frame.from_config(config)
+    frame.audio = rng.rand(len(frame._audio))
+    frame.is_onset = frame.is_beat = True
+    frame.pitch = 60.0
+    frame.audio_v_sum = float(np.sum(frame.audio))
+    frame.audio_v_avg = frame.audio_v_sum / len(frame._audio)
+    return frame
+
+
+def start_effects(lights, count, duration=1e9):
+    """Start up to count long running effects, spread over all lights and functions"""
+    targets = [(name, fn) for name, light in lights.lights.items() for fn in light.functions]
+    for name, fn in targets[:count]:
+        lights.create_effect('bench', name, {'function': fn, 'start_value': 0, 'end_value': 255, 'duration': duration})
+
+
+@benchmark('SmoothingProcessor.process')
+def bench_smoothing():
+    config = example_config()
+    proc = processor.SmoothingProcessor(config)
+    frame = Frame.from_config(config)
+    hop = audio_hop(config)
+    return lambda: proc.process(hop, frame)
+
+
+@benchmark('SmoothingProcessor.process 4 channels')
+def bench_smoothing_channels():
+    config = example_config()
+    config['Capture']['Channels'] = 4
+    proc = processor.SmoothingProcessor(config)
+    frame = Frame.from_config(config)
+    hop = np.array([audio_hop(config, seed=i) for i in range(4)])
+    return lambda: proc.process(hop, frame)
+
+
+@benchmark('SmoothingProcessor.process dense mel')
+def bench_smoothing_dense():
+    config = example_config()
+    config['Processors']['Smoothing']['MelProjection'] = 'dense'
+    proc = processor.SmoothingProcessor(config)
+    frame = Frame.from_config(config)
+    hop = audio_hop(config)
+    return lambda: proc.process(hop, frame)
+
+
+@benchmark('SmoothingProcessor.process 256 hop')
+def bench_smoothing_short_hops():
+    config = example_config()
+    config['Processors']['Smoothing'].update({'WindowLength': 1024, 'Hop': 256})
+    proc = processor.SmoothingProcessor(config)
+    frame = Frame.from_config(config)
+    hop = audio_hop(config)
+    return lambda: proc.process(hop, frame)
+
+
+def bench_fft(name):
+    def _setup():
+        stft = STFT(1470, 735, rows=3, fft_backend=name)
+        stft.push_batch(np.random.RandomState(0).randn(3, 735 * 8).astype(np.float32))
+        return lambda: stft.transform_batch(8)
+    return _setup
+
+
+for _name in fft.available_backends():
+    benchmark(f'STFT.transform_batch 8x3 {_name}')(bench_fft(_name))
+
+
+@benchmark('Catching up on 8 hops')
+def bench_catch_up():
+    config = example_config()
+    processors = processor.create_processors(config)
+    frame = Frame.from_config(config)
+    backlog = np.concatenate([audio_hop(config, seed=i) for i in range(8)])
+    def _run():
+        for p in processors:
+            p.process(backlog, frame)
+    return _run
+
+
+@benchmark('melbank.compute_melmat')
+def bench_melmat():
+    config = example_config()
+    smoothing = config['Processors']['Smoothing']
+    samples = int(config['Capture']['SampleRate'] * smoothing['RollingHistory'] / (2.0 * config['Capture']['FPS']))
+    return lambda: melbank.compute_melmat(
+        num_mel_bands=smoothing['FFTBins'],
+        freq_min=200,
+        freq_max=12000,
+        num_fft_bands=samples,
+        sample_rate=config['Capture']['SampleRate'],
+    )
+
+
+@benchmark('MapperTask._run_mapping')
+def bench_run_mapping():
+    config = example_config()
+    tasks = make_tasks(config)
+    mapper, lights = tasks['mapper'], tasks['lights']
+    frame = busy_frame(config)
+    def _run():
+        # Clear cooldowns so that every directive fires, and don't let state build up
+        mapper.prop_last_update.clear()
+        lights.state_queue = []
+        mapper._run_mapping(frame)
+    return _run
+
+
+@benchmark('LightOutputTask.run (100 effects)')
+def bench_light_output():
+    config = example_config()
+    tasks = make_tasks(config)
+    lights = tasks['lights']
+    start_effects(lights, 100)
+    frame = Frame.from_config(config)
+    def _run():
+        frame.reset()
+        lights.run(frame)
+    return _run
+
+
+@benchmark('DMXLight.send_batch')
+def bench_send_batch():
+    config = example_config()
+    lights = make_tasks(config)['lights']
+    rng = random.Random(0)
+    for light in lights.lights.values():
+        light.set_state(**{fn: rng.randint(0, 255) for fn in light.functions})
+    all_lights = list(lights.lights.values())
+    def _run():
+        for light in all_lights:
+            light.diff_state = dict(light.state)
+        DMXLight.send_batch(lights.dmx_devices, all_lights)
+    return _run
+
+
+@benchmark('NetworkClient.send')
+def bench_network_send():
+    config = example_config()
+    a, b = socket.socketpair()
+    client = NetworkClient(a, 'bench', 0)
+    msg = {'command': 'audio', 'params': {'data': busy_frame(config).to_dict()['audio']}}
+    def _run():
+        client.send(msg)
+        client.write()
+        b.recv(65536)
+    return _run
+
+
+@benchmark('NetworkClient.read')
+def bench_network_read():
+    a, b = socket.socketpair()
+    client = NetworkClient(a, 'bench', 0)
+    batch = b''.join(
+        json.dumps({'id': i, 'command': 'subscribe', 'params': {'events': ['+audio']}}).encode('utf-8') + b'\n'
+        for i in range(10)
+    )
+    def _run():
+        b.sendall(batch)
+        for _ in client.read():
+            pass
+    return _run
+
+
+@benchmark('Frame JSON encoding')
+def bench_frame_json():
+    config = example_config()
+    tasks = make_tasks(config)
+    lights = tasks['lights']
+    start_effects(lights, 50)
+    frame = busy_frame(config)
+    lights.run(frame)
+    frame.rendered_state = {name: dict(light.state) for name, light in lights.lights.items()}
+    return lambda: json.dumps(frame.to_dict())
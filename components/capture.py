@@ -1,3 +1,4 @@
+import time
 import logging
 import signal
 import threading
@@ -6,6 +7,8 @@ import json
 from lib.task import Task
 from lib.audio.input import Input
 from lib.audio import processor
+from lib.audio.analysis import AnalysisProcess
+from lib.audio.tee import AudioTee
 
 
 logger = logging.getLogger(__name__)
@@ -13,20 +16,44 @@ logger = logging.getLogger(__name__)
 
 class AudioCaptureTask(Task):
     def setup(self):
-        self.processors = [
-            processor.SmoothingProcessor(self.config),
-            processor.BeatProcessor(self.config),
-            processor.PitchProcessor(self.config),
-            processor.IdleProcessor(self.config),
-        ]
+        if self.config['Capture'].get('Process'):
+            self.analysis = AnalysisProcess(self.config)
+            self.analysis.start()
+            return
+
+        self.analysis = None
+        self.processors = processor.create_processors(self.config)
         self.capture = Input.get_input(self.config)
         self.capture.start()
+        self.tee = AudioTee.from_config(self.config)
+        if self.tee:
+            self.tee.start()
+
+    def run(self, frame):
+        if self.analysis:
+            self.analysis.read(frame)
+            return
 
-    def run(self, data):
+        start = time.perf_counter()
         res = self.capture.read()
+        self.wait_time = time.perf_counter() - start
+        if self.tee and res is not None:
+            self.tee.write(res)
+        for p in self.processors:
+            p.process(res, frame)
+
+    def set_quality(self, level):
+        if self.analysis:
+            self.analysis.set_quality(level)
+            return
+
         for p in self.processors:
-            p.process(res, data)
-        data['audio'] = list(data['audio']) if data['audio'] is not None else None
+            p.set_quality(level)
 
     def teardown(self):
-        self.capture.stop()
+        if self.analysis:
+            self.analysis.stop()
+        else:
+            self.capture.stop()
+            if self.tee:
+                self.tee.stop()
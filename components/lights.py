@@ -1,16 +1,28 @@
 import logging
 import json
 import uuid
-import time
+import threading
+import functools
 
+from lib import clock
+from lib import adaptive
 from lib.task import Task
 from lib.light.models import Light, DMXLight
-from lib.light.dmx import DMXDevice
+from lib.light.dmx import DMXDevice, DMXTrace
 
 
 logger = logging.getLogger(__name__)
 
 
+def _locked(fn):
+    # Other tasks call into the light output task, which may be running in its own thread
+    @functools.wraps(fn)
+    def _locked_impl(self, *args, **kwargs):
+        with self.lock:
+            return fn(self, *args, **kwargs)
+    return _locked_impl
+
+
 class Effect:
     def __init__(self, sender, light_name, function, start_value, end_value, duration, keep_state=False, speed_config=None, orig_speed=None):
         self.id = str(uuid.uuid4())
@@ -26,7 +38,7 @@ class Effect:
 
         self.is_new = True
         self.is_cancelled = False
-        self.start_time = time.perf_counter()
+        self.start_time = clock.perf_counter()
 
     @property
     def speed(self):
@@ -39,11 +51,11 @@ class Effect:
 
     @property
     def value(self):
-        return int(min(self.end_value, ((self.end_value - self.start_value) * ((time.perf_counter() - self.start_time) / self.duration)) + self.start_value))
+        return int(min(self.end_value, ((self.end_value - self.start_value) * ((clock.perf_counter() - self.start_time) / self.duration)) + self.start_value))
 
     @property
     def done(self):
-        return self.is_cancelled or (time.perf_counter() - self.start_time) >= self.duration
+        return self.is_cancelled or (clock.perf_counter() - self.start_time) >= self.duration
 
     @property
     def serialized(self):
@@ -75,23 +87,33 @@ class Effect:
 
 class LightOutputTask(Task):
     def setup(self):
+        self.lock = threading.RLock()
         self.lights = {}
         self.exclusive = {}
         self.effects = {}
 
         self.state_queue = []
+        # Maximum number of effects serialized into each frame, None for all of them
+        self.effects_data_limit = None
 
         for name, lconfig in self.config.get('Lights', {}).items():
             if name in self.lights:
                 raise RuntimeError(f"The light {name} is defined more than once, somehow")
             self.lights[name] = Light.create_from(self.config, name, lconfig)
 
-        self.dmx_devices = {k: DMXDevice(v) for k, v in self.config.get('DMXDevices', {}).items()}
+        trace_file = self.config.get('Render', {}).get('Trace')
+        self.trace = DMXTrace(trace_file) if trace_file else None
+        self.dmx_devices = {k: DMXDevice(v, name=k, trace=self.trace) for k, v in self.config.get('DMXDevices', {}).items()}
         if not self.dmx_devices:
             raise RuntimeError("No DMX devices are configured")
         if not self.dmx_devices.get('default'):
             raise RuntimeError("The default DMX device is not configured")
 
+    def teardown(self):
+        if self.trace:
+            self.trace.close()
+
+    @_locked
     def set_state(self, sender, light_or_name, state, suppress_errors=False):
         try:
             if isinstance(light_or_name, str):
@@ -121,6 +143,7 @@ class LightOutputTask(Task):
             return out.get(light, {})
         return out
 
+    @_locked
     def get_state(self, light_or_name, suppress_errors=False):
         try:
             if isinstance(light_or_name, str):
@@ -139,6 +162,7 @@ class LightOutputTask(Task):
             else:
                 raise
 
+    @_locked
     def create_effect(self, sender, light_name, data, override=False, suppress_errors=False):
         try:
             if not light_name or light_name not in self.lights:
@@ -190,6 +214,7 @@ class LightOutputTask(Task):
             else:
                 raise
 
+    @_locked
     def cancel_effect(self, effect=None, light=None, function=None):
         if not (effect or light):
             raise ValueError("Provide effect, or light and optional function")
@@ -208,6 +233,9 @@ class LightOutputTask(Task):
 
         new_state = {}
         for eff in effects:
+            if eff.id not in self.effects:
+                # Already cancelled, e.g. a state effect's sub-effect on a light that was reloaded
+                continue
             eff.is_cancelled = True
             if not eff.keep_state:
                 new_state.setdefault(eff.sender, {}).setdefault(eff.light_name, {})[eff.function] = eff.start_value
@@ -219,10 +247,98 @@ class LightOutputTask(Task):
             for l, s in lights.items():
                 self.set_state(sender, l, s)
 
-    def run(self, data):
+    def prepare_reload(self, config):
+        # Lights whose config and type didn't change are kept as they are, along with their effects
+        old_lights = self.config.get('Lights', {})
+        old_types = self.config.get('LightTypes', {})
+        new_types = config.get('LightTypes', {})
+        lights = {}
+        rebuilt = []
+        for name, lconfig in config.get('Lights', {}).items():
+            light = self.lights.get(name)
+            if light and lconfig == old_lights.get(name) and new_types.get(lconfig['Type']) == old_types.get(lconfig['Type']):
+                lights[name] = light
+            else:
+                lights[name] = Light.create_from(config, name, lconfig)
+                rebuilt.append(name)
+        removed = [name for name in self.lights if name not in lights]
+
+        old_devices = self.config.get('DMXDevices', {})
+        dmx_devices = {}
+        changed_devices = []
+        for k, v in config.get('DMXDevices', {}).items():
+            if k in self.dmx_devices and old_devices.get(k) == v:
+                dmx_devices[k] = self.dmx_devices[k]
+            else:
+                dmx_devices[k] = DMXDevice(v, name=k, trace=self.trace)
+                changed_devices.append(k)
+        if not dmx_devices.get('default'):
+            raise RuntimeError("The default DMX device is not configured")
+        missing = {l.device_name for l in lights.values()} - set(dmx_devices)
+        if missing:
+            raise RuntimeError(f"Lights use DMX devices that aren't configured: {', '.join(sorted(missing))}")
+
+        return {
+            'config': config,
+            'lights': lights,
+            'rebuilt': rebuilt,
+            'removed': removed,
+            'dmx_devices': dmx_devices,
+            'changed_devices': changed_devices,
+        }
+
+    @_locked
+    def apply_reload(self, plan):
+        lights = plan['lights']
+        for name in plan['rebuilt'] + plan['removed']:
+            if name in self.lights:
+                self.cancel_effect(light=name)
+        for name in plan['rebuilt']:
+            # Carry the state of functions the light still has over to the new one
+            old = self.lights.get(name)
+            if old:
+                lights[name].set_state(**{k: v for k, v in old.state.items() if k in lights[name].functions})
+        for name in plan['removed']:
+            for key in [k for k in self.exclusive if k[0] == name]:
+                del self.exclusive[key]
+        self.state_queue = [(name, state) for name, state in self.state_queue if name in lights]
+        # Anything on a new device needs sending in full
+        for light in lights.values():
+            if light.device_name in plan['changed_devices']:
+                light.diff_state = light.state.copy()
+
+        self.lights = lights
+        old_devices, self.dmx_devices = self.dmx_devices, plan['dmx_devices']
+        # New devices only open their ports when first rendered, so this is before then
+        for name, device in old_devices.items():
+            if self.dmx_devices.get(name) is not device:
+                device.close()
+        self.config = plan['config']
+        logger.info(
+            "Reloaded lights: %d rebuilt, %d removed, %d DMX devices changed",
+            len(plan['rebuilt']), len(plan['removed']), len(plan['changed_devices'])
+        )
+
+    def set_quality(self, level):
+        if level >= adaptive.CAPPED_EFFECTS:
+            self.effects_data_limit = self.config.get('Adaptive', {}).get('EffectsLimit', 16)
+        else:
+            self.effects_data_limit = None
+
+    def run(self, frame):
+        self._apply_effects(frame)
+        # The DMX write can be slow, so the lock is only held while the values are taken
+        with self.lock:
+            devices, lights = self.dmx_devices, list(self.lights.values())
+        frame.rendered_state = DMXLight.send_batch(devices, lights, lock=self.lock)
+
+    @_locked
+    def _apply_effects(self, frame):
         # Run effects first
+        limit = self.effects_data_limit
         for eff_id, eff in list(self.effects.items()):
-            data.setdefault('effects_data', {})[eff_id] = eff.serialized
+            if limit is None or len(frame.effects_data) < limit:
+                frame.effects_data[eff_id] = eff.serialized
             if eff.is_new:
                 # For new effects, set the initial value (unless speed is a factor then set the final value)
                 eff.is_new = False
@@ -280,5 +396,3 @@ class LightOutputTask(Task):
         #                     logger.error("Tried to cancel an effect w/ wrong sender")
         #                 else:
         #                     self._cancel_effect(effect=effect, explicit=True, keep_state=ev.data.get('keep_state'))
-
-        data['rendered_state'] = DMXLight.send_batch(self.dmx_devices, self.lights.values())
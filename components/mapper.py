@@ -1,14 +1,18 @@
 import random
 import logging
 import json
-import time
 import uuid
 
+from lib import clock
 from lib.task import Task
+from lib.config import resolve_mapping
 
 
 logger = logging.getLogger(__name__)
 
+# Globals for StateEffect "when" expressions, time is the show clock so that they follow a virtual clock too
+WHEN_GLOBALS = {'time': clock, 'random': random}
+
 
 class StateEffect:
     @classmethod
@@ -18,6 +22,7 @@ class StateEffect:
         StateEffectImpl.mapper = mapper
         StateEffectImpl.name = name
         StateEffectImpl.when = when
+        StateEffectImpl.when_code = compile(when, f'<StateEffect {name}>', 'eval')
         StateEffectImpl.effects = effects
         StateEffectImpl.reset = list(effects.keys()) if reset is None else reset
         StateEffectImpl.priority = index if priority is None else priority
@@ -25,7 +30,7 @@ class StateEffect:
 
     @classmethod
     def get_is_applicable(cls, audio, prop_last_update):
-        return eval(cls.when)
+        return eval(cls.when_code, WHEN_GLOBALS, {'audio': audio, 'prop_last_update': prop_last_update})
 
     def __str__(self):
         return f"StateEffect {self.name}#{self.priority} on {self.light_name}"
@@ -48,7 +53,7 @@ class StateEffect:
         for fn, props in self.effects.items():
             last_updated = (prop_last_update or {}).get(fn)
             prop_cooldown = (cooldown or {}).get(fn)
-            if last_updated is not None and prop_cooldown is not None and time.perf_counter() - last_updated < prop_cooldown:
+            if last_updated is not None and prop_cooldown is not None and clock.perf_counter() - last_updated < prop_cooldown:
                 continue
             self._mk_effect(fn, **props)
 
@@ -90,60 +95,79 @@ class MapperTask(Task):
         self.state_effects = {}
         self.applied_state_effects = {}
         self._parse_mapping(self.config)
+        # Directives can pick a capture channel by index or by one of these names
+        names = self.config.get('Capture', {}).get('ChannelNames') or []
+        self.channel_names = {name: i for i, name in enumerate(names)}
 
         self.prop_last_update = {}
 
-    def run(self, data):
-        self._run_effects(data)
-        self._run_mapping(data)
+    def run(self, frame):
+        self._run_effects(frame)
+        self._run_mapping(frame)
 
     def _parse_mapping(self, config):
-        self.mapping = config.get('Mapping', {})
+        # load_config() has usually done this already, but not for configs built some other way
+        self.mapping = resolve_mapping(config).get('Mapping') or {}
         for light, data in self.mapping.items():
-            program = data.get('Program')
-            while isinstance(program, str):
-                program = self.mapping.get(program, {}).get('Program')
-            data['Program'] = program or []
-
-            cooldown = data.get('Cooldown')
-            while isinstance(cooldown, str):
-                cooldown = self.mapping.get(cooldown, {}).get('Cooldown')
-            data['Cooldown'] = cooldown or {}
-
-            state_effects = data.get('StateEffects')
-            while isinstance(state_effects, str):
-                state_effects = self.mapping.get(state_effects, {}).get('StateEffects')
-            data['StateEffects'] = state_effects or {}
-
-            def make_bins(bins):
-                for b in bins:
-                    try:
-                        iter(b)
-                        yield from range(b[0], b[1] + 1)
-                    except:
-                        yield b
-            for directive in data['Program']:
-                if directive.get('bins'):
-                    directive['bins'] = list(make_bins(directive['bins']))
-
-            self.state_effects.setdefault(light, [])
-            for i, (k, v) in enumerate(data['StateEffects'].items()):
-                self.state_effects[light].append(StateEffect.define(
-                    self,
-                    i,
-                    k,
-                    **v
-                ))
-            self.state_effects[light] = list(sorted(self.state_effects[light], key=lambda v: v.priority, reverse=True))
-
-    def _run_effects(self, data):
+            self.state_effects[light] = self._define_state_effects(data)
+
+    def _define_state_effects(self, data):
+        state_effects = []
+        for i, (k, v) in enumerate(data['StateEffects'].items()):
+            state_effects.append(StateEffect.define(
+                self,
+                i,
+                k,
+                **v
+            ))
+        return list(sorted(state_effects, key=lambda v: v.priority, reverse=True))
+
+    def prepare_reload(self, config):
+        # Programs and cooldowns are just looked up every frame, only changed state effects need rebuilding
+        mapping = resolve_mapping(config).get('Mapping') or {}
+        state_effects = {}
+        changed = []
+        for light, data in mapping.items():
+            old = self.mapping.get(light)
+            if old is not None and old['StateEffects'] == data['StateEffects']:
+                state_effects[light] = self.state_effects.get(light, [])
+            else:
+                state_effects[light] = self._define_state_effects(data)
+                changed.append(light)
+        removed = [light for light in self.mapping if light not in mapping]
+        return {
+            'config': config,
+            'mapping': mapping,
+            'state_effects': state_effects,
+            'changed': changed,
+            'removed': removed,
+        }
+
+    def apply_reload(self, plan):
+        for light in plan['changed'] + plan['removed']:
+            applied_effect = self.applied_state_effects.pop(light, None)
+            if applied_effect:
+                logger.debug("Unapply - reloaded %s", applied_effect)
+                applied_effect.unapply()
+        for light in plan['removed']:
+            self.prop_last_update.pop(light, None)
+
+        self.mapping = plan['mapping']
+        self.state_effects = plan['state_effects']
+        self.config = plan['config']
+        logger.info(
+            "Reloaded mapping: state effects of %d lights rebuilt, %d lights removed",
+            len(plan['changed']), len(plan['removed'])
+        )
+
+    def _run_effects(self, frame):
         for light, s_eff_set in self.state_effects.items():
             prop_last_update = self.prop_last_update.setdefault(light, {})
             # Find the state effect that's applicable to this light right now
             applied_effect = self.applied_state_effects.get(light)
             applicable_effect = None
             for eff in s_eff_set:
-                if eff.get_is_applicable(data, prop_last_update):
+                if eff.get_is_applicable(frame, prop_last_update):
                     if applied_effect and applied_effect.priority > eff.priority:
                         # Ignore lower priority effects
                         continue
@@ -185,7 +209,7 @@ class MapperTask(Task):
 
             if applied_effect:
                 for p in applied_effect.affected_functions:
-                    prop_last_update[p] = time.perf_counter()
+                    prop_last_update[p] = clock.perf_counter()
 
     def _set_state_or_create_effect(self, durations, light_name, state):
         if state:
@@ -203,7 +227,10 @@ class MapperTask(Task):
             if state:
                 self.tasks['lights'].set_state('mapper', light_name, state, suppress_errors=True)
 
-    def _run_mapping(self, data):
+    def _run_mapping(self, frame):
+        # Only the bins a directive looks at are turned into Python floats
+        audio = frame.audio if frame.has_audio else None
+        channel_audio = frame.channel_audio if frame.has_channel_audio else None
         for light_name, mapping in self.mapping.items():
             state = {}
             durations = {}
@@ -215,8 +242,8 @@ class MapperTask(Task):
                 self.prop_last_update \
                     .setdefault(light_name, {}) \
                     .setdefault(directive['function'], -10000)
-                # print(light_name, directive['function'], "last @", self.prop_last_update[light_name][directive['function']], ", now", time.perf_counter(), ", cooldown", mapping.get('Cooldown', {}).get(directive['function'], 0))
-                if time.perf_counter() - self.prop_last_update[light_name][directive['function']] < mapping.get('Cooldown', {}).get(directive['function'], 1):
+                # print(light_name, directive['function'], "last @", self.prop_last_update[light_name][directive['function']], ", now", clock.perf_counter(), ", cooldown", mapping.get('Cooldown', {}).get(directive['function'], 0))
+                if clock.perf_counter() - self.prop_last_update[light_name][directive['function']] < mapping.get('Cooldown', {}).get(directive['function'], 1):
                     continue
 
                 trigger_value = None
@@ -231,10 +258,24 @@ class MapperTask(Task):
                 freq_agg = None
                 freq_peak = None
                 if trigger == 'frequency' or scale_src == 'frequency':
-                    if not data.get('audio'):
+                    if audio is None:
                         continue
+                    spectrum = audio
+                    channel = directive.get('channel')
+                    if channel is not None:
+                        index = self.channel_names.get(channel, channel)
+                        if channel_audio is None:
+                            # Mono capture, channel 0 is all there is
+                            spectrum = audio if index == 0 else None
+                        elif isinstance(index, int) and 0 <= index < len(channel_audio):
+                            spectrum = channel_audio[index]
+                        else:
+                            spectrum = None
+                        if spectrum is None:
+                            logger.error("Invalid channel %s in directive %s for light %s", channel, directive, light_name)
+                            continue
                     try:
-                        bins = [data['audio'][i] for i in directive['bins']] if directive.get('bins') else data['audio']
+                        bins = spectrum[directive['bins']].tolist() if directive.get('bins') else spectrum.tolist()
                     except IndexError as e:
                         logger.error("Invalid bin %s in directive %s for light %s", e, directive, light_name)
                         continue
@@ -248,13 +289,12 @@ class MapperTask(Task):
                         continue
                     freq_peak = 1 - (bins.index(max(bins)) / len(bins))
 
-
                 if trigger == 'onset':
-                    if not data.get('is_onset'):
+                    if not frame.is_onset:
                         continue
                     trigger_value = 1
                 elif trigger == 'beat':
-                    if not data.get('is_beat'):
+                    if not frame.is_beat:
                         continue
                     trigger_value = 1
                 elif trigger == 'frequency':
@@ -298,7 +338,7 @@ class MapperTask(Task):
                 if directive.get('duration'):
                     durations[directive['function']] = (directive['duration'], directive.get('keep_state', True))
                 state[directive['function']] = value
-                self.prop_last_update[light_name][directive['function']] = time.perf_counter()
+                self.prop_last_update[light_name][directive['function']] = clock.perf_counter()
 
             if state:
                 self._set_state_or_create_effect(durations, light_name, state)
@@ -8,6 +8,8 @@ import select
 import time
 
 from lib.task import Task
+from lib.stats import timings
+from lib.profiler import profiler
 # from lib.light.models import Light, DMXLight
 # from lib.light.dmx import DMXDevice
 
@@ -17,6 +19,7 @@ logger = logging.getLogger(__name__)
 E_UNICODE = 1, "Your last command contained invalid UTF-8 data"
 E_JSON = 2, "Your last command contained invalid JSON"
 E_CMD = 3, "Invalid command"
+E_PROFILE = 4, "Can't start profiling"
 
 
 class ClientExited(Exception):
@@ -150,14 +153,25 @@ class NetworkThread(threading.Thread):
             cl.subscriptions = ((to_set or cl.subscriptions) + to_add) - to_del
         return {'events': list(cl.subscriptions)}
 
+    def cmd_stats(self, cl, **kwargs):
+        return timings.snapshot()
+
+    def cmd_profile(self, cl, frames=None, mode=None, _raw=None, **kwargs):
+        if frames is None:
+            return profiler.status()
+        try:
+            return profiler.request(frames, mode)
+        except (ValueError, RuntimeError) as e:
+            cl.send_error(*E_PROFILE, msgid=_raw.get('id'), reason=str(e))
+
 
 class NetworkTask(Task):
     def setup(self):
         self.thread = NetworkThread(self.config)
         self.thread.start()
 
-    def run(self, data):
-        self.thread.data_queue.put(data)
+    def run(self, frame):
+        self.thread.data_queue.put(frame.to_dict())
 
     def teardown(self):
         self.thread.stop_event.set()
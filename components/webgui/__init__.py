@@ -23,9 +23,12 @@ class WebGUITask(Task):
         self.thread = threading.Thread(target=self._run_server)
         self.thread.start()
 
-    def run(self, data):
-        for q in self.data_queues:
-            q.put(data)
+    def run(self, frame):
+        # The frame is reused, so the server threads get a snapshot of it
+        if self.data_queues:
+            data = frame.to_dict()
+            for q in self.data_queues:
+                q.put(data)
 
     def _run_server(self):
         self.httpd = ThreadingHTTPServer(('', 8000), self.app_class)
@@ -4,6 +4,10 @@ import queue
 import json
 import os
 import mimetypes
+import urllib.parse
+
+from lib.stats import timings
+from lib.profiler import profiler
 
 
 class AppClass(BaseHTTPRequestHandler):
@@ -31,7 +35,9 @@ class AppClass(BaseHTTPRequestHandler):
 
 
     def dispatch(self, method):
-        fn = getattr(self, method + '_' + self.path.strip('/').replace('/', '_'), None)
+        path, _, query = self.path.partition('?')
+        self.query = dict(urllib.parse.parse_qsl(query))
+        fn = getattr(self, method + '_' + path.strip('/').replace('/', '_'), None)
         if fn is None:
             self.send_error(404)
             return
@@ -74,6 +80,27 @@ class AppClass(BaseHTTPRequestHandler):
         self.wfile.write(json.dumps(out).encode('utf-8'))
         self.wfile.flush()
 
+    def _send_json(self, data, code=200):
+        out = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+        self.wfile.flush()
+
+    def GET_stats(self):
+        self._send_json(timings.snapshot())
+
+    def GET_profile(self):
+        if 'frames' not in self.query:
+            self._send_json(profiler.status())
+            return
+        try:
+            self._send_json(profiler.request(self.query['frames'], self.query.get('mode')))
+        except (ValueError, RuntimeError) as e:
+            self._send_json({'error': str(e)}, code=409)
+
     def GET_js(self):
         out = ''
         rjs = ''
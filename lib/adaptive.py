@@ -0,0 +1,117 @@
+"""Trading analysis and output quality for frame time
+
+When frames keep running over their budget the QualityController steps the
+quality level down, one level at a time, and each level turns off or thins out
+one more piece of expensive work.  Once frames are comfortably inside the
+budget again it steps back up.  Tasks find out about the level through
+set_quality(), which is only ever called from the thread that runs the task.
+"""
+import time
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger(__name__)
+
+
+FULL = 0
+# Pitch isn't used by any mapping directive, so it's the first to go
+NO_PITCH = 1
+# aubio tempo runs on two hops at once, every other frame
+HALF_RATE_TEMPO = 2
+# The FFT covers one hop instead of RollingHistory hops
+SHORT_FFT = 3
+# Only a limited number of effects are serialized into effects_data
+CAPPED_EFFECTS = 4
+
+LEVELS = {
+    FULL: 'full quality',
+    NO_PITCH: 'pitch detection off',
+    HALF_RATE_TEMPO: 'tempo detection at half rate',
+    SHORT_FFT: 'shorter FFT window',
+    CAPPED_EFFECTS: 'effect serialization capped',
+}
+
+
+class QualityController:
+    """Steps the quality level down under load and back up with headroom
+
+    update() is given the time spent working in each frame (not counting the
+    time spent sleeping until the next one, or blocked waiting for audio).  Once more than overrun_fraction
+    of the last window frames took longer than high * budget, quality steps
+    down; once a full up_window frames in a row took less than low * budget,
+    it steps up.  In a pipeline every stage reports its own frames, each
+    against the whole budget.  Both windows start over after every step, so a
+    step has a chance to take effect before the next one.  Every step is
+    logged and kept in history as (time, from level, to level, reason).
+    """
+    def __init__(self, budget, window=30, up_window=300, high=0.9, low=0.5, overrun_fraction=0.2, max_level=CAPPED_EFFECTS):
+        self.budget = budget
+        self.window = window
+        self.up_window = up_window
+        self.high = high
+        self.low = low
+        self.overrun_fraction = overrun_fraction
+        self.max_level = min(max_level, max(LEVELS))
+        self.lock = threading.Lock()
+        self.level = FULL
+        self.applied = {}
+        self.history = []
+        self.recent = collections.deque(maxlen=window)
+        self.overruns = 0
+        self.quiet = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a controller from the Adaptive config section, or None if it's not enabled"""
+        aconfig = config.get('Adaptive', {})
+        if not aconfig.get('Enabled'):
+            return None
+        return cls(
+            1.0 / config['Capture']['FPS'],
+            window=aconfig.get('Window', 30),
+            up_window=aconfig.get('UpWindow', 300),
+            high=aconfig.get('High', 0.9),
+            low=aconfig.get('Low', 0.5),
+            overrun_fraction=aconfig.get('OverrunFraction', 0.2),
+            max_level=aconfig.get('MaxLevel', CAPPED_EFFECTS),
+        )
+
+    def update(self, elapsed):
+        # Stages of a pipeline each report their own frames
+        with self.lock:
+            self._update(elapsed)
+
+    def _update(self, elapsed):
+        over = elapsed > self.budget * self.high
+        if len(self.recent) == self.recent.maxlen and self.recent[0]:
+            self.overruns -= 1
+        self.recent.append(over)
+        self.overruns += over
+        self.quiet = self.quiet + 1 if elapsed < self.budget * self.low else 0
+
+        if self.overruns > self.overrun_fraction * self.window and self.level < self.max_level:
+            self._step(self.level + 1, f"{self.overruns} of the last {len(self.recent)} frames over {self.high:.0%} of the budget")
+        elif self.quiet >= self.up_window and self.level > FULL:
+            self._step(self.level - 1, f"{self.quiet} frames under {self.low:.0%} of the budget")
+
+    def _step(self, level, reason):
+        entry = (time.time(), self.level, level, reason)
+        self.history.append(entry)
+        logger.warning(
+            "Quality %s from level %d to %d (%s) at %s: %s",
+            'down' if level > self.level else 'up', self.level, level, LEVELS[level],
+            time.strftime('%H:%M:%S', time.localtime(entry[0])), reason
+        )
+        self.level = level
+        self.recent.clear()
+        self.overruns = 0
+        self.quiet = 0
+
+    def sync(self, task):
+        """Tell task about the current level if it hasn't seen it yet"""
+        level = self.level
+        if self.applied.get(task) != level:
+            self.applied[task] = level
+            task.set_quality(level)
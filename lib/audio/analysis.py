@@ -0,0 +1,243 @@
+"""Audio analysis in a child process
+
+The capture input and processors run in their own process so that the FFT and
+aubio work doesn't compete with the rest of the application for the GIL.  Each
+frame's features are published to a ring of slots in shared memory, and the
+parent just picks up the newest one.
+"""
+import time
+import zlib
+import logging
+import signal
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+# Feature keys published by the processors, other than the spectrum itself
+# Floats use NaN and flags use -1 for None
+FEATURES = [
+    ('is_onset', 'i1'),
+    ('is_beat', 'i1'),
+    ('pitch', 'f8'),
+    ('idle_for', 'f8'),
+    ('dead_for', 'f8'),
+    ('audio_v_sum', 'f8'),
+    ('audio_v_avg', 'f8'),
+]
+
+
+class FeatureRing:
+    """Ring of feature slots in shared memory, with one writer and one reader
+
+    Every slot carries the sequence number of the frame in it.  The writer
+    clears that before touching the slot and sets it once done, and the header
+    holds the sequence number of the newest complete slot, followed by the
+    quality level the reader wants the writer to run at.  A reader that
+    finds the slot's sequence number changed while it was copying it (because
+    the writer lapped the ring) simply retries with the newer frame.
+
+    Python has no memory barriers to put around the sequence numbers, and on
+    a weakly ordered CPU like the ARM boards this runs on, the reader can see
+    the new sequence number before all of the data written ahead of it.  So
+    each slot also carries a CRC of its data, and a copy that doesn't match
+    its CRC is retried like one whose sequence number changed.
+    """
+    # The sequence number and CRC come first, the CRC covers the rest
+    HEADER_SIZE = 12
+
+    def __init__(self, fft_bins, size=8, name=None, channels=1):
+        self.slot_dtype = np.dtype([
+            ('seq', 'u8'),
+            ('crc', 'u4'),
+            ('has_audio', '?'),
+            ('audio', 'f8', (fft_bins,)),
+        ] + ([('channel_audio', 'f8', (channels, fft_bins))] if channels > 1 else []) + FEATURES)
+        self.channels = channels
+        self.size = size
+        nbytes = 64 + self.slot_dtype.itemsize * size
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.header = np.ndarray((2,), dtype='u8', buffer=self.shm.buf)
+        self.slots = np.ndarray((size,), dtype=self.slot_dtype, buffer=self.shm.buf, offset=64)
+        self.slot_data = self.slots.view(np.uint8).reshape(size, -1)[:, self.HEADER_SIZE:]
+        if self.owner:
+            self.header[:] = 0
+            self.slots['seq'] = 0
+        self.last_seq = 0
+        # Copies that had to be retried
+        self.retries = 0
+        self.scratch = np.zeros((), dtype=self.slot_dtype)
+        self.scratch_data = self.scratch.reshape(1).view(np.uint8)[self.HEADER_SIZE:]
+
+    def write(self, frame):
+        seq = int(self.header[0]) + 1
+        index = seq % self.size
+        slot = self.slots[index]
+        slot['seq'] = 0
+        slot['has_audio'] = frame.has_audio
+        if frame.has_audio:
+            slot['audio'] = frame.audio
+            if self.channels > 1:
+                slot['channel_audio'] = frame.channel_audio
+        for key, dtype in FEATURES:
+            value = getattr(frame, key)
+            if value is None:
+                value = -1 if dtype == 'i1' else np.nan
+            slot[key] = value
+        slot['crc'] = zlib.crc32(self.slot_data[index])
+        slot['seq'] = seq
+        self.header[0] = seq
+
+    @property
+    def quality(self):
+        return int(self.header[1])
+
+    @quality.setter
+    def quality(self, level):
+        self.header[1] = level
+
+    def clear(self, frame):
+        frame.audio = None
+        for key, _ in FEATURES:
+            setattr(frame, key, None)
+
+    def read(self, frame):
+        """Update frame with the newest one in the ring
+
+        Returns the number of frames skipped over to get to it, or None if
+        there's no new frame (and frame is left as is).
+        """
+        while True:
+            seq = int(self.header[0])
+            if seq == self.last_seq:
+                return None
+            slot = self.slots[seq % self.size]
+            self.scratch[...] = slot
+            if slot['seq'] == seq and self.scratch['seq'] == seq and zlib.crc32(self.scratch_data) == self.scratch['crc']:
+                break
+            self.retries += 1
+
+        dropped = seq - self.last_seq - 1
+        self.last_seq = seq
+        frame.audio = self.scratch['audio'] if self.scratch['has_audio'] else None
+        if self.channels > 1 and self.scratch['has_audio']:
+            frame.channel_audio = self.scratch['channel_audio']
+        for key, dtype in FEATURES:
+            value = self.scratch[key].item()
+            if dtype == 'i1':
+                value = None if value < 0 else bool(value)
+            elif value != value:
+                value = None
+            setattr(frame, key, value)
+        return dropped
+
+    def close(self):
+        # Drop the views onto the buffer first or it can't be closed
+        self.header = self.slots = self.slot_data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _analysis_main(config, ring_name, fft_bins, ring_size, channels, stop_event):
+    # The parent handles signals and tells us when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Nothing else runs here, so inputs that can wait for audio should rather than have this loop spin
+    config['Capture'].setdefault('ReadTimeout', 1.0 / config['Capture']['FPS'])
+    from .input import Input
+    from .processor import create_processors
+    from .tee import AudioTee
+    from lib.frame import Frame
+
+    processors = create_processors(config)
+    ring = FeatureRing(fft_bins, size=ring_size, name=ring_name, channels=channels)
+    frame = Frame(fft_bins, channels)
+    quality = 0
+    tee = AudioTee.from_config(config)
+    if tee:
+        tee.start()
+    try:
+        with Input.get_input(config) as capture:
+            while not stop_event.is_set():
+                res = capture.read()
+                if res is None:
+                    if capture.finished:
+                        # A file that's run out, there's nothing more to analyse
+                        logger.info("Audio input finished, waiting to be stopped")
+                        stop_event.wait()
+                        break
+                    continue
+                if tee:
+                    tee.write(res)
+                if ring.quality != quality:
+                    quality = ring.quality
+                    for p in processors:
+                        p.set_quality(quality)
+                frame.reset()
+                for p in processors:
+                    p.process(res, frame)
+                ring.write(frame)
+    finally:
+        if tee:
+            tee.stop()
+        ring.close()
+
+
+class AnalysisProcess:
+    def __init__(self, config):
+        self.config = config
+        capconfig = config['Capture']
+        fft_bins = config.get('Processors', {}).get('Smoothing', {}).get('FFTBins', 24)
+        ring_size = capconfig.get('RingSize', 8)
+        channels = capconfig.get('Channels', 1)
+        self.ring = FeatureRing(fft_bins, size=ring_size, channels=channels)
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=_analysis_main,
+            args=(config, self.ring.name, fft_bins, ring_size, channels, self.stop_event),
+            name='AudioAnalysis',
+            daemon=True,
+        )
+        self.dropped = 0
+        self.logged_dropped = 0
+        self.prev_drop_time = 0
+        self.exit_logged = False
+
+    def start(self):
+        self.process.start()
+
+    def read(self, frame):
+        res = self.ring.read(frame)
+        if res is None:
+            # Nothing new, same as a capture that returned no data
+            self.ring.clear(frame)
+            if not self.exit_logged and not self.process.is_alive():
+                self.exit_logged = True
+                logger.error("The audio analysis process has exited (code %s)", self.process.exitcode)
+            return
+        self.dropped += res
+        if self.dropped != self.logged_dropped and time.time() > self.prev_drop_time + 1:
+            self.prev_drop_time = time.time()
+            self.logged_dropped = self.dropped
+            logger.warning("Audio analysis has skipped %d frames, the main loop isn't keeping up", self.dropped)
+
+    def set_quality(self, level):
+        self.ring.quality = level
+
+    def stop(self):
+        self.stop_event.set()
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.ring.close()
@@ -1,8 +1,14 @@
 from __future__ import print_function
+import os
+import logging
+
 import numpy as np
 from . import melbank
 
 
+logger = logging.getLogger(__name__)
+
+
 class ExpFilter:
     """Simple exponential smoothing filter"""
     def __init__(self, val=0.0, alpha_decay=0.5, alpha_rise=0.5):
@@ -12,9 +18,12 @@ class ExpFilter:
         self.alpha_decay = alpha_decay
         self.alpha_rise = alpha_rise
         self.value = val
+        self._alpha = self._rest = self._rising = None
 
     def update(self, value):
-        if isinstance(self.value, (list, np.ndarray, tuple)):
+        if isinstance(self.value, np.ndarray):
+            return self._update_array(value)
+        if isinstance(self.value, (list, tuple)):
             alpha = value - self.value
             alpha[alpha > 0.0] = self.alpha_rise
             alpha[alpha <= 0.0] = self.alpha_decay
@@ -23,6 +32,23 @@ class ExpFilter:
         self.value = alpha * value + (1.0 - alpha) * self.value
         return self.value
 
+    def _update_array(self, value):
+        # The same sums as update(), but in place, so that self.value is updated rather than replaced
+        if self._alpha is None or self._alpha.shape != self.value.shape:
+            self._alpha = np.empty_like(self.value)
+            self._rest = np.empty_like(self.value)
+            self._rising = np.empty(self.value.shape, dtype=bool)
+        alpha, rest = self._alpha, self._rest
+        np.subtract(value, self.value, out=alpha)
+        np.greater(alpha, 0.0, out=self._rising)
+        alpha.fill(self.alpha_decay)
+        np.copyto(alpha, self.alpha_rise, where=self._rising)
+        np.subtract(1.0, alpha, out=rest)
+        rest *= self.value
+        alpha *= value
+        np.add(alpha, rest, out=self.value)
+        return self.value
+
 
 # def rfft(data, window=None):
 #     window = 1.0 if window is None else window(len(data))
@@ -38,12 +64,67 @@ class ExpFilter:
 #     return xs, ys
 
 
-def create_mel_bank(sample_rate, rolling_history, fps, fft_bins, min_freq, max_freq):
-    global samples, mel_y, mel_x
+# Bump this whenever compute_melmat's results change, files saved by an older version are then ignored
+MEL_CACHE_VERSION = 1
+
+# Mel banks already built, by (sample_rate, num_fft_bands, fft_bins, min_freq, max_freq)
+_mel_banks = {}
+
+
+def create_mel_bank(sample_rate, rolling_history, fps, fft_bins, min_freq, max_freq, cache_dir=None):
+    """The mel matrix and FFT bin frequencies for analysing rolling_history hops"""
     samples = int(sample_rate * rolling_history / (2.0 * fps))
-    mel_y, (_, mel_x) = melbank.compute_melmat(num_mel_bands=fft_bins,
-                                               freq_min=min_freq,
-                                               freq_max=max_freq,
-                                               num_fft_bands=samples,
-                                               sample_rate=sample_rate)
-    return mel_y, mel_x
+    return get_mel_bank(sample_rate, samples, fft_bins, min_freq, max_freq, cache_dir=cache_dir)
+
+
+def get_mel_bank(sample_rate, num_fft_bands, fft_bins, min_freq, max_freq, cache_dir=None):
+    """The mel matrix and FFT bin frequencies for num_fft_bands bands
+
+    Banks are built once per set of parameters and shared, so the arrays
+    returned are read only.  With a cache_dir they're also saved there, to
+    be loaded rather than built next time.
+    """
+    key = (sample_rate, num_fft_bands, fft_bins, min_freq, max_freq)
+    mel_bank = _mel_banks.get(key)
+    if mel_bank is None:
+        cache_file = _mel_cache_filename(cache_dir, key) if cache_dir else None
+        mel_bank = _read_mel_cache(cache_file) if cache_file else None
+        if mel_bank is None:
+            mel_y, (_, mel_x) = melbank.compute_melmat(num_mel_bands=fft_bins,
+                                                       freq_min=min_freq,
+                                                       freq_max=max_freq,
+                                                       num_fft_bands=num_fft_bands,
+                                                       sample_rate=sample_rate)
+            mel_bank = (mel_y, mel_x)
+            if cache_file:
+                _write_mel_cache(cache_file, mel_bank)
+        for array in mel_bank:
+            array.flags.writeable = False
+        _mel_banks[key] = mel_bank
+    return mel_bank
+
+
+def _mel_cache_filename(cache_dir, key):
+    return os.path.join(cache_dir, 'melbank-v%d-%s.npz' % (MEL_CACHE_VERSION, '-'.join(str(k) for k in key)))
+
+
+def _read_mel_cache(cache_file):
+    try:
+        with np.load(cache_file) as cached:
+            return cached['mel_y'], cached['mel_x']
+    except FileNotFoundError:
+        return None
+    except:
+        logger.debug("Ignoring unreadable mel bank cache %s", cache_file, exc_info=True)
+        return None
+
+
+def _write_mel_cache(cache_file, mel_bank):
+    try:
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.npz'
+        np.savez(tmp_file, mel_y=mel_bank[0], mel_x=mel_bank[1])
+        os.replace(tmp_file, cache_file)
+    except:
+        # Not being able to cache shouldn't stop anything from starting
+        logger.warning("Failed to write the mel bank cache %s", cache_file, exc_info=True)
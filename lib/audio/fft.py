@@ -0,0 +1,133 @@
+"""FFT backends for the analysis
+
+The real FFT of a fixed pair of input and output buffers is planned once,
+and the plan then runs every frame.  numpy is always there and gives the
+spectra everything has been tuned against.  scipy.fft can split the rows
+over several workers, though it allocates its output every time, and
+pyFFTW (if it's installed) measures the fastest way to do the transform on
+this host, which makes the biggest difference on small ARM boards.  'auto'
+times each of them on the shape actually used and picks the fastest.
+"""
+import time
+import logging
+import functools
+
+import numpy as np
+import scipy.fft
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+
+logger = logging.getLogger(__name__)
+
+# Backend chosen by 'auto', by (shape, workers)
+_chosen = {}
+
+
+class FFTBackend:
+    """Does real FFTs, picked by NAME
+
+    Each backend has a plan(fft_in, fft_out), returning a function that puts
+    the real FFT of fft_in along its last axis into fft_out.  fft_in is
+    float32 and fft_out complex64, one bin longer than half of it.
+    """
+    NAME = None
+
+    @classmethod
+    def get_backend(cls, name, workers=1):
+        for tcls in cls.__subclasses__():
+            if tcls.NAME == name:
+                return tcls(workers)
+        raise RuntimeError(f"No such FFT backend {name}")
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def __init__(self, workers=1):
+        self.workers = workers
+
+    def zeros(self, shape, dtype):
+        """A buffer suited to this backend"""
+        return np.zeros(shape, dtype=dtype)
+
+
+class NumpyFFT(FFTBackend):
+    NAME = 'numpy'
+
+    def plan(self, fft_in, fft_out):
+        return functools.partial(np.fft.rfft, fft_in, axis=-1, out=fft_out)
+
+
+class ScipyFFT(FFTBackend):
+    """scipy.fft, with the rows split over workers threads
+
+    scipy.fft can't write into an array it's given, so unlike the others this
+    allocates its result every call, then copies it into fft_out.  It can
+    still come out faster than numpy, which auto will find out.
+    """
+    NAME = 'scipy'
+
+    def plan(self, fft_in, fft_out):
+        def _run():
+            np.copyto(fft_out, scipy.fft.rfft(fft_in, axis=-1, workers=self.workers))
+        return _run
+
+
+class PyFFTWFFT(FFTBackend):
+    """FFTW, through pyFFTW, with aligned buffers and a measured plan"""
+    NAME = 'pyfftw'
+
+    @classmethod
+    def available(cls):
+        return pyfftw is not None
+
+    def __init__(self, workers=1):
+        if not self.available():
+            raise RuntimeError("pyFFTW is not installed")
+        super().__init__(workers)
+
+    def zeros(self, shape, dtype):
+        return pyfftw.zeros_aligned(shape, dtype=dtype)
+
+    def plan(self, fft_in, fft_out):
+        # Measuring tries the transform out on the buffers, so put back what was in them
+        saved = fft_in.copy()
+        fftw = pyfftw.FFTW(fft_in, fft_out, axes=(-1,), threads=self.workers, flags=('FFTW_MEASURE',))
+        fft_in[:] = saved
+        return fftw.execute
+
+
+def available_backends():
+    return [tcls.NAME for tcls in FFTBackend.__subclasses__() if tcls.available()]
+
+
+def choose_backend(shape, workers=1, repeat=20):
+    """The name of the backend that's fastest here for float32 input of shape"""
+    key = (tuple(shape), workers)
+    if key not in _chosen:
+        times = {}
+        for name in available_backends():
+            try:
+                backend = FFTBackend.get_backend(name, workers)
+                fft_in = backend.zeros(shape, np.float32)
+                fft_out = backend.zeros(shape[:-1] + (shape[-1] // 2 + 1,), np.complex64)
+                fft_in[:] = np.random.rand(*shape)
+                run = backend.plan(fft_in, fft_out)
+                run()
+                best = None
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    run()
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                times[name] = best
+            except:
+                logger.warning("Failed to try the %s FFT backend", name, exc_info=True)
+        _chosen[key] = min(times, key=times.get) if times else 'numpy'
+        logger.info("Using the %s FFT backend for %s (%s)", _chosen[key], 'x'.join(str(s) for s in shape),
+                    ', '.join(f'{name} {t * 1e6:.1f}us' for name, t in sorted(times.items(), key=lambda i: i[1])))
+    return _chosen[key]
@@ -1,8 +1,21 @@
+import os
 import sys
+import mmap
+import stat
 import time
+import wave
+import errno
+import select
+import socket
+import struct
+import logging
+import threading
 
 import numpy as np
 
+from .ring import SampleRing
+from .net import HEADER, MAGIC, MAX_FRAMES, JitterBuffer, parse_address
+
 try:
     import pyaudio
 except ImportError:
@@ -14,8 +27,13 @@ except ImportError:
     pass
 
 
+logger = logging.getLogger(__name__)
+
+
 class Input:
     NAME = None
+    # Set by inputs that can run out of audio (like files) once they have
+    finished = False
 
     @classmethod
     def get_input(cls, config):
@@ -28,6 +46,12 @@ class Input:
     def __init__(self, config):
         self.config = config['Capture']
         self.frames_per_buffer = int(self.config['SampleRate'] / self.config['FPS'])
+        # read() returns (frames,) hops for one channel, (channels, frames) for more,
+        # or several hops end to end, (hops * frames,) or (channels, hops * frames)
+        self.channels = self.config.get('Channels', 1)
+        # Inputs that buffer audio return up to this many hops end to end, everything
+        # that arrived since the last read, rather than dropping all but the newest
+        self.catch_up = self.config.get('CatchUp', self.config.get('RingBlocks', 16))
 
     def _get_device_index(self, valid_input_devices):
         in_device = self.config['Device']
@@ -76,6 +100,18 @@ class Input:
 
 
 class PyAudioInput(Input):
+    """Captures from a PortAudio device
+
+    By default PortAudio calls back with each hop, which is written straight
+    into a SampleRing, and read() returns the hops from the ring that haven't
+    been read yet, up to Capture.CatchUp of them end to end - after waiting up
+    to Capture.ReadTimeout seconds for one if there isn't one yet, 0 meaning
+    don't wait at all.  Capture.PyAudioMode: blocking reads from the stream on
+    the calling thread instead.
+
+    Hops are timestamped from PortAudio's ADC time for the buffer, where the
+    host API gives one, rather than when the callback happened to run.
+    """
     NAME = 'pyaudio'
 
     def __init__(self, config):
@@ -85,6 +121,9 @@ class PyAudioInput(Input):
             raise RuntimeError("PyAudio is not installed")
         super().__init__(config)
         self.pa = pyaudio.PyAudio()
+        self.callback = self.config.get('PyAudioMode', 'callback') == 'callback'
+        self.read_timeout = self.config.get('ReadTimeout', 0)
+        self.ring = SampleRing(self.frames_per_buffer, size=self.config.get('RingBlocks', 16), channels=self.channels)
 
     def get_device_index(self):
         valid_input_devices = {}
@@ -98,24 +137,55 @@ class PyAudioInput(Input):
 
     def start(self):
         device_num = self.get_device_index()
+        # The callback can come before open() returns
+        self.overflows = 0
+        self.logged_overflows = 0
+        self.prev_ovf_time = time.time()
         self.stream = self.pa.open(
             format=pyaudio.paInt16,
-            channels=1,
+            channels=self.channels,
             rate=self.config['SampleRate'],
             input=True,
             frames_per_buffer=self.frames_per_buffer,
-            input_device_index=device_num
+            input_device_index=device_num,
+            stream_callback=self._callback if self.callback else None,
         )
-        self.overflows = 0
-        self.prev_ovf_time = time.time()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        # Runs on PortAudio's thread, so do as little as possible
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+        timestamp = None
+        adc_time = time_info.get('input_buffer_adc_time')
+        if adc_time:
+            # When the last sample was captured, going by how long ago PortAudio says the first one was
+            timestamp = time.perf_counter() - (time_info['current_time'] - adc_time) + frame_count / self.config['SampleRate']
+        self.ring.write(in_data, timestamp=timestamp, overflows=self.overflows)
+        return (None, pyaudio.paContinue)
 
     def read(self):
+        if not self.callback:
+            return self._read_blocking()
+        out = self.ring.read(self.read_timeout, max_blocks=self.catch_up)
+        if self.overflows != self.logged_overflows and time.time() > self.prev_ovf_time + 1:
+            self.prev_ovf_time = time.time()
+            self.logged_overflows = self.overflows
+            logger.warning("Audio input has overflowed %d times, %d hops dropped", self.overflows, self.ring.dropped)
+        return out
+
+    def _read_blocking(self):
         out = None
         try:
-            out = self.stream.read(self.frames_per_buffer, exception_on_overflow=False)
-            out = np.fromstring(out, dtype=np.int16)
-            out = out.astype(np.float32)
-            self.stream.read(self.stream.get_read_available(), exception_on_overflow=False)
+            # Every whole hop waiting, up to catch_up, skipping anything older - or wait for the next one
+            available = self.stream.get_read_available()
+            hops = max(1, min(available // self.frames_per_buffer, self.catch_up))
+            skip = max(0, available - hops * self.frames_per_buffer)
+            if skip:
+                self.stream.read(skip, exception_on_overflow=False)
+            out = self.stream.read(hops * self.frames_per_buffer, exception_on_overflow=False)
+            out = np.frombuffer(out, dtype=np.int16).astype(np.float32)
+            if self.channels > 1:
+                out = out.reshape(-1, self.channels).T
         except KeyboardInterrupt:
             raise
         except IOError:
@@ -133,6 +203,13 @@ class PyAudioInput(Input):
 
 
 class AlsaDeviceInput(Input):
+    """Captures from an ALSA PCM device
+
+    The PCM is non-blocking, and read() waits on its poll descriptors for
+    data, up to Capture.ReadTimeout seconds (two hops by default).  Whatever
+    has arrived is copied into a SampleRing, and the complete hops not read
+    yet are returned, up to Capture.CatchUp of them end to end.
+    """
     NAME = 'alsa'
 
     def __init__(self, config):
@@ -142,34 +219,289 @@ class AlsaDeviceInput(Input):
             raise RuntimeError("AlsaAudio is not installed")
         super().__init__(config)
         self.devices = dict(enumerate(alsaaudio.pcms(alsaaudio.PCM_CAPTURE)))
+        self.read_timeout = self.config.get('ReadTimeout', 2.0 / self.config['FPS'])
+        self.ring = SampleRing(self.frames_per_buffer, size=self.config.get('RingBlocks', 16), channels=self.channels)
 
     def get_device_index(self):
         return self._get_device_index(self.devices)
 
     def start(self):
-        self.buffer = b''
         self.device = alsaaudio.PCM(
             alsaaudio.PCM_CAPTURE,
             alsaaudio.PCM_NONBLOCK,
             device=self.devices[self.get_device_index()],
         )
-        # Set attributes: Mono, 44100 Hz, 16 bit little endian samples
-        self.device.setchannels(1)
+        # Set attributes: Capture.Channels channels, 44100 Hz, 16 bit little endian samples
+        self.device.setchannels(self.channels)
         self.device.setrate(self.config['SampleRate'])
         self.device.setformat(alsaaudio.PCM_FORMAT_S16_LE)
         self.device.setperiodsize(self.frames_per_buffer)
+        self.poll = select.poll()
+        for fd, mask in self.device.polldescriptors():
+            self.poll.register(fd, mask)
+        self.overflows = 0
+
+    def _drain(self):
+        while True:
+            num_frames, frame_data = self.device.read()
+            if num_frames > 0:
+                self.ring.write(frame_data, overflows=self.overflows)
+            elif num_frames < 0 and num_frames != -errno.EAGAIN:
+                # -EPIPE, the device overran, the read recovers it
+                self.overflows += 1
+            else:
+                return
+
+    def read(self):
+        deadline = time.perf_counter() + self.read_timeout
+        while True:
+            self._drain()
+            out = self.ring.read(max_blocks=self.catch_up)
+            if out is not None:
+                return out
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            self.poll.poll(remaining * 1000)
+
+    def stop(self):
+        self.device.close()
+
+
+def _find_wav_data(fp):
+    """Find the audio in a WAV file
+
+    Returns (offset, size, channels, sample rate, sample width) for the data
+    chunk, without reading it.
+    """
+    riff, _, wave_id = struct.unpack('<4sI4s', fp.read(12))
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise RuntimeError(f"{fp.name} is not a WAV file")
+    fmt = None
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            raise RuntimeError(f"{fp.name} has no audio data")
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', fp.read(16))
+            # PCM, or WAVE_FORMAT_EXTENSIBLE which is how some tools write PCM anyway
+            if tag not in (1, 0xfffe):
+                raise RuntimeError(f"{fp.name} is not PCM audio")
+            fmt = (channels, rate, bits // 8)
+            fp.seek(size - 16 + (size & 1), os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise RuntimeError(f"{fp.name} has audio data before its format")
+            return (fp.tell(), size) + fmt
+        else:
+            fp.seek(size + (size & 1), os.SEEK_CUR)
+
+
+class FileInput(Input):
+    """Reads audio from a file or a named pipe, for rendering and testing
+
+    Capture.Path is a 16 bit WAV file or raw 16 bit little endian PCM (Format:
+    raw, or a .raw/.pcm file) with Capture.Channels channels.  It can also be
+    a named pipe (or - for stdin) carrying either, raw unless Format is wav.
+    Files are memory mapped, and each hop is converted straight out of the map
+    into the same float32 buffer.  A WAV file is mixed down to mono unless
+    Capture.Channels is set, in which case it must have that many channels.
+
+    Reads go as fast as they're asked for, unless Capture.Realtime is set, in
+    which case each read waits for the time its hop would have arrived live.
+    At the end of a file, reading starts again from the top if Capture.Loop is
+    set, otherwise finished is set and read() returns None.
+    """
+    NAME = 'file'
+
+    def start(self):
+        self.finished = False
+        path = self.config['Path']
+        is_stream = path == '-' or stat.S_ISFIFO(os.stat(path).st_mode)
+        fmt = self.config.get('Format') or ('raw' if is_stream or path.lower().endswith(('.raw', '.pcm')) else 'wav')
+        if fmt not in ('wav', 'raw'):
+            raise RuntimeError(f"Unknown audio file format {fmt}, it must be wav or raw")
+        self.realtime = self.config.get('Realtime', False)
+        self.loop = self.config.get('Loop', False)
+        self.period = self.frames_per_buffer / self.config['SampleRate']
+        self.next_time = None
+        self.out = np.zeros(self.frames_per_buffer if self.channels == 1 else (self.channels, self.frames_per_buffer), dtype=np.float32)
+        self.fp = self.mm = self.wav = None
+        if is_stream:
+            self._open_stream(path, fmt)
+        else:
+            self._open_mapped(path, fmt)
+
+    def _check_format(self, channels, rate, width):
+        path = self.config['Path']
+        if width != 2:
+            raise RuntimeError(f"{path} is not 16 bit audio")
+        if rate != self.config['SampleRate']:
+            raise RuntimeError(f"{path} has a sample rate of {rate}, expected {self.config['SampleRate']}")
+        if self.channels > 1 and channels != self.channels:
+            raise RuntimeError(f"{path} has {channels} channels, expected {self.channels}")
+        self.file_channels = channels
+
+    def _open_mapped(self, path, fmt):
+        self.fp = open(path, 'rb')
+        if fmt == 'wav':
+            offset, size, channels, rate, width = _find_wav_data(self.fp)
+        else:
+            offset, size = 0, os.fstat(self.fp.fileno()).st_size
+            channels, rate, width = self.channels, self.config['SampleRate'], 2
+        self._check_format(channels, rate, width)
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        # Some tools write a bogus data size for streams they couldn't seek back on
+        frames = min(size, len(self.mm) - offset) // (2 * channels)
+        self.samples = np.frombuffer(self.mm, dtype='<i2', count=frames * channels, offset=offset).reshape(-1, channels)
+        self.pos = 0
+
+    def _open_stream(self, path, fmt):
+        self.fp = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        if fmt == 'wav':
+            self.wav = wave.open(self.fp, 'rb')
+            self._check_format(self.wav.getnchannels(), self.wav.getframerate(), self.wav.getsampwidth())
+        else:
+            self._check_format(self.channels, self.config['SampleRate'], 2)
+        self.buffer = bytearray(self.frames_per_buffer * 2 * self.file_channels)
+        self.samples = np.frombuffer(self.buffer, dtype='<i2').reshape(-1, self.file_channels)
+
+    def _read_mapped(self):
+        if self.pos + self.frames_per_buffer > len(self.samples):
+            if not self.loop or len(self.samples) < self.frames_per_buffer:
+                return None
+            self.pos = 0
+        block = self.samples[self.pos:self.pos + self.frames_per_buffer]
+        self.pos += self.frames_per_buffer
+        return block
+
+    def _read_stream(self):
+        if self.wav:
+            data = self.wav.readframes(self.frames_per_buffer)
+            self.buffer[:len(data)] = data
+            filled = len(data)
+        else:
+            # Pipes hand over whatever the writer has written so far
+            view = memoryview(self.buffer)
+            filled = 0
+            while filled < len(self.buffer):
+                n = self.fp.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+        return self.samples if filled == len(self.buffer) else None
+
+    def _wait(self):
+        now = time.perf_counter()
+        if self.next_time is None or now - self.next_time > self.period:
+            # Starting, or too far behind to catch up
+            self.next_time = now
+        elif self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time += self.period
 
     def read(self):
-        num_frames, frame_data = self.device.read()
-        if num_frames:
-            self.buffer += frame_data
-
-        offset = self.frames_per_buffer * 2
-        if len(self.buffer) < offset:
-            return
-
-        raw_data = self.buffer[:offset]
-        self.buffer = self.buffer[offset:]
-        raw_data = np.frombuffer(raw_data, dtype=np.int16)
-        raw_data = raw_data.astype(np.float32)
-        return raw_data
+        if self.finished:
+            return None
+        block = self._read_mapped() if self.mm else self._read_stream()
+        if block is None:
+            self.finished = True
+            return None
+        if self.channels > 1:
+            self.out[:] = block.T
+        elif self.file_channels == 1:
+            self.out[:] = block[:, 0]
+        else:
+            np.mean(block, axis=1, out=self.out)
+        if self.realtime:
+            self._wait()
+        return self.out
+
+    def stop(self):
+        if self.wav:
+            self.wav.close()
+        if self.mm:
+            # The array is a view onto the map, so has to go first
+            self.samples = None
+            self.mm.close()
+        if self.fp and self.fp is not sys.stdin.buffer:
+            self.fp.close()
+
+
+class UDPInput(Input):
+    """Receives audio sent over the network by lib.audio.net
+
+    Listens on Capture.Listen (host:port, 0.0.0.0:37738 by default) for
+    packets from a PCMSender.  A thread receives them into a JitterBuffer
+    Capture.JitterPackets packets deep, which writes them to a SampleRing in
+    order, with lost packets concealed.  The sender's audio is mixed down to
+    mono unless Capture.Channels is set, in which case it must send that many.  read() waits up
+    to Capture.ReadTimeout seconds (two hops by default) for the next hop, and
+    returns up to Capture.CatchUp hops that have arrived since the last read.
+    """
+    NAME = 'udp'
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.listen = parse_address(self.config.get('Listen', ''))
+        self.read_timeout = self.config.get('ReadTimeout', 2.0 / self.config['FPS'])
+        self.ring = SampleRing(self.frames_per_buffer, size=self.config.get('RingBlocks', 16), channels=self.channels)
+        self.jitter = JitterBuffer(self.ring, depth=self.config.get('JitterPackets', 3))
+        self.bad_packets = 0
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.listen)
+        # Lets the thread notice it's been stopped
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._receive, name='UDPInput', daemon=True)
+        self.thread.start()
+        self.logged = (0, 0)
+        self.prev_log_time = time.time()
+
+    def _receive(self):
+        buffer = bytearray(65536)
+        while not self.stop_event.is_set():
+            try:
+                size = self.sock.recv_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.stop_event.is_set():
+                    logger.error("Failed to receive network audio", exc_info=True)
+                return
+            if size < HEADER.size:
+                self.bad_packets += 1
+                continue
+            magic, seq, rate, _, channels, frames = HEADER.unpack_from(buffer)
+            if magic != MAGIC or not channels or frames > MAX_FRAMES or size != HEADER.size + frames * channels * 2:
+                self.bad_packets += 1
+                continue
+            if rate != self.config['SampleRate'] or (self.channels > 1 and channels != self.channels):
+                if not self.bad_packets:
+                    logger.error("Network audio is %d channels at %d Hz, expected %d at %d Hz",
+                                 channels, rate, self.channels, self.config['SampleRate'])
+                self.bad_packets += 1
+                continue
+            samples = np.frombuffer(buffer, dtype='<i2', count=frames * channels, offset=HEADER.size)
+            if self.channels == 1 and channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            self.jitter.push(seq, samples)
+
+    def read(self):
+        out = self.ring.read(self.read_timeout, max_blocks=self.catch_up)
+        lost = (self.jitter.lost, self.jitter.late)
+        if lost != self.logged and time.time() > self.prev_log_time + 1:
+            self.prev_log_time = time.time()
+            self.logged = lost
+            logger.warning("Network audio has lost %d packets, %d arrived too late", *lost)
+        return out
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.sock.close()
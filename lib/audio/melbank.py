@@ -30,6 +30,7 @@ Functions
 ---------
 """
 
+import numpy as np
 from numpy import abs, append, arange, insert, linspace, log10, round, zeros
 
 
@@ -130,23 +131,92 @@ def compute_melmat(num_mel_bands=12, freq_min=64, freq_max=8000,
             num_fft_bands
         )
 
-    center_frequencies_hz = mel_to_hertz(center_frequencies_mel)
-    lower_edges_hz = mel_to_hertz(lower_edges_mel)
-    upper_edges_hz = mel_to_hertz(upper_edges_mel)
+    center_frequencies_hz = mel_to_hertz(center_frequencies_mel)[:, np.newaxis]
+    lower_edges_hz = mel_to_hertz(lower_edges_mel)[:, np.newaxis]
+    upper_edges_hz = mel_to_hertz(upper_edges_mel)[:, np.newaxis]
     freqs = linspace(0.0, sample_rate / 2.0, num_fft_bands)
-    melmat = zeros((num_mel_bands, num_fft_bands))
 
-    for imelband, (center, lower, upper) in enumerate(zip(
-            center_frequencies_hz, lower_edges_hz, upper_edges_hz)):
+    # Every band at once, a row each.  Each slope is below 0 outside the
+    # triangle and above 1 on the other side of the center, so the smaller of
+    # them is the triangle, and anything below 0 is outside it
+    with np.errstate(divide='ignore', invalid='ignore'):
+        left_slope = (freqs - lower_edges_hz) / (center_frequencies_hz - lower_edges_hz)
+        melmat = (upper_edges_hz - freqs) / (upper_edges_hz - center_frequencies_hz)
+    np.minimum(left_slope, melmat, out=melmat)
+    np.maximum(melmat, 0.0, out=melmat)
 
-        left_slope = (freqs >= lower) == (freqs <= center)
-        melmat[imelband, left_slope] = (
-            (freqs[left_slope] - lower) / (center - lower)
-        )
+    return melmat, (center_frequencies_mel, freqs)
 
-        right_slope = (freqs >= center) == (freqs <= upper)
-        melmat[imelband, right_slope] = (
-            (upper - freqs[right_slope]) / (upper - center)
-        )
 
-    return melmat, (center_frequencies_mel, freqs)
+class SparseMelBank:
+    """A mel matrix stored as just the weights of each band's triangle
+
+    Each band only covers a short run of FFT bins, so the weights are kept
+    end to end, CSR style - weights[starts[b]:starts[b + 1]] are band b's, for
+    FFT bins columns[starts[b]:starts[b + 1]].  Projecting a spectrum then
+    only multiplies the bins each band actually covers, rather than the
+    whole matrix, most of which is zeros.
+
+    Parameters
+    ----------
+    melmat : ndarray
+        Dense transformation matrix, as returned by compute_melmat.
+    """
+    def __init__(self, melmat):
+        self.num_bands, self.num_fft_bands = melmat.shape
+        columns = [np.flatnonzero(band) for band in melmat]
+        lengths = np.array([len(c) for c in columns], dtype=np.intp)
+        self.starts = np.concatenate(([0], np.cumsum(lengths))).astype(np.intp)
+        self.band_starts = self.starts[:-1].copy()
+        self.nnz = int(self.starts[-1])
+        # One more weight of zero on the end, where any empty bands at the end start
+        self.columns = np.zeros(self.nnz + 1, dtype=np.intp)
+        self.weights = zeros(self.nnz + 1)
+        if self.nnz:
+            self.columns[:-1] = np.concatenate(columns)
+            self.weights[:-1] = melmat[np.repeat(arange(self.num_bands), lengths), self.columns[:-1]]
+        # reduceat gives an empty band the product it starts at, rather than 0
+        self.empty = lengths == 0
+        self.any_empty = bool(self.empty.any())
+        # The weights repeated for each row, multiplying by them broadcast makes numpy copy the products
+        self.row_weights = self.weights[np.newaxis, :]
+
+    def to_dense(self):
+        melmat = zeros((self.num_bands, self.num_fft_bands))
+        rows = np.repeat(arange(self.num_bands), np.diff(self.starts))
+        melmat[rows, self.columns[:-1]] = self.weights[:-1]
+        return melmat
+
+    def project(self, spectra, out=None, products=None):
+        """Returns the mel spectrum of each row of spectra.
+
+        Parameters
+        ----------
+        spectra : ndarray (rows, num_fft_bands)
+            Magnitude spectra, float64 to avoid a conversion per call.
+        out : ndarray (rows, num_bands), optional
+            Where to put the result.
+        products : ndarray (rows, nnz + 1), optional
+            Scratch space from new_products(), so that nothing is allocated.
+        Returns
+        -------
+        mel : ndarray (rows, num_bands)
+        """
+        if products is None:
+            products = self.new_products(spectra.shape[0])
+        if out is None:
+            out = np.empty((spectra.shape[0], self.num_bands))
+        # clip rather than raise, which would copy through a buffer - the columns are all in range anyway
+        np.take(spectra, self.columns, axis=1, out=products, mode='clip')
+        rows = products.shape[0]
+        if self.row_weights.shape[0] < rows:
+            self.row_weights = np.tile(self.weights, (rows, 1))
+        products *= self.row_weights[:rows]
+        np.add.reduceat(products, self.band_starts, axis=1, out=out)
+        if self.any_empty:
+            out[:, self.empty] = 0.0
+        return out
+
+    def new_products(self, rows):
+        """Scratch space for project()"""
+        return zeros((rows, self.nnz + 1))
@@ -0,0 +1,169 @@
+"""PCM audio over UDP
+
+Capture can run on another machine and send its audio to the lighting
+controller, which receives it with the udp capture method (UDPInput).  Each
+datagram is a header followed by 16 bit little endian samples, interleaved if
+there's more than one channel:
+
+    magic       4s  b'PLPC'
+    seq         u32 packet number, counting up from whatever the sender started at
+    rate        u32 sample rate
+    timestamp   f64 sender's clock when the first sample was captured
+    channels    u16
+    frames      u16 samples per channel in this packet
+
+Run this module to send audio from any configured capture input:
+
+    python -m lib.audio.net -c config/main.yaml controller-host:37738
+
+The receiving end keeps a small jitter buffer, so that packets arriving out
+of order are put back in order, and a packet that still hasn't turned up by
+the time JitterPackets later ones have is given up on and concealed.
+"""
+import sys
+import time
+import threading
+import socket
+import struct
+import logging
+import argparse
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'PLPC'
+HEADER = struct.Struct('<4sIIdHH')
+DEFAULT_PORT = 37738
+# Keeps datagrams under a 1500 byte MTU, so they're never fragmented
+MAX_PAYLOAD = 1400
+MAX_FRAMES = (MAX_PAYLOAD - HEADER.size) // 2
+# A sequence number this far from the one expected means the sender restarted
+RESYNC = 256
+# Each packet concealed in a row is the last one again, this much quieter
+CONCEAL_FADE = 0.5
+
+
+def parse_address(address, default_host='0.0.0.0'):
+    host, _, port = address.rpartition(':')
+    return (host or default_host, int(port) if port else DEFAULT_PORT)
+
+
+class PCMSender:
+    """Sends blocks of samples as numbered datagrams"""
+    def __init__(self, address, sample_rate, channels=1, seq=0):
+        self.address = address
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.seq = seq
+        self.max_frames = (MAX_PAYLOAD - HEADER.size) // (2 * channels)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, samples, timestamp=None):
+        """Send int16 (or float, which is rounded) samples, (frames,) or (frames, channels)"""
+        if timestamp is None:
+            timestamp = time.time()
+        samples = np.asarray(samples)
+        if samples.dtype != np.int16:
+            samples = np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+        samples = samples.reshape(-1, self.channels)
+        for start in range(0, len(samples), self.max_frames):
+            chunk = samples[start:start + self.max_frames]
+            header = HEADER.pack(MAGIC, self.seq & 0xffffffff, self.sample_rate, timestamp, self.channels, len(chunk))
+            self.sock.sendto(header + chunk.astype('<i2').tobytes(), self.address)
+            self.seq += 1
+            timestamp += len(chunk) / self.sample_rate
+
+    def close(self):
+        self.sock.close()
+
+
+class JitterBuffer:
+    """Puts packets back in order and conceals the ones lost
+
+    push() takes each packet's sequence number and samples (interleaved if
+    there's more than one channel) as they arrive, and writes them to the ring in sequence order.  Packets that
+    arrive after their turn has passed are dropped, and counted in late.
+    """
+    def __init__(self, ring, depth=3):
+        self.ring = ring
+        self.depth = depth
+        self.pending = {}
+        self.next_seq = None
+        self.last = np.zeros(MAX_FRAMES, dtype=np.float32)
+        self.last_len = 0
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+        self.resyncs = 0
+
+    def push(self, seq, samples):
+        self.received += 1
+        if self.next_seq is None:
+            self.next_seq = seq
+        # Distance from the packet expected, allowing for the counter wrapping
+        ahead = ((seq - self.next_seq + 0x80000000) & 0xffffffff) - 0x80000000
+        if abs(ahead) > RESYNC:
+            self.resyncs += 1
+            self.pending.clear()
+            self.next_seq = seq
+        elif ahead < 0 or seq in self.pending:
+            self.late += 1
+            return
+        self.pending[seq] = np.array(samples, dtype=np.float32)
+        self._drain()
+
+    def _drain(self):
+        while True:
+            samples = self.pending.pop(self.next_seq, None)
+            if samples is not None:
+                self.last_len = len(samples)
+                self.last[:self.last_len] = samples
+                self.ring.write(samples)
+            elif len(self.pending) >= self.depth:
+                self.lost += 1
+                last = self.last[:self.last_len]
+                last *= CONCEAL_FADE
+                self.ring.write(last)
+            else:
+                return
+            self.next_seq = (self.next_seq + 1) & 0xffffffff
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Send audio from a capture input to a PartyLights udp input")
+    parser.add_argument('-c', '--config-file', help="Path to main config file, its Capture section sets up the input")
+    parser.add_argument('destination', help="host:port to send to")
+    return parser.parse_args()
+
+
+def main(args):
+    from lib.config import load_config
+    from .input import Input
+
+    logging.basicConfig(level=logging.INFO)
+    config = load_config(args.config_file)
+    # Nothing else runs here, so wait for audio rather than spin
+    config['Capture'].setdefault('ReadTimeout', 1.0 / config['Capture']['FPS'])
+    sender = PCMSender(parse_address(args.destination, 'localhost'), config['Capture']['SampleRate'],
+                       channels=config['Capture'].get('Channels', 1))
+    sent = 0
+    try:
+        with Input.get_input(config) as capture:
+            while not capture.finished:
+                hop = capture.read()
+                if hop is not None:
+                    sender.send(hop.T)
+                    sent += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sender.close()
+        logger.info("Sent %d hops", sent)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
@@ -1,10 +1,21 @@
-import time
-
 import numpy as np
-from scipy.ndimage.filters import gaussian_filter1d
+from scipy.ndimage import gaussian_filter1d
 import aubio
 
-from .dsp import create_mel_bank, ExpFilter
+from lib import clock
+from lib import adaptive
+from . import stft
+from .dsp import get_mel_bank, ExpFilter
+from .melbank import SparseMelBank
+
+
+def create_processors(config):
+    return [
+        SmoothingProcessor(config),
+        BeatProcessor(config),
+        PitchProcessor(config),
+        IdleProcessor(config),
+    ]
 
 
 class Processor:
@@ -12,71 +23,246 @@ class Processor:
         self.capconfig = config['Capture']
         self.config = config.get('Processors', {})
 
-    def process(self, raw_audio, data):
+    def process(self, raw_audio, frame):
+        """Analyse a hop of raw_audio into frame
+
+        raw_audio is (samples,) for mono capture, (channels, samples) for
+        more than one channel, or None if there was no audio this frame.
+        An input catching up after a stall hands over all the hops it has
+        buffered end to end, and they all go into the one frame.
+        """
+        pass
+
+    @staticmethod
+    def mono(raw_audio):
+        """raw_audio mixed down to one channel"""
+        return raw_audio if raw_audio.ndim == 1 else raw_audio.mean(axis=0)
+
+    @staticmethod
+    def hops(raw_audio, hop_size):
+        """raw_audio split into hops of hop_size, for analysis that can only take one at a time"""
+        for start in range(0, raw_audio.shape[-1] - hop_size + 1, hop_size):
+            yield raw_audio[..., start:start + hop_size]
+
+    def set_quality(self, level):
+        """Scale back the work done per frame, see lib.adaptive"""
         pass
 
 
 class SmoothingProcessor(Processor):
+    """Smoothed mel spectrum of the audio, and of each channel when there are several
+
+    Parameters (Processors.Smoothing)
+    ----------
+    RollingHistory : int
+        Capture blocks in the default window.
+    FFTBins : int
+        Mel bins in the spectrum.
+    MinFrequency, MaxFrequency : float
+        Range the mel bins cover, in Hz.
+    MinVolumeThreshold : float
+        Windows quieter than this come out as silence.
+    WindowLength, Hop, FFTSize, Window
+        The STFT, see lib.audio.stft.  By default RollingHistory blocks, a
+        hop per block, the next power of two and hamming.
+    FFTBackend, FFTWorkers
+        numpy, scipy, pyfftw or auto, and their threads, see lib.audio.fft.
+    MelProjection : str
+        sparse, or dense for the whole matrix.
+    MelBankCache : str, optional
+        Directory to keep mel banks in between runs.
+    """
     def __init__(self, config):
         super().__init__(config)
         self.config = self.config.get('Smoothing', {})
         self.rolling_history = self.config.get('RollingHistory', 2)
         self.fft_bins = self.config.get('FFTBins', 24)
+        self.min_volume = float(self.config.get('MinVolumeThreshold', 1e-7))
+        # Sparse only multiplies the bins under each band's triangle (see melbank.SparseMelBank), dense
+        # multiplies the whole matrix, summing in the original order for bit for bit the old spectra
+        self.mel_projection = self.config.get('MelProjection', 'sparse')
+        if self.mel_projection not in ('sparse', 'dense'):
+            raise RuntimeError(f"Unknown MelProjection {self.mel_projection}, it must be sparse or dense")
+        self.channels = self.capconfig.get('Channels', 1)
+        # The mix, then each channel, or just the one channel - analysed together as rows of one block
+        self.rows = self.channels + 1 if self.channels > 1 else 1
         self.samples_per_frame = int(self.capconfig['SampleRate'] / self.capconfig['FPS'])
-        self.y_roll = np.random.rand(self.rolling_history, self.samples_per_frame) / 1e16
-        self.fft_window = np.hamming(int(self.capconfig['SampleRate'] / self.capconfig['FPS']) * self.rolling_history)
-        self.mel_y, self.mel_x = create_mel_bank(
+        self.window_length = self.config.get('WindowLength', self.samples_per_frame * self.rolling_history)
+        self.hop = self.config.get('Hop', self.samples_per_frame)
+        self.fft_size = self.config.get('FFTSize')
+        self.window = self.config.get('Window', 'hamming')
+        # The backends agree to float32 precision, numpy's are the spectra everything was tuned on
+        self.fft_backend = self.config.get('FFTBackend', 'numpy')
+        self.fft_workers = self.config.get('FFTWorkers', 1)
+        self.stft = None
+        # Most windows one block has completed, see _allocate_windows
+        self.max_windows = 1
+        self._set_window(self.window_length)
+        self.mel_gain = ExpFilter(np.tile(1e-1, (self.rows, self.fft_bins)),
+                         alpha_decay=0.01, alpha_rise=0.99)
+        self.mel_smoothing = ExpFilter(np.tile(1e-1, (self.rows, self.fft_bins)),
+                         alpha_decay=0.5, alpha_rise=0.99)
+
+        shape = (self.rows, self.fft_bins)
+        self.block = np.zeros((self.rows, self.samples_per_frame), dtype=np.float32)
+        self.mix = np.zeros(self.samples_per_frame)
+        self.mel_peaks = np.zeros(shape)
+        self.mel_peak = np.zeros((self.rows, 1))
+        self.prev_gain = np.zeros(shape)
+        self.prev_smoothing = np.zeros(shape)
+        self.output = np.zeros(shape)
+        self.silence = np.zeros(shape)
+        # The spectrum from the last window, until the next one
+        self.spectrum = None
+
+    def _noise(self, samples):
+        # Too quiet to hear, a block at a time as the history used to be filled
+        blocks = -(-samples // self.samples_per_frame)
+        noise = (np.random.rand(blocks, self.rows, self.samples_per_frame) / 1e16).astype(np.float32)
+        return noise.transpose(1, 0, 2).reshape(self.rows, -1)[:, -samples:]
+
+    def _set_window(self, window_length):
+        # Keep the newest samples, so the spectrum carries on without a gap
+        history = self.stft.latest(window_length) if self.stft else np.zeros((self.rows, 0), dtype=np.float32)
+        if history.shape[1] < window_length:
+            history = np.concatenate((self._noise(window_length - history.shape[1]), history), axis=1)
+        fft_size = self.fft_size
+        if fft_size and window_length < self.window_length:
+            # Cut the FFT down along with the window
+            fft_size = min(fft_size, stft.next_power_of_two(window_length))
+        pending = self.stft.pending if self.stft else 0
+        self.stft = stft.STFT(window_length, self.hop, fft_size, self.window, self.rows, history=history,
+                              fft_backend=self.fft_backend, fft_workers=self.fft_workers)
+        self.stft.pending = pending
+
+        if self.fft_size:
+            # Every bin the FFT gives, 0 to SampleRate / 2
+            self.bands = self.stft.fft_size // 2 + 1
+        else:
+            # The first window_length / 2 bins, stretched over 0 to SampleRate / 2 as they always have been
+            self.bands = window_length // 2
+        self.mel_y, self.mel_x = get_mel_bank(
             self.capconfig['SampleRate'],
-            self.rolling_history,
-            self.capconfig['FPS'],
+            self.bands,
             self.fft_bins,
             self.config.get('MinFrequency', 200),
-            self.config.get('MaxFrequency', 12000)
+            self.config.get('MaxFrequency', 12000),
+            cache_dir=self.config.get('MelBankCache'),
         )
-        self.mel_gain = ExpFilter(np.tile(1e-1, self.fft_bins),
-                         alpha_decay=0.01, alpha_rise=0.99)
-        self.mel_smoothing = ExpFilter(np.tile(1e-1, self.fft_bins),
-                         alpha_decay=0.5, alpha_rise=0.99)
+        if self.mel_projection == 'sparse':
+            self.mel_bank = SparseMelBank(self.mel_y)
+        self._allocate_windows(self.max_windows)
+
+    def _allocate_windows(self, windows):
+        # Buffers for as many windows as a block can complete, usually one - every step writes into them in place
+        bands = self.bands
+        self.vol = np.zeros((windows, self.rows), dtype=np.float32)
+        self.vol_lo = np.zeros((windows, self.rows), dtype=np.float32)
+        self.active = np.zeros((windows, self.rows), dtype=bool)
+        self.mel = np.zeros((windows, self.rows, self.fft_bins))
+        if self.mel_projection == 'sparse':
+            self.ys64 = np.zeros((windows, self.rows, bands))
+            self.mel_products = self.mel_bank.new_products(windows * self.rows)
+        else:
+            # The spectrum repeated for each mel bin, to multiply by the mel bank in place
+            self.mel_product = np.zeros((self.rows, self.fft_bins, bands))
+
+    def set_quality(self, level):
+        # The number of mel bins stays the same, mapping directives refer to them by index
+        window_length = self.window_length
+        if level >= adaptive.SHORT_FFT:
+            window_length = min(window_length, self.samples_per_frame)
+        if window_length != self.stft.window_length:
+            self._set_window(window_length)
 
-    def process(self, raw_audio, data):
-        data['audio'] = None
+    def process(self, raw_audio, frame):
+        frame.audio = None
         if raw_audio is None:
             return
+        samples = raw_audio.shape[-1]
+        if samples > self.block.shape[1]:
+            # Several hops at once, from an input catching up
+            self.block = np.zeros((self.rows, samples), dtype=np.float32)
+            self.mix = np.zeros(samples)
+        windows = (self.stft.pending + samples) // self.stft.hop
+        if windows > self.max_windows:
+            self.max_windows = windows
+            self._allocate_windows(windows)
         # Normalize samples between 0 and 1
-        y = raw_audio / 2.0**15
-        # Construct a rolling window of audio samples
-        self.y_roll[:-1] = self.y_roll[1:]
-        self.y_roll[-1, :] = np.copy(y)
-        y_data = np.concatenate(self.y_roll, axis=0).astype(np.float32)
+        block = self.block[:, :samples]
+        if self.rows == 1:
+            np.divide(raw_audio, 2.0**15, out=block[0])
+        else:
+            mix = self.mix[:samples]
+            np.divide(raw_audio, 2.0**15, out=block[1:])
+            np.mean(block[1:], axis=0, out=mix)
+            block[0] = mix
+        # None leaves the spectrum as it was, several (a shorter Hop, or a backlog) are analysed as a batch
+        windows = self.stft.push_batch(block)
+        if windows:
+            self.spectrum = self._analyse(windows)
+        if self.spectrum is None:
+            return
 
-        output = None
+        frame.audio = self.spectrum[0]
+        if self.rows > 1:
+            frame.channel_audio = self.spectrum[1:]
 
-        vol = np.max(np.abs(y_data))
-        if vol < self.config.get('MinVolumeThreshold', 1e-7):
+    def _analyse(self, windows):
+        """The smoothed mel spectrum after the windows the last block completed
+
+        The FFTs and mel projections of all the windows are done at once, then
+        the gain and smoothing filters step through them in order.
+        """
+        y_data = self.stft.frames[:windows]
+        # The loudest sample either way
+        vol, vol_lo = self.vol[:windows], self.vol_lo[:windows]
+        np.max(y_data, axis=-1, out=vol)
+        np.min(y_data, axis=-1, out=vol_lo)
+        np.negative(vol_lo, out=vol_lo)
+        np.maximum(vol, vol_lo, out=vol)
+        active = np.greater_equal(vol, self.min_volume, out=self.active[:windows])
+        if not active.any():
             # print('No audio input. Volume below threshold. Volume:', vol)
-            output = np.tile(0, self.fft_bins).astype(float)
+            return self.silence
+        # Transform audio input into the frequency domain
+        ys = self.stft.transform_batch(windows)[:, :, :self.bands]
+        # Construct a Mel filterbank from the FFT data
+        mel = self.mel[:windows]
+        if self.mel_projection == 'sparse':
+            rows = windows * self.rows
+            ys64 = self.ys64[:windows]
+            np.copyto(ys64, ys)
+            self.mel_bank.project(ys64.reshape(rows, -1), out=mel.reshape(rows, -1), products=self.mel_products[:rows])
         else:
-            # Transform audio input into the frequency domain
-            N = len(y_data)
-            N_zeros = 2**int(np.ceil(np.log2(N))) - N
-            # Pad with zeros until the next power of two
-            y_data *= self.fft_window
-            y_padded = np.pad(y_data, (0, N_zeros), mode='constant')
-            YS = np.abs(np.fft.rfft(y_padded)[:N // 2])
-            # Construct a Mel filterbank from the FFT data
-            mel = np.atleast_2d(YS).T * self.mel_y.T
-            # Scale data to values more suitable for visualization
-            # mel = np.sum(mel, axis=0)
-            mel = np.sum(mel, axis=0)
-            mel = mel**2.0
-            # Gain normalization
-            self.mel_gain.update(np.max(gaussian_filter1d(mel, sigma=1.0)))
-            mel /= self.mel_gain.value
-            mel = self.mel_smoothing.update(mel)
-            output = mel
-
-        if output is not None:
-            data['audio'] = output
+            for i in range(windows):
+                np.copyto(self.mel_product, ys[i, :, np.newaxis, :])
+                self.mel_product *= self.mel_y
+                np.sum(self.mel_product, axis=2, out=mel[i])
+        # Scale data to values more suitable for visualization
+        np.square(mel, out=mel)
+        for i in range(windows):
+            output = self._smooth(mel[i], active[i]) if active[i].any() else self.silence
+        return output
+
+    def _smooth(self, mel, active):
+        # Gain normalization, leaving rows that are too quiet as they were
+        all_active = active.all()
+        if not all_active:
+            np.copyto(self.prev_gain, self.mel_gain.value)
+            np.copyto(self.prev_smoothing, self.mel_smoothing.value)
+        gaussian_filter1d(mel, sigma=1.0, axis=-1, output=self.mel_peaks)
+        self.mel_gain.update(np.max(self.mel_peaks, axis=-1, keepdims=True, out=self.mel_peak))
+        mel /= self.mel_gain.value
+        output = self.mel_smoothing.update(mel)
+        if not all_active:
+            inactive = ~active
+            self.mel_gain.value[inactive] = self.prev_gain[inactive]
+            self.mel_smoothing.value[inactive] = self.prev_smoothing[inactive]
+            output = self.output
+            np.copyto(output, self.mel_smoothing.value)
+            output[inactive] = 0.0
+        return output
 
 
 class BeatProcessor(Processor):
@@ -87,15 +273,37 @@ class BeatProcessor(Processor):
         self.hop_s = self.frames_per_buffer = int(self.capconfig['SampleRate'] / self.capconfig['FPS'])
         self.onset_detect = aubio.onset('energy', self.win_s, self.hop_s, self.capconfig['SampleRate'])
         self.beat_detect = aubio.tempo('hfc', self.win_s, self.hop_s, self.capconfig['SampleRate'])
+        # Tempo detection over two hops at a time, for when it only runs every other frame
+        self.half_rate = False
+        self.half_rate_detect = None
+        self.pending = None
 
-    def process(self, raw_audio, data):
-        data.update({'is_onset': None, 'is_beat': None})
+    def set_quality(self, level):
+        half_rate = level >= adaptive.HALF_RATE_TEMPO
+        if half_rate != self.half_rate:
+            self.half_rate = half_rate
+            self.pending = None
+            if half_rate and self.half_rate_detect is None:
+                self.half_rate_detect = aubio.tempo('hfc', self.win_s * 2, self.hop_s * 2, self.capconfig['SampleRate'])
+
+    def process(self, raw_audio, frame):
+        frame.is_onset = frame.is_beat = None
         if raw_audio is None:
             return
-        data.update({
-            'is_onset': True if self.onset_detect(raw_audio) else False,
-            'is_beat': True if self.beat_detect(raw_audio) else False,
-            })
+        frame.is_onset = frame.is_beat = False
+        # An onset or beat in any of the hops caught up on counts for the frame
+        for hop in self.hops(self.mono(raw_audio), self.hop_s):
+            if self.onset_detect(hop):
+                frame.is_onset = True
+            if not self.half_rate:
+                if self.beat_detect(hop):
+                    frame.is_beat = True
+            elif self.pending is None:
+                self.pending = hop.copy()
+            else:
+                if self.half_rate_detect(np.concatenate((self.pending, hop))):
+                    frame.is_beat = True
+                self.pending = None
 
 
 class PitchProcessor(Processor):
@@ -109,21 +317,28 @@ class PitchProcessor(Processor):
         # self.pitch_detect.set_tolerance(1)
         self.buffer = []
         self.buffer_len = 3
+        self.enabled = True
 
-    def process(self, raw_audio, data):
-        data['pitch'] = None
-        if raw_audio is None:
+    def set_quality(self, level):
+        self.enabled = level < adaptive.NO_PITCH
+        if not self.enabled:
+            self.buffer = []
+
+    def process(self, raw_audio, frame):
+        frame.pitch = None
+        if raw_audio is None or not self.enabled:
             return
-        pitch = self.pitch_detect(raw_audio)[0]
-        confidence = self.pitch_detect.get_confidence()
-        # print('{:1.5f} {:s}'.format(confidence, '*' * int(pitch)))
-        if confidence > 0:
-            self.buffer.append(pitch)
-            self.buffer = self.buffer[-self.buffer_len:]
+        for hop in self.hops(self.mono(raw_audio), self.hop_s):
+            pitch = self.pitch_detect(hop)[0]
+            confidence = self.pitch_detect.get_confidence()
+            # print('{:1.5f} {:s}'.format(confidence, '*' * int(pitch)))
+            if confidence > 0:
+                self.buffer.append(pitch)
+                self.buffer = self.buffer[-self.buffer_len:]
 
         if len(self.buffer) == self.buffer_len:
             avg = sum(self.buffer) / len(self.buffer)
-            data['pitch'] = avg
+            frame.pitch = avg
 
 
 class IdleProcessor(Processor):
@@ -133,25 +348,26 @@ class IdleProcessor(Processor):
         self.idle_since = None
         self.dead_since = None
 
-    def process(self, raw_audio, data):
-        data.update({'idle_for': None, 'dead_for': None})
-        audio = data.get('audio')
+    def process(self, raw_audio, frame):
+        frame.idle_for = frame.dead_for = None
+        audio = frame.audio
         if audio is None:
             return
         threshold = self.config.get('Threshold', 0.1)
-        v_sum = np.sum(audio)
+        v_sum = float(np.sum(audio))
         v_avg = v_sum / len(audio)
-        data.update({'audio_v_sum': v_sum, 'audio_v_avg': v_avg})
+        frame.audio_v_sum = v_sum
+        frame.audio_v_avg = v_avg
         if v_avg < threshold:
-            self.idle_since = self.idle_since or time.time()
-            data['idle_for'] = time.time() - self.idle_since
+            self.idle_since = self.idle_since or clock.time()
+            frame.idle_for = clock.time() - self.idle_since
         else:
             self.idle_since = None
-            data['idle_for'] = None
+            frame.idle_for = None
 
         if v_sum == 0:
-            self.dead_since = self.dead_since or time.time()
-            data['dead_for'] = time.time() - self.dead_since
+            self.dead_since = self.dead_since or clock.time()
+            frame.dead_for = clock.time() - self.dead_since
         else:
             self.dead_since = None
-            data['dead_for'] = None
+            frame.dead_for = None
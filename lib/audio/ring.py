@@ -0,0 +1,97 @@
+import time
+import threading
+
+import numpy as np
+
+
+class SampleRing:
+    """Preallocated ring of hop sized blocks of samples, one writer and one reader
+
+    The writer (usually an audio callback thread) hands over chunks of any
+    size, as int16 bytes or arrays, and they're converted to float32 as
+    they're copied into the current block.  Each block is stamped with the
+    time it was completed and the input's overflow count at that point.
+
+    With more than one channel the writer's samples are interleaved, as they
+    come from the device, and chunks are always whole frames.
+
+    read() returns a view of the newest complete block rather than a copy,
+    (block_size,) or (channels, block_size).
+    The view stays valid until the writer laps the ring, size - 1 blocks
+    later.  Blocks that are never returned by read(), because a newer one
+    came along first, are counted in dropped.
+
+    read(max_blocks=n) instead returns up to the newest n blocks not read
+    yet, oldest first and end to end, (blocks * block_size,) or (channels,
+    blocks * block_size) - so a reader that has fallen behind can catch up
+    on everything it missed in one go.  They're copied out into a buffer
+    that stays valid until the next read.
+    """
+    def __init__(self, block_size, size=16, channels=1):
+        self.block_size = block_size
+        self.size = size
+        self.channels = channels
+        self.blocks = np.zeros((size, block_size) if channels == 1 else (size, block_size, channels), dtype=np.float32)
+        # Blocks copied out end to end by read(max_blocks=...)
+        self.backlog = np.zeros((size * block_size,) if channels == 1 else (size * block_size, channels), dtype=np.float32)
+        self.timestamps = np.zeros(size)
+        self.overflows = np.zeros(size, dtype=np.int64)
+        self.cond = threading.Condition()
+        # Samples in the block being filled
+        self.fill = 0
+        # Complete blocks written, and blocks read or skipped by the reader
+        self.written = 0
+        self.read_pos = 0
+        self.dropped = 0
+        # Timestamp and overflow count of the block last read
+        self.timestamp = None
+        self.overflow_count = 0
+
+    def write(self, samples, timestamp=None, overflows=0):
+        if isinstance(samples, (bytes, bytearray, memoryview)):
+            samples = np.frombuffer(samples, dtype=np.int16)
+        if self.channels > 1:
+            samples = samples.reshape(-1, self.channels)
+        pos = 0
+        while pos < len(samples):
+            slot = self.written % self.size
+            take = min(self.block_size - self.fill, len(samples) - pos)
+            self.blocks[slot, self.fill:self.fill + take] = samples[pos:pos + take]
+            self.fill += take
+            pos += take
+            if self.fill == self.block_size:
+                self.timestamps[slot] = time.perf_counter() if timestamp is None else timestamp
+                self.overflows[slot] = overflows
+                self.fill = 0
+                with self.cond:
+                    self.written += 1
+                    self.cond.notify_all()
+
+    def read(self, timeout=0, max_blocks=1):
+        """The newest block not read yet, or None if none arrives within timeout
+
+        With max_blocks, up to that many of the blocks not read yet, as one.
+        """
+        if self.written == self.read_pos:
+            if not timeout:
+                return None
+            with self.cond:
+                if not self.cond.wait_for(lambda: self.written != self.read_pos, timeout):
+                    return None
+        written = self.written
+        # The writer is filling the slot after the newest block, and the oldest after that, so leave both alone
+        count = min(written - self.read_pos, max_blocks, max(1, self.size - 2))
+        self.dropped += written - self.read_pos - count
+        self.read_pos = written
+        slot = (written - 1) % self.size
+        self.timestamp = self.timestamps[slot]
+        self.overflow_count = int(self.overflows[slot])
+        if count == 1:
+            return self.blocks[slot] if self.channels == 1 else self.blocks[slot].T
+        first = (written - count) % self.size
+        # Up to the end of the ring, then from the start
+        head = min(count, self.size - first) * self.block_size
+        backlog = self.backlog[:count * self.block_size]
+        backlog[:head] = self.blocks[first:first + count].reshape(backlog[:head].shape)
+        backlog[head:] = self.blocks[:count - head // self.block_size].reshape(backlog[head:].shape)
+        return backlog if self.channels == 1 else backlog.T
@@ -0,0 +1,168 @@
+"""Streaming short time Fourier transform
+
+The window length, the hop between windows and the FFT size are independent
+of each other and of the capture block size.  Samples are pushed in as they
+arrive, in chunks of any size, and a window is produced each time another
+hop's worth has come in - none for a chunk shorter than what's left of the
+hop, several for a chunk longer than the hop.
+
+The most recent window_length samples are kept in a ring, so producing a
+window copies it out oldest first rather than shifting the history along.
+"""
+import numpy as np
+
+from .fft import FFTBackend, choose_backend
+
+
+# Symmetric windows, as np.hamming has always been used here
+WINDOWS = {
+    'hamming': np.hamming,
+    'hann': np.hanning,
+    'blackman': np.blackman,
+}
+
+
+def next_power_of_two(n):
+    return 2**int(np.ceil(np.log2(n)))
+
+
+class STFT:
+    """Windows of rows of samples, and their magnitude spectra
+
+    push() yields self.frame, the (rows, window_length) samples of the window,
+    oldest first, each time one is complete.  transform() then turns it into
+    self.magnitudes, the (rows, fft_size // 2 + 1) magnitude spectrum of the
+    window zero padded to fft_size.  Both are overwritten by the next window,
+    and nothing is allocated along the way.
+
+    push_batch() instead collects every window a chunk completes into
+    self.frames, (windows, rows, window_length), and transform_batch() does
+    them all in one FFT into self.spectra - for catching up on a backlog.
+    The batch buffers grow to the most windows seen in one chunk.
+
+    Parameters
+    ----------
+    window_length : int
+        Samples in each window.
+    hop : int
+        Samples between the start of one window and the next.
+    fft_size : int, optional
+        At least window_length.  Default: the next power of two.
+    window : str
+        hamming, hann or blackman.
+    rows : int
+        Signals transformed together, such as channels.
+    history : ndarray (rows, samples), optional
+        Samples to start with, oldest first.  Windows before there have been
+        window_length samples otherwise start with zeros.
+    fft_backend : str
+        numpy, scipy, pyfftw or auto, see lib.audio.fft.
+    fft_workers : int
+        Threads for backends that can use more than one.
+    """
+    def __init__(self, window_length, hop, fft_size=None, window='hamming', rows=1, history=None,
+                 fft_backend='numpy', fft_workers=1):
+        if window not in WINDOWS:
+            raise RuntimeError(f"Unknown window {window}, it must be one of {', '.join(WINDOWS)}")
+        fft_size = fft_size or next_power_of_two(window_length)
+        if fft_size < window_length:
+            raise RuntimeError(f"FFT size {fft_size} is shorter than the window length {window_length}")
+        if hop < 1:
+            raise RuntimeError(f"Invalid hop {hop}")
+        self.window_length = window_length
+        self.hop = hop
+        self.fft_size = fft_size
+        self.window_name = window
+        self.rows = rows
+        self.ring = np.zeros((rows, window_length), dtype=np.float32)
+        # Where the next sample goes, which is the oldest one until then
+        self.pos = 0
+        # Samples since the last window
+        self.pending = 0
+        if history is not None:
+            history = history[:, -window_length:]
+            self.ring[:, window_length - history.shape[1]:] = history
+        self.window = WINDOWS[window](window_length)
+        if fft_backend == 'auto':
+            fft_backend = choose_backend((rows, fft_size), fft_workers)
+        self.fft = FFTBackend.get_backend(fft_backend, fft_workers)
+        self._allocate(1)
+
+    def _allocate(self, windows):
+        # The window's samples at the start of each FFT input, the rest stays zero
+        self.fft_in = self.fft.zeros((windows, self.rows, self.fft_size), np.float32)
+        self.frames = self.fft_in[:, :, :self.window_length]
+        self.fft_out = self.fft.zeros((windows, self.rows, self.fft_size // 2 + 1), np.complex64)
+        # FFT plans for the first so many windows, made as they're needed
+        self.plans = {}
+        # Windowed in double precision then rounded back, going through a buffer saves numpy making its own
+        self.windowed = np.zeros((windows, self.rows, self.window_length))
+        # Every bin, abs() of a slice of the FFT output would go through a buffer
+        self.spectra = np.zeros((windows, self.rows, self.fft_size // 2 + 1), dtype=np.float32)
+        self.frame = self.frames[0]
+        self.magnitudes = self.spectra[0]
+
+    def push(self, samples):
+        """Add (rows, n) samples, yielding self.frame for each window they complete"""
+        for _ in self._push(samples, batch=False):
+            yield self.frame
+
+    def push_batch(self, samples):
+        """Add (rows, n) samples, returning how many windows they complete, in self.frames"""
+        windows = (self.pending + samples.shape[-1]) // self.hop
+        if windows > len(self.fft_in):
+            self._allocate(windows)
+        count = 0
+        for count in self._push(samples, batch=True):
+            pass
+        return count
+
+    def _push(self, samples, batch):
+        n = samples.shape[-1]
+        i = 0
+        count = 0
+        while i < n:
+            take = min(self.hop - self.pending, n - i)
+            self._write(samples[:, i:i + take])
+            self.pending += take
+            i += take
+            if self.pending == self.hop:
+                self.pending = 0
+                # Oldest first, the oldest sample being the one the next write replaces
+                frame = self.frames[count if batch else 0]
+                tail = self.window_length - self.pos
+                frame[:, :tail] = self.ring[:, self.pos:]
+                frame[:, tail:] = self.ring[:, :self.pos]
+                count += 1
+                yield count
+
+    def _write(self, samples):
+        # Only the newest window_length of a hop longer than the window are ever used
+        samples = samples[:, -self.window_length:]
+        n = samples.shape[-1]
+        first = min(n, self.window_length - self.pos)
+        self.ring[:, self.pos:self.pos + first] = samples[:, :first]
+        self.ring[:, :n - first] = samples[:, first:]
+        self.pos = (self.pos + n) % self.window_length
+
+    def transform(self):
+        """The magnitude spectrum of self.frame, which is windowed in place"""
+        return self.transform_batch(1)[0]
+
+    def transform_batch(self, windows):
+        """The magnitude spectra of the first windows in self.frames, windowed in place"""
+        windowed = self.windowed[:windows]
+        np.copyto(windowed, self.frames[:windows])
+        windowed *= self.window
+        np.copyto(self.frames[:windows], windowed)
+        plan = self.plans.get(windows)
+        if plan is None:
+            plan = self.plans[windows] = self.fft.plan(self.fft_in[:windows], self.fft_out[:windows])
+        plan()
+        np.abs(self.fft_out[:windows], out=self.spectra[:windows])
+        return self.spectra[:windows]
+
+    def latest(self, samples):
+        """A copy of the newest samples in the ring, oldest first"""
+        ordered = np.concatenate((self.ring[:, self.pos:], self.ring[:, :self.pos]), axis=1)
+        return ordered[:, max(0, self.window_length - samples):]
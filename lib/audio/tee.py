@@ -0,0 +1,216 @@
+"""Recording the raw capture to disk while running
+
+So that a show that went wrong can be played back through the same analysis
+and mapping later (python main.py -r tee-....wav), the capture task can hand
+every hop it reads to an AudioTee.  Hops are copied into a preallocated ring
+and written out by a background thread, so the frame loop never waits on the
+disk - if the writer falls behind and the ring fills up, hops are dropped and
+counted instead.
+
+Audio goes to a rotating set of WAV files, FileSeconds long each, and enough
+of them are kept to cover the last Minutes.  Next to each is a .ts file with
+the clock time of every hop in it, as little endian doubles.
+"""
+import os
+import glob
+import time
+import struct
+import logging
+import threading
+
+import numpy as np
+
+from lib import clock
+
+
+logger = logging.getLogger(__name__)
+
+
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+# Sizes written until the file is closed, anything reading it before then has to go by its length
+UNKNOWN_SIZE = 0xffffffff
+
+
+class AudioTee(threading.Thread):
+    """Writes hops to rotating WAV files from a background thread
+
+    write() is called from the capture loop with each hop and only copies it
+    into the ring, never waiting.  Hops it has no room for are counted in
+    dropped, and hops lost to errors writing the files in failed.
+    """
+    def __init__(self, directory, sample_rate, frames, channels=1, minutes=10, file_seconds=60, buffer_hops=256):
+        super().__init__(name='AudioTee', daemon=True)
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.frames = frames
+        self.channels = channels
+        self.hops_per_file = max(1, int(file_seconds * sample_rate / frames))
+        self.max_files = max(1, int(np.ceil(minutes * 60 / file_seconds)))
+        self.size = buffer_hops
+        self.buffer = np.zeros((buffer_hops, frames * channels), dtype='<i2')
+        self.timestamps = np.zeros(buffer_hops, dtype='<f8')
+        self.write_pos = 0
+        self.read_pos = 0
+        self.ready = threading.Event()
+        self.stop_event = threading.Event()
+        self.fp = self.ts_fp = None
+        self.file_hops = 0
+        self.files = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.logged_dropped = 0
+        self.prev_log_time = 0
+        # Set if the writer thread died, after which everything is dropped
+        self.crashed = False
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a tee from the Capture.Tee config section, or None if there isn't one"""
+        capconfig = config['Capture']
+        tconfig = capconfig.get('Tee')
+        if not tconfig or not tconfig.get('Enabled', True):
+            return None
+        return cls(
+            tconfig.get('Directory', 'captures'),
+            capconfig['SampleRate'],
+            int(capconfig['SampleRate'] / capconfig['FPS']),
+            channels=capconfig.get('Channels', 1),
+            minutes=tconfig.get('Minutes', 10),
+            file_seconds=tconfig.get('FileSeconds', 60),
+            buffer_hops=tconfig.get('BufferHops', 256),
+        )
+
+    def write(self, hop, timestamp=None):
+        """Queue a hop to be written, returning False if it had to be dropped
+
+        Several hops end to end, from an input catching up, are queued one by
+        one, timestamped as if they had arrived a hop apart.
+        """
+        if hop.shape[-1] > self.frames:
+            timestamp = clock.time() if timestamp is None else timestamp
+            hops = hop.shape[-1] // self.frames
+            queued = True
+            for i in range(hops):
+                start = i * self.frames
+                hop_time = timestamp - (hops - 1 - i) * self.frames / self.sample_rate
+                queued = self.write(hop[..., start:start + self.frames], hop_time) and queued
+            return queued
+        if self.write_pos - self.read_pos >= self.size:
+            self.dropped += 1
+            if self.crashed:
+                # Nothing else is going to say so
+                self._report()
+            return False
+        slot = self.write_pos % self.size
+        if self.channels == 1:
+            self.buffer[slot] = hop
+        else:
+            self.buffer[slot].reshape(self.frames, self.channels)[:] = hop.T
+        self.timestamps[slot] = clock.time() if timestamp is None else timestamp
+        self.write_pos += 1
+        self.ready.set()
+        return True
+
+    def run(self):
+        try:
+            while True:
+                self.ready.wait(0.5)
+                self.ready.clear()
+                self._drain()
+                self._report()
+                if self.stop_event.is_set() and self.read_pos == self.write_pos:
+                    break
+            self._close_file()
+        except:
+            self.crashed = True
+            logger.error("Audio tee writer stopped unexpectedly, hops will be dropped from now on", exc_info=True)
+
+    def _drain(self):
+        while self.read_pos < self.write_pos:
+            start = self.read_pos % self.size
+            # Up to the end of the ring, or of the file, in one go
+            count = min(self.write_pos - self.read_pos, self.size - start)
+            try:
+                if self.fp is None:
+                    self._open_file()
+                count = min(count, self.hops_per_file - self.file_hops)
+                self.fp.write(self.buffer[start:start + count].data)
+                self.ts_fp.write(self.timestamps[start:start + count].data)
+                self.file_hops += count
+                self.written += count
+                if self.file_hops >= self.hops_per_file:
+                    self._close_file()
+            except OSError:
+                self.failed += count
+                logger.error("Failed to write captured audio to %s", self.directory, exc_info=True)
+                self._close_file()
+            self.read_pos += count
+
+    def _open_file(self):
+        now = time.time()
+        # The count keeps files started within the same millisecond apart, and in order
+        name = time.strftime('tee-%Y%m%d-%H%M%S', time.localtime(now)) + f'-{int(now * 1000) % 1000:03d}-{self.files:06d}'
+        self.files += 1
+        path = os.path.join(self.directory, name)
+        # Here rather than at startup, so a directory that couldn't be made is tried again
+        os.makedirs(self.directory, exist_ok=True)
+        self.fp = open(path + '.wav', 'wb')
+        self.ts_fp = open(path + '.ts', 'wb')
+        self._write_header(UNKNOWN_SIZE)
+        self.file_hops = 0
+        self._prune()
+
+    def _write_header(self, data_size):
+        block_align = 2 * self.channels
+        riff_size = UNKNOWN_SIZE if data_size == UNKNOWN_SIZE else data_size + WAV_HEADER.size - 8
+        self.fp.write(WAV_HEADER.pack(
+            b'RIFF', riff_size, b'WAVE',
+            b'fmt ', 16, 1, self.channels, self.sample_rate, self.sample_rate * block_align, block_align, 16,
+            b'data', data_size,
+        ))
+
+    def _close_file(self):
+        if self.fp is None:
+            return
+        try:
+            self.fp.seek(0)
+            self._write_header(self.file_hops * self.buffer.shape[1] * 2)
+        except OSError:
+            logger.error("Failed to finish captured audio file %s", self.fp.name, exc_info=True)
+        finally:
+            # Opening the .ts file may have been what failed
+            for fp in (self.fp, self.ts_fp):
+                if fp is None:
+                    continue
+                try:
+                    fp.close()
+                except OSError:
+                    pass
+            self.fp = self.ts_fp = None
+
+    def _prune(self):
+        # Names sort by time, so the oldest go first - including any left by earlier runs
+        files = sorted(glob.glob(os.path.join(self.directory, 'tee-*.wav')))
+        for filename in files[:-self.max_files]:
+            for path in (filename, filename[:-len('.wav')] + '.ts'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    logger.warning("Failed to remove old captured audio %s", path, exc_info=True)
+
+    def _report(self):
+        if self.dropped != self.logged_dropped and time.time() > self.prev_log_time + 10:
+            self.prev_log_time = time.time()
+            self.logged_dropped = self.dropped
+            logger.warning("Audio tee has dropped %d hops, the disk isn't keeping up", self.dropped)
+
+    def stop(self):
+        """Write out everything queued and close the file"""
+        self.stop_event.set()
+        self.ready.set()
+        if self.is_alive():
+            self.join()
+        logger.info("Audio tee wrote %d hops, dropped %d, failed to write %d", self.written, self.dropped, self.failed)
@@ -0,0 +1,52 @@
+"""The time source for anything that depends on the passage of show time
+
+Effects, mapper cooldowns and idle detection read the time from here rather
+than the time module, so that an offline render can swap in a VirtualClock and
+run faster (or slower) than real time.  Things that measure real elapsed time,
+like frame pacing and profiling, should keep using the time module.
+"""
+import time as _time
+
+
+class RealClock:
+    def perf_counter(self):
+        return _time.perf_counter()
+
+    def time(self):
+        return _time.time()
+
+
+class VirtualClock:
+    """A clock that only moves when told to"""
+    def __init__(self, start=0.0):
+        self.now = start
+        self.epoch = _time.time()
+
+    def perf_counter(self):
+        return self.now
+
+    def time(self):
+        return self.epoch + self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+_clock = RealClock()
+
+
+def set_clock(clock):
+    global _clock
+    _clock = clock
+
+
+def get_clock():
+    return _clock
+
+
+def perf_counter():
+    return _clock.perf_counter()
+
+
+def time():
+    return _clock.time()
@@ -1,9 +1,20 @@
 import os
 import json
+import pickle
+import logging
 
 import yaml
 
 
+logger = logging.getLogger(__name__)
+
+# The C loader is much faster, but is only there if PyYAML was built against libyaml
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Bump this whenever what ends up in the cache changes
+CACHE_VERSION = 1
+
+
 def _load_config_file(filename=None):
     if not filename:
         filename = os.path.join('.', 'config', 'main.yaml')
@@ -12,17 +23,126 @@ def _load_config_file(filename=None):
         raise RuntimeError(f"Config file {filename} does not exist")
     with open(filename, 'r') as fp:
         if filename.lower().endswith('.yml') or filename.lower().endswith('.yaml'):
-            return filename, yaml.load(fp)
+            return filename, yaml.load(fp, Loader=YAMLLoader)
         elif filename.lower().endswith('.json'):
             return filename, json.load(fp)
         else:
             raise RuntimeError(f"Config file {filename} is not of a supported type (YAML or JSON)")
 
 
-def load_config(filename=None):
+def file_key(filename):
+    """(path, mtime, size) of a file, to tell whether it has changed"""
+    st = os.stat(filename)
+    return (filename, st.st_mtime_ns, st.st_size)
+
+
+def _load_config(filename, files):
+    # Stat before reading, so that a change made while loading leaves the cache stale rather than wrong
+    # A file that fails to load is still recorded, so that fixing it counts as a change
+    files.append(file_key(filename) if os.path.exists(filename) else (filename, None, None))
     filename, config = _load_config_file(filename=filename)
     if isinstance(config, dict):
         for k, v in list(config.items()):
             if isinstance(v, str) and v.startswith('@'):
-                config[k] = load_config(filename=os.path.join(os.path.dirname(filename), v[1:]))
+                config[k] = _load_config(os.path.join(os.path.dirname(filename), v[1:]), files)
+    return config
+
+
+def _cache_filename(filename):
+    dirname, basename = os.path.split(filename)
+    return os.path.join(dirname, f'.{basename}.cache')
+
+
+def _read_cache(cache_file, filename):
+    """The cache's contents, or None if there isn't one or any file it came from has changed"""
+    try:
+        with open(cache_file, 'rb') as fp:
+            cached = pickle.load(fp)
+        # A cache copied along with the config still describes the original files
+        if cached['version'] != CACHE_VERSION or not cached['files'] or cached['files'][0][0] != filename:
+            return None
+        for key in cached['files']:
+            if file_key(key[0]) != key:
+                return None
+        return cached
+    except FileNotFoundError:
+        return None
+    except:
+        logger.debug("Ignoring unreadable config cache %s", cache_file, exc_info=True)
+        return None
+
+
+def _write_cache(cache_file, files, config):
+    try:
+        tmp_file = f'{cache_file}.{os.getpid()}'
+        with open(tmp_file, 'wb') as fp:
+            pickle.dump({'version': CACHE_VERSION, 'files': files, 'config': config}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except:
+        # Not being able to cache shouldn't stop anything from starting
+        logger.warning("Failed to write the config cache %s", cache_file, exc_info=True)
+
+
+def resolve_mapping(config):
+    """Resolve references between mappings and expand bin ranges, in place
+
+    Program, Cooldown and StateEffects can name another light whose value to
+    use, and bins can contain [start, end] ranges.  Doing this again to a
+    mapping that's already been resolved changes nothing.
+    """
+    mapping = config.get('Mapping') or {}
+    for light, data in mapping.items():
+        program = data.get('Program')
+        while isinstance(program, str):
+            program = mapping.get(program, {}).get('Program')
+        data['Program'] = program or []
+
+        cooldown = data.get('Cooldown')
+        while isinstance(cooldown, str):
+            cooldown = mapping.get(cooldown, {}).get('Cooldown')
+        data['Cooldown'] = cooldown or {}
+
+        state_effects = data.get('StateEffects')
+        while isinstance(state_effects, str):
+            state_effects = mapping.get(state_effects, {}).get('StateEffects')
+        data['StateEffects'] = state_effects or {}
+
+        def make_bins(bins):
+            for b in bins:
+                try:
+                    iter(b)
+                    yield from range(b[0], b[1] + 1)
+                except:
+                    yield b
+        for directive in data['Program']:
+            if directive.get('bins'):
+                directive['bins'] = list(make_bins(directive['bins']))
+    return config
+
+
+def load_config(filename=None, cache=True, files=None):
+    """Load the config, including any files referenced with @, and resolve the mapping
+
+    The result is cached in a hidden file next to the main config file, which
+    is used for as long as none of the files it was loaded from have changed.
+    If files is given, the file_key() of each of those files is added to it.
+    """
+    if not filename:
+        filename = os.path.join('.', 'config', 'main.yaml')
+    filename = os.path.abspath(os.path.expanduser(filename))
+    cache_file = _cache_filename(filename)
+    if files is None:
+        files = []
+    if cache:
+        cached = _read_cache(cache_file, filename)
+        if cached is not None:
+            files.extend(cached['files'])
+            return cached['config']
+
+    start = len(files)
+    config = _load_config(filename, files)
+    if isinstance(config, dict):
+        resolve_mapping(config)
+    if cache:
+        _write_cache(cache_file, files[start:], config)
     return config
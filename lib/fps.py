@@ -21,12 +21,80 @@ class FPSCounter:
         now = time.perf_counter()
         s = now - self.last_log
         if s >= self.log_interval:
-            getattr(logger, self.log_level)("%s FPS: %d", self.name, self.frames / s)
+            self._log(s)
             self.last_log = now
             self.frames = 0
 
+    def _log(self, s):
+        getattr(logger, self.log_level)("%s FPS: %d", self.name, self.frames / s)
+
     def __enter__(self):
         return self
 
     def __exit__(self, *args):
         self.update()
+
+
+class FrameClock(FPSCounter):
+    """Paces a loop at a fixed frame rate
+
+    Entering the clock marks the start of a frame, leaving it sleeps until the
+    frame's deadline.  Deadlines are kept on a fixed grid of 1/fps so that the
+    cadence doesn't drift.  A frame that ends after its deadline is counted as
+    late, and any whole periods it overran are counted as missed - those frames
+    are skipped rather than run back to back to catch up.
+    """
+    def __init__(self, name, fps, spin_time=0.0005, **kwargs):
+        super().__init__(name, **kwargs)
+        self.fps = fps
+        self.period = 1.0 / fps
+        # Sleeping is only accurate to around a millisecond, so sleep until
+        # just before the deadline and spin for the rest
+        self.spin_time = spin_time
+        self.deadline = None
+        self.frame_start = None
+        self.late = self.missed = 0
+        self.total_frames = self.total_late = self.total_missed = 0
+
+    def _log(self, s):
+        getattr(logger, self.log_level)(
+            "%s FPS: %d (late: %d, missed: %d)",
+            self.name, self.frames / s, self.late, self.missed
+        )
+        self.late = self.missed = 0
+
+    def reset(self):
+        self.deadline = None
+
+    def sleep_until(self, deadline):
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin_time:
+            time.sleep(remaining - self.spin_time)
+        while time.perf_counter() < deadline:
+            pass
+
+    def tick(self):
+        now = time.perf_counter()
+        if self.deadline is None:
+            self.deadline = now + self.period
+        self.total_frames += 1
+        if now > self.deadline:
+            missed = int((now - self.deadline) / self.period)
+            self.late += 1
+            self.missed += missed
+            self.total_late += 1
+            self.total_missed += missed
+            self.deadline += (missed + 1) * self.period
+        else:
+            self.sleep_until(self.deadline)
+            self.deadline += self.period
+        self.update()
+
+    def __enter__(self):
+        self.frame_start = time.perf_counter()
+        if self.deadline is None:
+            self.deadline = self.frame_start + self.period
+        return self
+
+    def __exit__(self, *args):
+        self.tick()
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class Frame:
+    """Data passed through the tasks for a single frame
+
+    One frame object is reused for every iteration of the loop, so the spectrum
+    lives in a preallocated buffer and reset() is called at the start of each
+    frame rather than building a new one.
+
+    audio           ndarray (fft_bins,) or None - smoothed mel spectrum, 0-1
+    channel_audio   ndarray (channels, fft_bins) or None - the spectrum of each
+                    capture channel, only when there's more than one
+    is_onset        bool or None - an onset was detected in this frame
+    is_beat         bool or None - a beat was detected in this frame
+    pitch           float or None - smoothed pitch as a MIDI note number
+    idle_for        float or None - seconds the audio has been below the idle threshold
+    dead_for        float or None - seconds the audio has been silent
+    audio_v_sum     float or None - sum of the spectrum
+    audio_v_avg     float or None - average of the spectrum
+    effects_data    dict - serialized active effects, by effect ID
+    rendered_state  dict or None - light state sent out this frame, by light name
+
+    Setting audio or channel_audio copies into the frame's buffers, and setting
+    audio to None marks the frame as having no audio on any channel.  Items can also be read like a dict (frame['idle_for']),
+    which is what mapping expressions use.
+    """
+    __slots__ = (
+        '_audio', 'has_audio', '_channel_audio', 'has_channel_audio',
+        'is_onset', 'is_beat', 'pitch',
+        'idle_for', 'dead_for', 'audio_v_sum', 'audio_v_avg',
+        'effects_data', 'rendered_state',
+    )
+
+    # Fields that are copied as-is, everything except the spectrum and effects
+    SCALARS = (
+        'is_onset', 'is_beat', 'pitch',
+        'idle_for', 'dead_for', 'audio_v_sum', 'audio_v_avg',
+        'rendered_state',
+    )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get('Processors', {}).get('Smoothing', {}).get('FFTBins', 24),
+            config.get('Capture', {}).get('Channels', 1),
+        )
+
+    def __init__(self, fft_bins, channels=1):
+        self._audio = np.zeros(fft_bins)
+        self._channel_audio = np.zeros((channels, fft_bins)) if channels > 1 else None
+        self.effects_data = {}
+        self.reset()
+
+    def reset(self):
+        self.has_audio = self.has_channel_audio = False
+        for k in self.SCALARS:
+            setattr(self, k, None)
+        self.effects_data.clear()
+
+    @property
+    def audio(self):
+        return self._audio if self.has_audio else None
+
+    @audio.setter
+    def audio(self, value):
+        if value is None:
+            self.has_audio = self.has_channel_audio = False
+        else:
+            self._audio[:] = value
+            self.has_audio = True
+
+    @property
+    def channel_audio(self):
+        return self._channel_audio if self.has_channel_audio else None
+
+    @channel_audio.setter
+    def channel_audio(self, value):
+        if value is None or self._channel_audio is None:
+            self.has_channel_audio = False
+        else:
+            self._channel_audio[:] = value
+            self.has_channel_audio = True
+
+    def copy_from(self, other):
+        self.audio = other.audio
+        self.channel_audio = other.channel_audio
+        for k in self.SCALARS:
+            setattr(self, k, getattr(other, k))
+        self.effects_data.clear()
+        self.effects_data.update(other.effects_data)
+
+    def to_dict(self):
+        out = {k: getattr(self, k) for k in self.SCALARS}
+        out['audio'] = self._audio.tolist() if self.has_audio else None
+        if self._channel_audio is not None:
+            out['channel_audio'] = self._channel_audio.tolist() if self.has_channel_audio else None
+        out['effects_data'] = dict(self.effects_data)
+        return out
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
@@ -4,9 +4,12 @@ import logging
 import time
 import subprocess
 import re
+import json
 
 from dmxpy.DmxPy import DmxPy
 
+from lib import clock
+
 
 logger = logging.getLogger(__name__)
 hexint = lambda v: int(v, 16)
@@ -24,9 +27,28 @@ class _DMXSink:
         self.data = {}
 
 
+class DMXTrace:
+    """Records every DMX frame sent, one JSON object per line
+
+    Each line holds the show clock time, device name and the channels sent.
+    """
+    def __init__(self, filename):
+        self.fp = open(filename, 'w')
+        self.frames = 0
+
+    def write(self, device, data):
+        self.fp.write(json.dumps({'t': round(clock.perf_counter(), 6), 'device': device, 'channels': data}) + '\n')
+        self.frames += 1
+
+    def close(self):
+        self.fp.close()
+
+
 class DMXDevice:
-    def __init__(self, spec):
+    def __init__(self, spec, name=None, trace=None):
         self.spec = spec
+        self.name = name
+        self.trace = trace
         self.impl = None
         self.last_attempt = None
         self.last_send = None
@@ -134,14 +156,28 @@ class DMXDevice:
 
         raise RuntimeError(f"Can't find USB device {name}")
 
+    def close(self):
+        """Let go of the serial port, it's opened again if anything is rendered after"""
+        port = getattr(self.impl, 'serial', None)
+        if port is not None:
+            try:
+                port.close()
+            except:
+                logger.warning("Failed to close DMX device %s", self.spec, exc_info=True)
+        self.impl = None
+
     def setChannel(self, chan, value):
         self.data[chan] = value
 
     def render(self):
         if self.data:
+            if self.trace:
+                self.trace.write(self.name, self.data)
             dmx = self.dmx_impl
             if dmx:
                 for k, v in self.data.items():
                     dmx.setChannel(k, v)
                 dmx.render()
                 self.data = {}
+            elif self.trace:
+                self.data = {}
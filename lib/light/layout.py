@@ -0,0 +1,151 @@
+"""Compiled channel layouts for DMX light types
+
+The Functions of a light type are compiled once into a ChannelLayout, which is
+shared by every light of that type.  Everything the per-frame code needs -
+channel offsets, inversion, the function type, reset ranges and value maps - is
+worked out and checked up front, so a mistake in types.yaml is an error at
+startup (or reload) rather than in the middle of a show.
+"""
+import math
+import numbers
+
+
+RANGE = 0
+STATIC = 1
+BOOLEAN = 2
+
+TYPES = {'range': RANGE, 'static': STATIC, 'boolean': BOOLEAN}
+
+
+class Channel:
+    """One function of a light type
+
+    offset      channel offset from the light's address (channel - 1)
+    kind        RANGE, STATIC or BOOLEAN
+    resets      (min, max) of values that reset the light, or None
+    map         {name: (min, max)} of named values, or None
+    maps        ((when_function, min, max, map), ...) - map applies while
+                when_function's value is between min and max
+    """
+    __slots__ = ('name', 'offset', 'invert', 'kind', 'speed', 'resets', 'map', 'maps')
+
+    def __init__(self, name, offset, invert, kind, speed, resets, map, maps):
+        self.name = name
+        self.offset = offset
+        self.invert = invert
+        self.kind = kind
+        self.speed = speed
+        self.resets = resets
+        self.map = map
+        self.maps = maps
+
+
+class ChannelLayout:
+    """All the functions of a light type, compiled
+
+    channels    {name: Channel}
+    order       the channels in the order they're configured
+    speed       the speed Channel, or None
+    resetting   the channels with resets
+    """
+    __slots__ = ('type_name', 'num_channels', 'channels', 'order', 'speed', 'resetting')
+
+    def __init__(self, type_name, num_channels, channels):
+        self.type_name = type_name
+        self.num_channels = num_channels
+        self.channels = channels
+        self.order = tuple(channels.values())
+        self.speed = channels.get('speed')
+        self.resetting = tuple(c for c in self.order if c.resets)
+
+    @classmethod
+    def compile(cls, type_name, type_config):
+        def error(msg):
+            return RuntimeError(f"Light type {type_name}: {msg}")
+
+        num_channels = type_config.get('Channels')
+        if not isinstance(num_channels, int) or not 1 <= num_channels <= 512:
+            raise error(f"Channels must be a number of channels, not {num_channels!r}")
+        functions = type_config.get('Functions')
+        if not isinstance(functions, dict) or not functions:
+            raise error("no Functions are defined")
+
+        maps = {}
+        for name, fn in functions.items():
+            if not isinstance(fn, dict):
+                raise error(f"function {name} must be a mapping")
+            if fn.get('map') is not None:
+                maps[name] = _compile_map(fn['map'], error, name)
+
+        channels = {}
+        for name, fn in functions.items():
+            channel = fn.get('channel')
+            if not isinstance(channel, int) or not 1 <= channel <= num_channels:
+                raise error(f"function {name} has channel {channel!r}, it must be 1 - {num_channels}")
+
+            kind = TYPES.get(fn.get('type', 'range'))
+            if kind is None:
+                raise error(f"function {name} has unknown type {fn.get('type')!r}, it must be one of {', '.join(TYPES)}")
+
+            speed = fn.get('speed')
+            if speed is not None:
+                if not (isinstance(speed, (list, tuple)) and len(speed) == 2 and all(isinstance(v, numbers.Real) and v > 0 for v in speed)):
+                    raise error(f"function {name} speed must be [slowest, fastest] in seconds, not {speed!r}")
+                speed = tuple(speed)
+
+            resets = fn.get('resets')
+            if resets is True:
+                resets = (1, math.inf)
+            elif resets:
+                resets = _compile_range(resets, error, f"function {name} resets")
+            else:
+                resets = None
+
+            multi_maps = None
+            if fn.get('maps'):
+                multi_maps = []
+                for multi_map in fn['maps']:
+                    try:
+                        when_fn, when_value = multi_map['when']
+                    except (KeyError, TypeError, ValueError):
+                        raise error(f"function {name} maps need a when of [function, value]")
+                    if when_fn not in functions:
+                        raise error(f"function {name} has a map for unknown function {when_fn}")
+                    if when_fn in maps:
+                        if when_value not in maps[when_fn]:
+                            raise error(f"function {name} has a map for {when_fn} {when_value!r}, which {when_fn} doesn't have")
+                        lo, hi = maps[when_fn][when_value]
+                    elif isinstance(when_value, numbers.Real):
+                        lo = hi = when_value
+                    else:
+                        raise error(f"function {name} has a map for {when_fn} {when_value!r}, but {when_fn} has no map")
+                    multi_maps.append((when_fn, lo, hi, _compile_map(multi_map.get('map'), error, name)))
+                multi_maps = tuple(multi_maps)
+
+            channels[name] = Channel(name, channel - 1, bool(fn.get('invert')), kind, speed, resets, maps.get(name), multi_maps)
+        return cls(type_name, num_channels, channels)
+
+
+def _compile_range(value, error, what):
+    if not (isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(v, int) for v in value)
+            and 0 <= value[0] <= value[1] <= 255):
+        raise error(f"{what} must be [min, max] within 0 - 255, not {value!r}")
+    return tuple(value)
+
+
+def _compile_map(map_, error, name):
+    if not isinstance(map_, dict):
+        raise error(f"function {name} map must be a mapping of names to [min, max]")
+    return {k: _compile_range(v, error, f"function {name} value {k}") for k, v in map_.items()}
+
+
+# Layouts already compiled, by type name, along with the config they were compiled from
+_layouts = {}
+
+
+def get_layout(type_name, type_config):
+    """The compiled layout for a light type, shared with other lights of the same type"""
+    cached = _layouts.get(type_name)
+    if cached is None or cached[0] != type_config:
+        cached = _layouts[type_name] = (type_config, ChannelLayout.compile(type_name, type_config))
+    return cached[1]
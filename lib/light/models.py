@@ -1,5 +1,7 @@
 import logging
 
+from .layout import get_layout, STATIC, BOOLEAN
+
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +42,7 @@ class DMXLight(Light):
         self.device_name = light_config.get('Device', 'default')
         self.num_channels = type_config['Channels']
         self.functions = type_config['Functions']
+        self.layout = get_layout(self.type_name, type_config)
         self.initialize = dict(type_config.get('Initialize', {}), **light_config.get('Initialize', {}))
         self.address = light_config['Address']
         # TODO: light config RestrictPosition, or in auto?
@@ -64,60 +67,50 @@ class DMXLight(Light):
         return out
 
     def get_dmx(self, speed_only=False):
-        out = {}
-        for fn, data in self.functions.items():
-            if speed_only and fn != 'speed':
-                continue
-            v = self.state.get(fn, 0)
-            if data.get('invert'):
-                v = 255 - v
-            out[(self.address - 1) + data['channel']] = v
-        return out
+        base = self.address - 1
+        state = self.state
+        if speed_only:
+            c = self.layout.speed
+            if c is None:
+                return {}
+            return {base + c.offset: 255 - state[c.name] if c.invert else state[c.name]}
+        return {base + c.offset: 255 - state[c.name] if c.invert else state[c.name] for c in self.layout.order}
 
     def _get_map(self, prop, multi=True):
-        fn = self.functions.get(prop, {})
-        if 'map' in fn:
-            return fn['map']
-        if multi and 'maps' in fn:
-            for multi_map in fn['maps']:
-                when_prop, when_expected_val = multi_map['when']
-                when_current_val = self.state.get(when_prop)
-                when_prop_map = self._get_map(when_prop)
-                if when_prop_map:
-                    for k, v in when_prop_map.items():
-                        if when_current_val >= v[0] and when_current_val <= v[1] and k == when_expected_val:
-                            when_expected_val = v[0]
-                            break
-                if when_expected_val == when_current_val:
-                    return multi_map['map']
+        c = self.layout.channels.get(prop)
+        if c is None:
+            return None
+        if c.map is not None or not multi or not c.maps:
+            return c.map
+        for when_fn, lo, hi, map_ in c.maps:
+            if lo <= self.state.get(when_fn) <= hi:
+                return map_
 
     def set_state(self, **kwargs):
+        channels = self.layout.channels
+        state = self.state
         choice_map_props = []
         for k, v in kwargs.items():
-            fn = self.functions.get(k)
-            if not fn:
+            c = channels.get(k)
+            if c is None:
                 continue
-            if fn.get('type') == 'static':
-                if isinstance(v, str):
+            if c.kind == STATIC and isinstance(v, str):
+                if c.map is not None:
                     # If there's a single map, use it
-                    map_ = self._get_map(k, multi=False)
-                    if map_:
-                        if v not in map_:
-                            logger.error("%s: value '%s' not in prop map for %s", self, v, k)
-                        else:
-                            self.state[k] = map_[v][0]
-                    elif fn.get('maps'):
-                        # Set other props before figuring out what map to use
-                        choice_map_props.append(k)
+                    if v not in c.map:
+                        logger.error("%s: value '%s' not in prop map for %s", self, v, k)
                     else:
-                        logger.error("%s: can't set value '%s' for %s", self, v, k)
+                        state[k] = c.map[v][0]
+                elif c.maps:
+                    # Set other props before figuring out what map to use
+                    choice_map_props.append(k)
                 else:
-                    self.state[k] = v
-            elif fn.get('type') == 'boolean':
-                self.state[k] = int(bool(v))
+                    logger.error("%s: can't set value '%s' for %s", self, v, k)
+            elif c.kind == BOOLEAN:
+                state[k] = int(bool(v))
             else:
-                # Probably range
-                self.state[k] = v
+                # Range, or a static set to a raw value
+                state[k] = v
 
         for k in choice_map_props:
             # Can assume that k is both in functions and kwargs, and that v is a string
@@ -127,35 +120,56 @@ class DMXLight(Light):
                 if v not in map_:
                     logger.error("%s: value '%s' not in prop map for %s", self, v, k)
                 else:
-                    self.state[k] = map_[v][0]
+                    state[k] = map_[v][0]
 
-        for k, v in self.state.items():
-            if v != self.last_state.get(k):
-                self.diff_state[k] = v
+        # Only what was just set can have changed
+        last_state = self.last_state
+        for k in kwargs:
+            if k in channels and state[k] != last_state.get(k):
+                self.diff_state[k] = state[k]
 
     def mark_sent(self):
-        for k, v in self.diff_state.items():
-            fn = self.functions.get(k)
-            if not fn:
-                continue
-            if fn.get('resets') is True:
-                if v:
-                    return self.init_state()
-            elif fn.get('resets'):
-                if v >= fn['resets'][0] and v <= fn['resets'][1]:
-                    return self.init_state()
+        diff_state = self.diff_state
+        for c in self.layout.resetting:
+            v = diff_state.get(c.name)
+            if v is not None and c.resets[0] <= v <= c.resets[1]:
+                return self.init_state()
         self.last_state = self.state.copy()
         self.diff_state = {}
 
     @classmethod
-    def send_batch(cls, devices, lights):
+    def send_batch(cls, devices, lights, lock=None):
+        """Send every light that changed, returning what changed by light name
+
+        With a lock, it's held while the DMX values are taken and the lights
+        marked sent, so nothing set in between is lost, but not for the writes.
+        """
+        if lock is None:
+            speeds, dev_data, out = cls._collect_batch(lights)
+        else:
+            with lock:
+                speeds, dev_data, out = cls._collect_batch(lights)
+
+        for dname, sd in speeds:
+            for chan, val in sd.items():
+                devices[dname].setChannel(chan, val)
+            devices[dname].render()
+        for dname, data in dev_data.items():
+            for chan, val in data.items():
+                devices[dname].setChannel(chan, val)
+            devices[dname].render()
+
+        return out
+
+    @classmethod
+    def _collect_batch(cls, lights):
+        # Speed goes out first, on its own, so the move that follows happens at that speed
+        speeds = []
         for l in lights:
             if l.diff_state:
                 sd = l.get_dmx(speed_only=True)
                 if sd:
-                    for chan, val in sd.items():
-                        devices[l.device_name].setChannel(chan, val)
-                    devices[l.device_name].render()
+                    speeds.append((l.device_name, sd))
 
         out = {}
         dev_data = {}
@@ -164,9 +178,4 @@ class DMXLight(Light):
                 out.setdefault(l.name, {}).update(l.diff_state)
                 dev_data.setdefault(l.device_name, {}).update(l.get_dmx())
                 l.mark_sent()
-        for dname, data in dev_data.items():
-            for chan, val in data.items():
-                devices[dname].setChannel(chan, val)
-            devices[dname].render()
-
-        return out
+        return speeds, dev_data, out
@@ -0,0 +1,132 @@
+import time
+import logging
+import threading
+
+from lib.fps import FPSCounter, FrameClock
+from lib.stats import timings
+
+
+logger = logging.getLogger(__name__)
+
+
+class Handoff:
+    """Single slot, latest-value handoff of frames between two threads
+
+    The handoff holds its own frame which put() copies into and get() copies
+    out of, so neither side sees the other's frame change under it.  Putting a
+    frame replaces whatever the consumer hasn't picked up yet, so a slow
+    consumer only ever sees the newest one and never builds a backlog.
+    Replaced frames are counted in dropped.
+    """
+    def __init__(self, frame):
+        self.cond = threading.Condition()
+        self.frame = frame
+        self.fresh = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self.cond:
+            if self.fresh:
+                self.dropped += 1
+            self.frame.copy_from(frame)
+            self.fresh = True
+            self.cond.notify_all()
+
+    def get(self, frame, timeout=None):
+        """Copy the newest frame not yet taken into frame
+
+        Returns False if there wasn't one.  With a timeout of 0 this does not
+        block.
+        """
+        with self.cond:
+            if not self.fresh and timeout != 0:
+                self.cond.wait_for(lambda: self.fresh, timeout)
+            if not self.fresh:
+                return False
+            self.fresh = False
+            frame.copy_from(self.frame)
+            return True
+
+
+class StageWorker(threading.Thread):
+    """Runs a single task in its own thread
+
+    A stage with an input and no fps runs once per new input frame, otherwise
+    it runs at fps using the newest input it has seen (if any).  Each run
+    starts from a copy of that input, and the result is put to the output.
+    If there's a quality controller, the task is kept at its level and the
+    time each run spends working (less the task's wait_time) is reported to
+    it, and if there's a config reloader the task applies reloads between
+    runs.
+    """
+    def __init__(self, task, stop_event, new_frame, input=None, fps=None, quality=None, reloader=None):
+        super().__init__(name=task.__class__.__name__, daemon=True)
+        self.task = task
+        self.stop_event = stop_event
+        self.input = input
+        self.input_frame = new_frame()
+        self.frame = new_frame()
+        self.output = Handoff(new_frame())
+        if fps:
+            self.clock = FrameClock(self.name, fps)
+        else:
+            self.clock = FPSCounter(self.name)
+        self.timer = timings.timer(self.name, 'run')
+        self.quality = quality
+        self.reloader = reloader
+
+    def _get_input(self):
+        if self.input is None:
+            self.frame.reset()
+            return True
+        if isinstance(self.clock, FrameClock):
+            # Carry on with the last input if there's nothing new
+            self.input.get(self.input_frame, timeout=0)
+        elif not self.input.get(self.input_frame, timeout=0.1):
+            return False
+        self.frame.copy_from(self.input_frame)
+        return True
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if not self._get_input():
+                continue
+            with self.clock:
+                start = time.perf_counter()
+                try:
+                    if self.reloader:
+                        self.reloader.sync(self.task)
+                    if self.quality:
+                        self.quality.sync(self.task)
+                    with self.timer:
+                        self.task.run(self.frame)
+                except:
+                    logger.error("Failure in %s", self.name, exc_info=True)
+                self.output.put(self.frame)
+                if self.quality:
+                    self.quality.update(time.perf_counter() - start - self.task.wait_time)
+
+
+class Pipeline:
+    """Chains tasks into stage workers joined by handoffs
+
+    Stages are given as (task, fps) pairs, fps being None for stages that
+    should just run whenever the previous stage produces something.  new_frame
+    is called to create each of the frames the stages and handoffs use.
+    """
+    def __init__(self, stages, stop_event, new_frame, quality=None, reloader=None):
+        self.workers = []
+        prev = None
+        for task, fps in stages:
+            worker = StageWorker(task, stop_event, new_frame, input=prev, fps=fps, quality=quality, reloader=reloader)
+            self.workers.append(worker)
+            prev = worker.output
+        self.output = prev
+
+    def start(self):
+        for w in self.workers:
+            w.start()
+
+    def join(self):
+        for w in self.workers:
+            w.join()
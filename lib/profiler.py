@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import cProfile
+import pstats
+import logging
+import threading
+import collections
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Sampler(threading.Thread):
+    """Samples the stacks of all other threads at a fixed interval
+
+    Stacks are kept in collapsed form (root;...;leaf), as used by flamegraph
+    tools, with the thread name as the root.
+    """
+    def __init__(self, interval):
+        super().__init__(name='ProfileSampler', daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.stacks = collections.Counter()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class _Session:
+    def __init__(self, frames, mode, output_dir, interval):
+        self.frames = frames
+        self.mode = mode
+        self.output_dir = output_dir
+        self.interval = interval
+        self.frames_done = 0
+        self.profile = None
+        self.sampler = None
+
+    def start(self):
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+        else:
+            self.sampler = _Sampler(self.interval)
+            self.sampler.start()
+
+    def finish(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        basename = os.path.join(self.output_dir, time.strftime('profile-%Y%m%d-%H%M%S'))
+        if self.profile:
+            out = [basename + '.pstats', basename + '.txt']
+            self.profile.dump_stats(out[0])
+            with open(out[1], 'w') as fp:
+                pstats.Stats(self.profile, stream=fp).sort_stats('cumulative').print_stats(50)
+        else:
+            self.sampler.stop()
+            out = [basename + '.collapsed']
+            with open(out[0], 'w') as fp:
+                for stack, count in sorted(self.sampler.stacks.items()):
+                    fp.write(f'{stack} {count}\n')
+        return out
+
+
+class FrameProfiler:
+    """Profiles the next N frames of a running loop on request
+
+    Requests can come from any thread, the session starts at the beginning of
+    the next frame of the loop using this as a context manager.  The cprofile
+    mode only sees the thread running the loop, the sample mode samples the
+    stacks of every thread every interval seconds.  With threaded set, as when
+    the stages are pipelined, the loop's thread doesn't run the stages worth
+    profiling, so cprofile is refused and sample is the default.
+    """
+    MODES = ('cprofile', 'sample')
+
+    def __init__(self, output_dir='profiles', interval=0.001):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = None
+        self.session = None
+        self.last_output = None
+        self.threaded = False
+
+    def configure(self, config):
+        pconfig = config.get('Profiling', {})
+        self.output_dir = pconfig.get('Directory', self.output_dir)
+        self.interval = pconfig.get('Interval', self.interval)
+
+    def request(self, frames=60, mode=None):
+        if mode is None:
+            mode = 'sample' if self.threaded else 'cprofile'
+        if mode not in self.MODES:
+            raise ValueError(f"Invalid profiling mode {mode}")
+        frames = int(frames)
+        if frames < 1:
+            raise ValueError("Must profile at least one frame")
+        if mode == 'cprofile' and self.threaded:
+            raise ValueError("cprofile only sees the main loop's thread, and capture, mapping and lights "
+                             "run in threads of their own when pipelined - use the sample mode")
+        with self.lock:
+            if self.pending or self.session:
+                raise RuntimeError("A profiling session is already in progress")
+            self.pending = _Session(frames, mode, self.output_dir, self.interval)
+        return self.status()
+
+    def status(self):
+        session = self.session or self.pending
+        return {
+            'active': session is not None,
+            'mode': session.mode if session else None,
+            'frames_left': session.frames - session.frames_done if session else 0,
+            'last_output': self.last_output,
+        }
+
+    def __enter__(self):
+        if self.pending is not None and self.session is None:
+            with self.lock:
+                self.session, self.pending = self.pending, None
+            logger.info("Profiling the next %d frames (%s)", self.session.frames, self.session.mode)
+            self.session.start()
+        if self.session is not None and self.session.profile:
+            self.session.profile.enable()
+        return self
+
+    def __exit__(self, *args):
+        session = self.session
+        if session is None:
+            return
+        if session.profile:
+            session.profile.disable()
+        session.frames_done += 1
+        if session.frames_done >= session.frames:
+            if session.sampler:
+                session.sampler.stop_event.set()
+            with self.lock:
+                self.session = None
+            # Don't hold up the loop while the results are written out
+            threading.Thread(target=self._finish, args=(session,), daemon=True).start()
+
+    def _finish(self, session):
+        try:
+            self.last_output = session.finish()
+            logger.info("Profile written to %s", ', '.join(self.last_output))
+        except:
+            logger.error("Failed to write profile", exc_info=True)
+
+
+profiler = FrameProfiler()
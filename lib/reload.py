@@ -0,0 +1,105 @@
+"""Reloading the config while running
+
+A ConfigReloader polls the files the config was loaded from.  When any of
+them changes it loads the new config and asks each task to prepare for it with
+prepare_reload(), all in its own thread so that parsing, building lights and
+compiling expressions never hold up a frame.  Each task then swaps its prepared
+reload in with apply_reload(), called from sync() in the thread that runs the
+task, between two of its frames.
+"""
+import logging
+import threading
+
+from lib.config import load_config, file_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigReloader(threading.Thread):
+    """Watches the config files and prepares reloads in the background
+
+    A reload is all or nothing: if the config can't be loaded or any task
+    fails to prepare for it, the running config is kept and the error logged,
+    and nothing is tried again until the files change again.  A new reload
+    isn't prepared until every task has applied the previous one, so that
+    each is always prepared against what the tasks are actually running.
+    """
+    def __init__(self, filename, tasks, files, interval=1.0, cache=True):
+        super().__init__(name='ConfigReloader', daemon=True)
+        self.filename = filename
+        self.tasks = tasks
+        self.interval = interval
+        self.cache = cache
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.files = files
+        self.reloads = 0
+
+    @classmethod
+    def from_config(cls, filename, config, tasks, files, cache=True):
+        """Build a reloader from the Reload config section, or None if it's turned off
+
+        files are the keys of the files the running config was loaded from,
+        as filled in by load_config().
+        """
+        rconfig = config.get('Reload', {})
+        if not rconfig.get('Enabled', True):
+            return None
+        return cls(filename, tasks, files, interval=rconfig.get('Interval', 1.0), cache=cache)
+
+    def _changed(self):
+        for key in self.files:
+            try:
+                current = file_key(key[0])
+            except OSError:
+                current = (key[0], None, None)
+            if current != key:
+                return True
+        return False
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            with self.lock:
+                if self.pending:
+                    continue
+            if self._changed():
+                self._prepare()
+
+    def _prepare(self):
+        files = []
+        try:
+            config = load_config(self.filename, cache=self.cache, files=files)
+            pending = {}
+            for task in self.tasks.values():
+                plan = task.prepare_reload(config)
+                if plan is not None:
+                    pending[task] = plan
+        except:
+            logger.error("Failed to reload the config from %s, carrying on with the old one", self.filename, exc_info=True)
+            return
+        finally:
+            self.files = files
+
+        logger.info("Reloading the config from %s", self.filename)
+        self.reloads += 1
+        with self.lock:
+            self.pending = pending
+
+    def sync(self, task):
+        """Apply the task's part of a prepared reload, if there is one"""
+        if not self.pending:
+            return
+        with self.lock:
+            plan = self.pending.pop(task, None)
+        if plan is not None:
+            try:
+                task.apply_reload(plan)
+            except:
+                logger.error("Failed to apply the reloaded config to %s", task.__class__.__name__, exc_info=True)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
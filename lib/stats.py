@@ -0,0 +1,137 @@
+import threading
+import time
+
+
+class LatencyHistogram:
+    """Log-linear (HDR style) latency histogram over a sliding window
+
+    Values are recorded in microseconds.  Below 2**sub_bits each microsecond
+    gets its own bucket, above that every power of two is split into
+    2**(sub_bits - 1) buckets, so the relative error stays under
+    2**-(sub_bits - 1) whatever the magnitude.  The window is made of a ring of
+    sub-histograms that are cleared as it moves on, so old samples age out in
+    steps of window / slots.
+    """
+    def __init__(self, window=10, slots=10, sub_bits=5, max_value=60):
+        self.sub_bits = sub_bits
+        self.half = 1 << (sub_bits - 1)
+        self.max_us = int(max_value * 1e6)
+        self.num_buckets = self._index(self.max_us) + 1
+        self.slot_length = window / slots
+        self.counts = [[0] * self.num_buckets for _ in range(slots)]
+        self.maxes = [0] * slots
+        self.slot = 0
+        self.slot_end = time.perf_counter() + self.slot_length
+        self.lock = threading.Lock()
+
+    def _index(self, v):
+        e = v.bit_length() - self.sub_bits
+        if e <= 0:
+            return v
+        return e * self.half + (v >> e)
+
+    def _value(self, idx):
+        # Upper bound of the bucket
+        if idx < (1 << self.sub_bits):
+            return idx
+        e, m = divmod(idx - self.half, self.half)
+        return ((m + self.half + 1) << e) - 1
+
+    def _rotate(self, now):
+        if now - self.slot_end >= self.slot_length * len(self.counts):
+            # Idle for longer than the whole window, everything is stale
+            self.counts = [[0] * self.num_buckets for _ in self.counts]
+            self.maxes = [0] * len(self.counts)
+            self.slot_end = now + self.slot_length
+            return
+        while now >= self.slot_end:
+            self.slot = (self.slot + 1) % len(self.counts)
+            self.counts[self.slot] = [0] * self.num_buckets
+            self.maxes[self.slot] = 0
+            self.slot_end += self.slot_length
+
+    def record(self, seconds):
+        us = min(self.max_us, max(0, int(seconds * 1e6)))
+        with self.lock:
+            self._rotate(time.perf_counter())
+            self.counts[self.slot][self._index(us)] += 1
+            if us > self.maxes[self.slot]:
+                self.maxes[self.slot] = us
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """Return count, the given percentiles and max, in milliseconds"""
+        with self.lock:
+            self._rotate(time.perf_counter())
+            counts = [sum(c) for c in zip(*self.counts)]
+            max_us = max(self.maxes)
+
+        total = sum(counts)
+        out = {'count': total}
+        targets = sorted(percentiles)
+        results = {}
+        seen = 0
+        t = 0
+        for idx, c in enumerate(counts):
+            seen += c
+            while t < len(targets) and total and seen >= total * targets[t] / 100.0:
+                results[targets[t]] = min(self._value(idx), max_us)
+                t += 1
+            if t == len(targets):
+                break
+        for p in percentiles:
+            out[f'p{p}'] = results.get(p, 0) / 1000.0
+        out['max'] = max_us / 1000.0
+        return out
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.record(time.perf_counter() - self.start)
+
+
+class TaskTimings:
+    """Latency histograms for each phase of each task
+
+    Timers are cached per name/phase, and are not reentrant - each one should
+    only be used from the thread that runs that task.
+    """
+    def __init__(self, **histogram_args):
+        self.histogram_args = histogram_args
+        self.histograms = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, phase):
+        key = (name, phase)
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self.lock:
+                hist = self.histograms.setdefault(key, LatencyHistogram(**self.histogram_args))
+        return hist
+
+    def timer(self, name, phase):
+        key = (name, phase)
+        timer = self.timers.get(key)
+        if timer is None:
+            timer = self.timers[key] = _Timer(self.histogram(name, phase))
+        return timer
+
+    def record(self, name, phase, seconds):
+        self.histogram(name, phase).record(seconds)
+
+    def snapshot(self):
+        out = {}
+        for (name, phase), hist in list(self.histograms.items()):
+            out.setdefault(name, {})[phase] = hist.summary()
+        return out
+
+
+timings = TaskTimings()
@@ -5,6 +5,9 @@ logger = logging.getLogger(__name__)
 
 
 class Task:
+    # Time the last run() spent blocked waiting for input, which isn't work the quality controller can shed
+    wait_time = 0.0
+
     def __init__(self, tasks, config):
         self.tasks = tasks
         self.config = config
@@ -12,7 +15,22 @@ class Task:
     def setup(self):
         pass
 
-    def run(self, data):
+    def run(self, frame):
+        pass
+
+    def set_quality(self, level):
+        """Scale back the work done per frame, see lib.adaptive"""
+        pass
+
+    def prepare_reload(self, config):
+        """Do the work for switching to a new config, without touching anything running
+
+        Called from the reloader's thread.  Whatever this returns is passed to
+        apply_reload() between two frames, None meaning there's nothing to do.
+        """
+        return None
+
+    def apply_reload(self, plan):
         pass
 
     def teardown(self):
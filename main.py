@@ -7,8 +7,15 @@ import argparse
 import signal
 import threading
 
+from lib import clock
 from lib.config import load_config
-from lib.fps import FPSCounter
+from lib.fps import FrameClock
+from lib.pipeline import Pipeline
+from lib.stats import timings
+from lib.profiler import profiler
+from lib.frame import Frame
+from lib.adaptive import QualityController
+from lib.reload import ConfigReloader
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -18,11 +25,88 @@ logger = logging.getLogger(__name__)
 def parse_args():
     parser = argparse.ArgumentParser(description="It's time to party!")
     parser.add_argument('-c', '--config-file', help="Path to main config file")
+    parser.add_argument('-p', '--pipelined', action='store_true', help="Run capture, mapping and light output in their own threads")
+    parser.add_argument('-r', '--render', metavar='WAV_FILE', help="Render the lights for an audio file as fast as possible, instead of running live")
+    parser.add_argument('--no-config-cache', action='store_true', help="Always load the config from the YAML files, and don't cache it")
+    parser.add_argument('-t', '--trace', metavar='TRACE_FILE', default='dmx-trace.jsonl', help="Where to write the DMX frames when rendering")
     return parser.parse_args()
 
 
+def run_tasks(tasks, frame, syncs=()):
+    # Everything is synced before anything runs, so all the tasks switch to a reloaded config in the same frame
+    for s in syncs:
+        for t in tasks:
+            s.sync(t)
+    for t in tasks:
+        try:
+            with timings.timer(t.__class__.__name__, 'run'):
+                t.run(frame)
+        except:
+            logger.error("Failure in %s", t.__class__.__name__, exc_info=True)
+
+
+def run_pipelined(tasks, config, fps, stop_event, quality=None, reloader=None):
+    # Capture is paced by the audio device, mapping runs whenever there's a new audio frame,
+    # and light output keeps its own cadence so effects stay smooth even if mapping falls behind
+    pipelined = ['audio', 'mapper', 'lights']
+    pipeline = Pipeline([
+        (tasks['audio'], fps),
+        (tasks['mapper'], None),
+        (tasks['lights'], fps),
+    ], stop_event, lambda: Frame.from_config(config), quality=quality, reloader=reloader)
+    others = [t for k, t in tasks.items() if k not in pipelined]
+    # Only the rest run in this thread, so only sampling can see the stages
+    profiler.threaded = True
+    frame = Frame.from_config(config)
+    pipeline.start()
+    try:
+        while not stop_event.is_set():
+            if pipeline.output.get(frame, timeout=0.1):
+                with profiler:
+                    run_tasks(others, frame, [s for s in (reloader, quality) if s])
+    finally:
+        stop_event.set()
+        pipeline.join()
+
+
+def render_config(config, path, trace):
+    """Switch config over to rendering the audio file at path, writing DMX frames to trace"""
+    config['Capture'].update({'Method': 'file', 'Path': path, 'Format': None, 'Realtime': False, 'Loop': False, 'Process': False, 'Tee': None})
+    config['DMXDevices'] = {k: 'sink' for k in config.get('DMXDevices', {})}
+    config['Render'] = {'Trace': trace}
+
+
+def run_render(tasks, config, stop_event):
+    """Run the tasks until the capture file is finished, returning the number of frames rendered"""
+    # Nothing is paced when rendering, each frame just moves the virtual clock on by the length of one hop
+    vclock = clock.VirtualClock()
+    clock.set_clock(vclock)
+    capture = tasks['audio'].capture
+    hop = capture.frames_per_buffer / config['Capture']['SampleRate']
+    frame = Frame.from_config(config)
+    start = time.perf_counter()
+    frames = 0
+    while not stop_event.is_set():
+        frame.reset()
+        run_tasks(tasks.values(), frame)
+        if capture.finished:
+            break
+        vclock.advance(hop)
+        frames += 1
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "Rendered %d frames (%.1fs of audio) in %.1fs, %d DMX frames written",
+        frames, vclock.now, elapsed, tasks['lights'].trace.frames
+    )
+    return frames
+
+
 def main(args):
-    config = load_config(args.config_file)
+    config_files = []
+    config = load_config(args.config_file, cache=not args.no_config_cache, files=config_files)
+    if args.render:
+        render_config(config, args.render, args.trace)
+    profiler.configure(config)
 
     stop_event = threading.Event()
     def _sig_handler(signo, frame):
@@ -36,34 +120,56 @@ def main(args):
     from components.webgui import WebGUITask
     from components.network import NetworkTask
 
-    fps = FPSCounter('All')
+    fps = config['Capture']['FPS']
+    frame_clock = FrameClock('All', fps)
+    # Rendering isn't real time, so there's nothing to adapt to
+    quality = None if args.render else QualityController.from_config(config)
+    reloader = None
 
     # Initialize tasks first so that the dict can be passed to all tasks, giving them access to other tasks
     tasks = {}
     tasks['audio'] = AudioCaptureTask(tasks, config)
     tasks['mapper'] = MapperTask(tasks, config)
     tasks['lights'] = LightOutputTask(tasks, config)
-    tasks['webgui'] = WebGUITask(tasks, config)
-    tasks['network'] = NetworkTask(tasks, config)
+    if not args.render:
+        tasks['webgui'] = WebGUITask(tasks, config)
+        tasks['network'] = NetworkTask(tasks, config)
 
     try:
         for task in tasks.values():
-            task.setup()
-
-        while not stop_event.is_set():
-            with fps:
-                data = {}
-                for t in tasks.values():
-                    try:
-                        t.run(data)
-                    except:
-                        logger.error("Failure in %s", t.__class__.__name__, exc_info=True)
+            with timings.timer(task.__class__.__name__, 'setup'):
+                task.setup()
+
+        if not args.render:
+            reloader = ConfigReloader.from_config(args.config_file, config, tasks, config_files, cache=not args.no_config_cache)
+            if reloader:
+                reloader.start()
+
+        if args.render:
+            run_render(tasks, config, stop_event)
+        elif args.pipelined:
+            run_pipelined(tasks, config, fps, stop_event, quality, reloader)
+        else:
+            frame = Frame.from_config(config)
+            frame_timer = timings.timer('All', 'frame')
+            syncs = [s for s in (reloader, quality) if s]
+            while not stop_event.is_set():
+                with frame_clock, profiler, frame_timer:
+                    frame.reset()
+                    run_tasks(tasks.values(), frame, syncs)
+                    if quality:
+                        # Only the work counts, not waiting on the audio device
+                        waited = sum(t.wait_time for t in tasks.values())
+                        quality.update(time.perf_counter() - frame_clock.frame_start - waited)
     finally:
+        if reloader:
+            reloader.stop()
         # print("Exiting")
         for t in tasks.values():
             # print("Stop " + t.__class__.__name__)
             try:
-                t.teardown()
+                with timings.timer(t.__class__.__name__, 'teardown'):
+                    t.teardown()
             except:
                 logger.error("Failed to tear down %s", t.__class__.__name__, exc_info=True)
 
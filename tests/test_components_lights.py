@@ -0,0 +1,56 @@
+from unittest import TestCase
+import os
+import threading
+
+from lib.config import load_config
+from lib.frame import Frame
+from components.lights import LightOutputTask
+
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'config-example', 'main.yaml')
+
+
+class _Device:
+    def __init__(self):
+        self.sent = {}
+
+    def setChannel(self, chan, value):
+        self.sent[chan] = value
+
+    def render(self):
+        pass
+
+
+class TestLightOutputTask(TestCase):
+    def setUp(self):
+        self.config = load_config(EXAMPLE_CONFIG, cache=False)
+        self.task = LightOutputTask({}, self.config)
+        self.task.setup()
+        self.task.dmx_devices = {name: _Device() for name in self.task.dmx_devices}
+
+    def test_state_set_while_sending(self):
+        task = self.task
+        light = task.lights['back_1']
+        mark_sent = light.mark_sent
+        threads = []
+
+        def _set_pan():
+            task.set_state('test', 'back_1', {'pan': 99})
+            task._apply_effects(Frame.from_config(self.config))
+
+        def _mark_sent():
+            # Another thread sets the state after the DMX values were taken, before the light is marked sent
+            if not threads:
+                threads.append(threading.Thread(target=_set_pan))
+                threads[0].start()
+                threads[0].join(0.2)
+            mark_sent()
+
+        light.mark_sent = _mark_sent
+        task.run(Frame.from_config(self.config))
+        threads[0].join()
+        self.assertEqual(0, task.dmx_devices[light.device_name].sent[light.address - 1])
+        frame = Frame.from_config(self.config)
+        task.run(frame)
+        self.assertEqual({'pan': 99}, frame.rendered_state['back_1'])
+        self.assertEqual(99, task.dmx_devices[light.device_name].sent[light.address - 1])
@@ -0,0 +1,87 @@
+from unittest import TestCase
+import time
+import threading
+
+from lib import adaptive
+from lib.adaptive import QualityController
+from lib.frame import Frame
+from lib.pipeline import StageWorker
+from lib.task import Task
+
+
+class FakeTask:
+    def __init__(self):
+        self.levels = []
+
+    def set_quality(self, level):
+        self.levels.append(level)
+
+
+class TestQualityController(TestCase):
+    def test_steps_down_under_load(self):
+        quality = QualityController(0.01, window=10, up_window=20)
+        for _ in range(10):
+            quality.update(0.005)
+        self.assertEqual(adaptive.FULL, quality.level)
+        for _ in range(3):
+            quality.update(0.02)
+        self.assertEqual(adaptive.NO_PITCH, quality.level)
+        # The window starts over after a step
+        quality.update(0.02)
+        self.assertEqual(adaptive.NO_PITCH, quality.level)
+        self.assertEqual(1, len(quality.history))
+
+    def test_steps_up_with_headroom(self):
+        quality = QualityController(0.01, window=10, up_window=20, max_level=adaptive.HALF_RATE_TEMPO)
+        for _ in range(20):
+            quality.update(0.02)
+        self.assertEqual(adaptive.HALF_RATE_TEMPO, quality.level)
+        for _ in range(19):
+            quality.update(0.001)
+        self.assertEqual(adaptive.HALF_RATE_TEMPO, quality.level)
+        quality.update(0.001)
+        self.assertEqual(adaptive.NO_PITCH, quality.level)
+
+    def test_sync_only_on_change(self):
+        quality = QualityController(0.01, window=10)
+        task = FakeTask()
+        quality.sync(task)
+        quality.sync(task)
+        for _ in range(3):
+            quality.update(0.02)
+        quality.sync(task)
+        self.assertEqual([adaptive.FULL, adaptive.NO_PITCH], task.levels)
+
+
+class BlockingInputTask(Task):
+    """Waits most of the frame for its input, like a capture read, then does very little"""
+    def __init__(self, wait):
+        super().__init__({}, {})
+        self.wait = wait
+        self.runs = 0
+
+    def run(self, frame):
+        start = time.perf_counter()
+        time.sleep(self.wait)
+        self.wait_time = time.perf_counter() - start
+        self.runs += 1
+
+
+class TestWaitingIsNotWork(TestCase):
+    def test_blocked_input_stays_full(self):
+        quality = QualityController(0.02, window=10)
+        task = BlockingInputTask(0.018)
+        stop = threading.Event()
+        config = {'Capture': {'SampleRate': 44100, 'FPS': 50}}
+        worker = StageWorker(task, stop, lambda: Frame.from_config(config), fps=50, quality=quality)
+        worker.start()
+        try:
+            deadline = time.time() + 5
+            while task.runs < 30 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            stop.set()
+            worker.join()
+        self.assertGreaterEqual(task.runs, 30)
+        self.assertEqual(adaptive.FULL, quality.level)
+        self.assertEqual([], quality.history)
@@ -0,0 +1,107 @@
+from unittest import TestCase
+import os
+import time
+import wave
+import tempfile
+import threading
+
+import numpy as np
+
+from lib.frame import Frame
+from lib.audio.analysis import FeatureRing, AnalysisProcess
+
+
+class TestFeatureRing(TestCase):
+    def setUp(self):
+        self.writer = FeatureRing(4, size=4, channels=2)
+        self.reader = FeatureRing(4, size=4, name=self.writer.name, channels=2)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def _frame(self, value):
+        frame = Frame(4, channels=2)
+        frame.audio = np.arange(4) + value
+        frame.channel_audio = np.arange(8).reshape(2, 4) * value
+        frame.is_onset = True
+        frame.pitch = float(value)
+        return frame
+
+    def test_round_trip(self):
+        out = Frame(4, channels=2)
+        self.assertIsNone(self.reader.read(out))
+        self.writer.write(self._frame(3))
+        self.assertEqual(0, self.reader.read(out))
+        np.testing.assert_array_equal(np.arange(4) + 3, out.audio)
+        np.testing.assert_array_equal(np.arange(8).reshape(2, 4) * 3, out.channel_audio)
+        self.assertIs(True, out.is_onset)
+        self.assertIsNone(out.is_beat)
+        self.assertEqual(3.0, out.pitch)
+        self.assertIsNone(out.idle_for)
+        # Nothing new
+        self.assertIsNone(self.reader.read(out))
+
+        self.writer.write(Frame(4, channels=2))
+        self.assertEqual(0, self.reader.read(out))
+        self.assertIsNone(out.audio)
+        self.assertIsNone(out.is_onset)
+
+    def test_dropped(self):
+        # Lapping the ring is fine, only the newest is read
+        for i in range(6):
+            self.writer.write(self._frame(i))
+        out = Frame(4, channels=2)
+        self.assertEqual(5, self.reader.read(out))
+        self.assertEqual(5.0, out.pitch)
+
+    def test_torn_read_retried(self):
+        self.writer.write(self._frame(1))
+        # The sequence number is there but not all of the data yet, as a weakly ordered CPU could show it
+        self.writer.slots[1]['pitch'] = 2.0
+        thread = threading.Timer(0.05, self.writer.write, args=(self._frame(2),))
+        thread.start()
+        out = Frame(4, channels=2)
+        self.assertEqual(1, self.reader.read(out))
+        thread.join()
+        self.assertGreater(self.reader.retries, 0)
+        self.assertEqual(2.0, out.pitch)
+        np.testing.assert_array_equal(np.arange(4) + 2, out.audio)
+
+
+class TestAnalysisProcess(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'test.wav')
+        t = np.arange(735 * 30) / 44100
+        with wave.open(self.path, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(44100)
+            wav.writeframes((np.sin(2 * np.pi * 440 * t) * 8000).astype('<i2').tobytes())
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_file(self):
+        config = {
+            'Capture': {'Method': 'file', 'Path': self.path, 'SampleRate': 44100, 'FPS': 60, 'Process': True},
+            'Processors': {},
+        }
+        analysis = AnalysisProcess(config)
+        analysis.start()
+        try:
+            deadline = time.time() + 20
+            while int(analysis.ring.header[0]) < 30 and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(30, int(analysis.ring.header[0]))
+            frame = Frame.from_config(config)
+            with self.assertLogs('lib.audio.analysis', 'WARNING'):
+                analysis.read(frame)
+            self.assertEqual(29, analysis.dropped)
+            self.assertIsNotNone(frame.audio)
+            # Out of audio, it waits to be stopped rather than going round again
+            self.assertTrue(analysis.process.is_alive())
+        finally:
+            analysis.stop()
+        self.assertEqual(0, analysis.process.exitcode)
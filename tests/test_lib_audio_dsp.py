@@ -0,0 +1,43 @@
+from unittest import TestCase
+import os
+import tempfile
+
+import numpy as np
+
+from lib.audio import dsp
+
+
+class TestCreateMelBank(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        dsp._mel_banks.clear()
+
+    def tearDown(self):
+        self.dir.cleanup()
+        dsp._mel_banks.clear()
+
+    def test_shared(self):
+        mel_y, mel_x = dsp.create_mel_bank(44100, 2, 60, 24, 200, 12000)
+        self.assertEqual((24, 735), mel_y.shape)
+        self.assertFalse(mel_y.flags.writeable)
+        # The same bank for the same FFT size, however it's arrived at
+        self.assertIs(mel_y, dsp.create_mel_bank(44100, 4, 120, 24, 200, 12000)[0])
+        self.assertIsNot(mel_y, dsp.create_mel_bank(44100, 2, 60, 12, 200, 12000)[0])
+
+    def test_disk_cache(self):
+        cache_dir = os.path.join(self.dir.name, 'melbanks')
+        mel_y, mel_x = dsp.create_mel_bank(44100, 2, 60, 24, 200, 12000, cache_dir=cache_dir)
+        files = os.listdir(cache_dir)
+        self.assertEqual(1, len(files))
+        dsp._mel_banks.clear()
+        cached_y, cached_x = dsp.create_mel_bank(44100, 2, 60, 24, 200, 12000, cache_dir=cache_dir)
+        np.testing.assert_array_equal(mel_y, cached_y)
+        np.testing.assert_array_equal(mel_x, cached_x)
+
+        # A broken file is built again and replaced
+        with open(os.path.join(cache_dir, files[0]), 'wb') as fp:
+            fp.write(b'not a mel bank')
+        dsp._mel_banks.clear()
+        np.testing.assert_array_equal(mel_y, dsp.create_mel_bank(44100, 2, 60, 24, 200, 12000, cache_dir=cache_dir)[0])
+        dsp._mel_banks.clear()
+        np.testing.assert_array_equal(mel_y, dsp._read_mel_cache(os.path.join(cache_dir, files[0]))[0])
@@ -0,0 +1,65 @@
+from unittest import TestCase, skipUnless
+
+import numpy as np
+
+from lib.audio import fft
+from lib.audio.stft import STFT
+
+
+class TestFFTBackend(TestCase):
+    def setUp(self):
+        self.signal = np.random.RandomState(0).randn(3, 2, 2048).astype(np.float32)
+
+    def test_same_as_numpy(self):
+        expected = np.fft.rfft(self.signal, axis=-1)
+        for name in fft.available_backends():
+            for workers in (1, 2):
+                backend = fft.FFTBackend.get_backend(name, workers)
+                fft_in = backend.zeros(self.signal.shape, np.float32)
+                fft_out = backend.zeros((3, 2, 1025), np.complex64)
+                run = backend.plan(fft_in, fft_out)
+                # Plans keep running on whatever's in the buffers
+                for scale in (1, 2):
+                    fft_in[:] = self.signal * scale
+                    run()
+                    np.testing.assert_allclose(expected * scale, fft_out, rtol=1e-3, atol=1e-2 * scale, err_msg=name)
+
+    def test_auto(self):
+        self.assertIn('numpy', fft.available_backends())
+        self.assertIn('scipy', fft.available_backends())
+        name = fft.choose_backend((2, 2048))
+        self.assertIn(name, fft.available_backends())
+        self.assertEqual(name, fft.choose_backend((2, 2048)))
+        stft = STFT(1470, 735, rows=2, fft_backend='auto')
+        self.assertIn(stft.fft.NAME, fft.available_backends())
+
+    def test_stft(self):
+        samples = self.signal[0, :, :1470]
+        spectra = []
+        for name in fft.available_backends():
+            stft = STFT(1470, 735, rows=2, fft_backend=name, fft_workers=2)
+            stft.push_batch(samples)
+            spectra.append(stft.transform_batch(2).copy())
+        for spectrum in spectra[1:]:
+            np.testing.assert_allclose(spectra[0], spectrum, rtol=1e-3, atol=1e-2)
+
+    @skipUnless(fft.PyFFTWFFT.available(), "pyFFTW is not installed")
+    def test_pyfftw(self):
+        backend = fft.FFTBackend.get_backend('pyfftw', 2)
+        fft_in = backend.zeros(self.signal.shape, np.float32)
+        fft_out = backend.zeros((3, 2, 1025), np.complex64)
+        fft_in[:] = self.signal
+        # Planning mustn't lose what's already in the input
+        run = backend.plan(fft_in, fft_out)
+        np.testing.assert_array_equal(self.signal, fft_in)
+        run()
+        np.testing.assert_allclose(np.fft.rfft(self.signal, axis=-1), fft_out, rtol=1e-3, atol=1e-2)
+
+    def test_invalid(self):
+        with self.assertRaises(RuntimeError):
+            fft.FFTBackend.get_backend('fftpack')
+        with self.assertRaises(RuntimeError):
+            STFT(1000, 100, fft_backend='fftpack')
+        if not fft.PyFFTWFFT.available():
+            with self.assertRaises(RuntimeError):
+                fft.FFTBackend.get_backend('pyfftw')
@@ -0,0 +1,73 @@
+from unittest import TestCase
+import os
+import wave
+import tempfile
+import threading
+
+import numpy as np
+
+from lib.audio.input import Input
+
+
+class TestFileInput(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.hop = 441
+        self.samples = (np.arange(self.hop * 3 * 2) % 1000).astype('<i2').reshape(-1, 2)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _input(self, path, **kwargs):
+        config = {'Capture': dict({'Method': 'file', 'Path': path, 'SampleRate': 44100, 'FPS': 100}, **kwargs)}
+        return Input.get_input(config)
+
+    def _read_all(self, capture):
+        hops = []
+        with capture:
+            while True:
+                hop = capture.read()
+                if hop is None:
+                    break
+                hops.append(hop.copy())
+        self.assertTrue(capture.finished)
+        return hops
+
+    def test_wav(self):
+        path = os.path.join(self.dir.name, 'test.wav')
+        with wave.open(path, 'wb') as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(44100)
+            wav.writeframes(self.samples.tobytes())
+        hops = self._read_all(self._input(path))
+        self.assertEqual(3, len(hops))
+        self.assertEqual(np.float32, hops[0].dtype)
+        np.testing.assert_array_equal(self.samples.mean(axis=1)[self.hop:self.hop * 2], hops[1])
+
+    def test_raw_loop(self):
+        path = os.path.join(self.dir.name, 'test.raw')
+        with open(path, 'wb') as fp:
+            fp.write(self.samples[:, 0].tobytes())
+        with self._input(path, Loop=True) as capture:
+            hops = [capture.read().copy() for _ in range(7)]
+        self.assertFalse(capture.finished)
+        np.testing.assert_array_equal(hops[0], hops[6])
+
+    def test_pipe(self):
+        path = os.path.join(self.dir.name, 'pipe')
+        os.mkfifo(path)
+        def _write():
+            with open(path, 'wb') as fp:
+                data = self.samples.tobytes()
+                # Writes that don't line up with hops
+                for i in range(0, len(data), 1000):
+                    fp.write(data[i:i + 1000])
+                    fp.flush()
+        writer = threading.Thread(target=_write)
+        writer.start()
+        hops = self._read_all(self._input(path, Channels=2))
+        writer.join()
+        self.assertEqual(3, len(hops))
+        # Both channels, since Channels is set
+        np.testing.assert_array_equal(self.samples[-self.hop:].T, hops[2])
@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+import numpy as np
+
+from lib.audio.melbank import compute_melmat, melfrequencies_mel_filterbank, mel_to_hertz, SparseMelBank
+
+
+def reference_melmat(num_mel_bands, freq_min, freq_max, num_fft_bands, sample_rate):
+    """The mel matrix built a band at a time"""
+    center, lower, upper = (mel_to_hertz(f) for f in melfrequencies_mel_filterbank(num_mel_bands, freq_min, freq_max, num_fft_bands))
+    freqs = np.linspace(0.0, sample_rate / 2.0, num_fft_bands)
+    melmat = np.zeros((num_mel_bands, num_fft_bands))
+    for band in range(num_mel_bands):
+        left = (freqs >= lower[band]) & (freqs <= center[band])
+        melmat[band, left] = (freqs[left] - lower[band]) / (center[band] - lower[band])
+        right = (freqs >= center[band]) & (freqs <= upper[band])
+        melmat[band, right] = (upper[band] - freqs[right]) / (upper[band] - center[band])
+    return melmat
+
+
+class TestComputeMelmat(TestCase):
+    def test_same_as_reference(self):
+        for args in [(24, 200, 12000, 735, 44100), (12, 64, 8000, 513, 16000), (64, 20, 20000, 367, 44100)]:
+            melmat, (_, freqs) = compute_melmat(*args)
+            np.testing.assert_array_equal(reference_melmat(*args), melmat)
+            np.testing.assert_array_equal(np.linspace(0.0, args[4] / 2.0, args[3]), freqs)
+
+
+class TestSparseMelBank(TestCase):
+    def setUp(self):
+        self.melmat, _ = compute_melmat(24, 200, 12000, num_fft_bands=735, sample_rate=44100)
+        self.spectra = np.random.RandomState(0).rand(3, 735)
+
+    def test_same_as_dense(self):
+        bank = SparseMelBank(self.melmat)
+        np.testing.assert_array_equal(self.melmat, bank.to_dense())
+        self.assertLess(bank.nnz, self.melmat.size // 10)
+        out = np.zeros((3, 24))
+        products = bank.new_products(3)
+        self.assertIs(out, bank.project(self.spectra, out=out, products=products))
+        np.testing.assert_allclose(self.spectra @ self.melmat.T, out, rtol=1e-12)
+        # One row at a time as well as several
+        np.testing.assert_allclose(self.spectra[:1] @ self.melmat.T, bank.project(self.spectra[:1]), rtol=1e-12)
+
+    def test_empty_bands(self):
+        # Too narrow to cover an FFT bin, at either end and in the middle
+        for empty in ([0], [23], [5, 6], [0, 1, 22, 23]):
+            melmat = self.melmat.copy()
+            melmat[empty] = 0
+            bank = SparseMelBank(melmat)
+            np.testing.assert_array_equal(melmat, bank.to_dense())
+            np.testing.assert_allclose(self.spectra @ melmat.T, bank.project(self.spectra), rtol=1e-12, atol=1e-300)
+        self.assertFalse(SparseMelBank(np.zeros((4, 10))).project(self.spectra[:, :10]).any())
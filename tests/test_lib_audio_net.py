@@ -0,0 +1,69 @@
+from unittest import TestCase
+import time
+
+import numpy as np
+
+from lib.audio.input import Input
+from lib.audio.net import PCMSender, JitterBuffer
+from lib.audio.ring import SampleRing
+
+
+class TestUDPInput(TestCase):
+    def setUp(self):
+        self.hop = 441
+        self.hops = [np.arange(self.hop, dtype=np.int16) + i * 1000 for i in range(7)]
+        config = {'Capture': {'Method': 'udp', 'Listen': '127.0.0.1:0', 'SampleRate': 44100, 'FPS': 100, 'JitterPackets': 2}}
+        self.capture = Input.get_input(config)
+        self.capture.start()
+        self.sender = PCMSender(self.capture.address, 44100)
+
+    def tearDown(self):
+        self.sender.close()
+        self.capture.stop()
+
+    def _send(self, seq):
+        self.sender.seq = seq
+        self.sender.send(self.hops[seq])
+
+    def _wait_written(self, count):
+        deadline = time.perf_counter() + 2
+        while self.capture.ring.written < count and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(count, self.capture.ring.written)
+
+    def test_loopback(self):
+        self._send(0)
+        hop = self.capture.read()
+        np.testing.assert_array_equal(self.hops[0], hop)
+
+        # Out of order, then 3 is lost, and turns up after it's been concealed
+        for seq in (2, 1, 4, 5, 6):
+            self._send(seq)
+        self._wait_written(7)
+        self._send(3)
+        deadline = time.perf_counter() + 2
+        while self.capture.jitter.late < 1 and time.perf_counter() < deadline:
+            time.sleep(0.001)
+
+        expected = self.hops[:3] + [self.hops[2] * 0.5] + self.hops[4:]
+        np.testing.assert_array_equal(np.array(expected, dtype=np.float32), self.capture.ring.blocks[:7])
+        self.assertEqual(1, self.capture.jitter.lost)
+        self.assertEqual(1, self.capture.jitter.late)
+        self.assertEqual(0, self.capture.bad_packets)
+
+
+class TestJitterBuffer(TestCase):
+    def test_wrap_and_resync(self):
+        ring = SampleRing(4)
+        jitter = JitterBuffer(ring)
+        jitter.push(0xffffffff, np.full(4, 1))
+        jitter.push(0, np.full(4, 2))
+        self.assertEqual(2, ring.written)
+        self.assertEqual(0, jitter.resyncs)
+
+        # The sender restarted
+        jitter.push(5000, np.full(4, 3))
+        self.assertEqual(3, ring.written)
+        self.assertEqual(1, jitter.resyncs)
+        self.assertEqual(0, jitter.lost)
+        np.testing.assert_array_equal([2, 3], ring.blocks[1:3, 0])
@@ -0,0 +1,179 @@
+from unittest import TestCase
+
+import numpy as np
+
+from scipy.ndimage import gaussian_filter1d
+
+from lib.frame import Frame
+from lib.audio.dsp import create_mel_bank, ExpFilter
+from lib.audio.processor import SmoothingProcessor, BeatProcessor
+
+
+def reference_spectra(config, hops, history=2):
+    """Mono spectra computed the straightforward way, with a fresh array for every step"""
+    rate, fps = config['Capture']['SampleRate'], config['Capture']['FPS']
+    y_roll = np.random.rand(history, int(rate / fps)) / 1e16
+    mel_y, _ = create_mel_bank(rate, history, fps, 24, 200, 12000)
+    gain = ExpFilter(np.tile(1e-1, 24), alpha_decay=0.01, alpha_rise=0.99)
+    smoothing = ExpFilter(np.tile(1e-1, 24), alpha_decay=0.5, alpha_rise=0.99)
+    for hop in hops:
+        y_roll[:-1] = y_roll[1:]
+        y_roll[-1, :] = np.copy(hop / 2.0**15)
+        y_data = np.concatenate(y_roll, axis=0).astype(np.float32)
+        if np.max(np.abs(y_data)) < 1e-7:
+            yield np.zeros(24)
+            continue
+        N = len(y_data)
+        y_data *= np.hamming(N)
+        y_padded = np.pad(y_data, (0, 2**int(np.ceil(np.log2(N))) - N), mode='constant')
+        YS = np.abs(np.fft.rfft(y_padded)[:N // 2])
+        mel = np.sum(np.atleast_2d(YS).T * mel_y.T, axis=0)**2.0
+        gain.update(np.max(gaussian_filter1d(mel, sigma=1.0)))
+        yield smoothing.update(mel / gain.value).copy()
+
+
+class TestSmoothingProcessor(TestCase):
+    def _config(self, channels=1, projection='sparse'):
+        return {
+            'Capture': {'SampleRate': 44100, 'FPS': 60, 'Channels': channels},
+            'Processors': {'Smoothing': {'MelProjection': projection}},
+        }
+
+    def _hops(self, count, channels, seed=0):
+        rng = np.random.RandomState(seed)
+        t = np.arange(735) / 44100
+        for i in range(count):
+            hop = np.array([np.sin(2 * np.pi * 110 * (c + 1) * t) * 4000 + rng.randn(735) * 500 for c in range(channels)])
+            # The last channel goes quiet half way through
+            hop[-1] *= i < count // 2
+            yield hop.astype(np.float32)
+
+    def test_channels_match_mono(self):
+        config = self._config(channels=3)
+        proc = SmoothingProcessor(config)
+        frame = Frame.from_config(config)
+        mono_procs = [SmoothingProcessor(self._config()) for _ in range(4)]
+        mono_frame = Frame.from_config(self._config())
+        for hop in self._hops(8, 3):
+            proc.process(hop, frame)
+            # The mix is frame.audio, and each channel is analysed just as it would be on its own
+            for i, mono_hop in enumerate([hop.mean(axis=0)] + list(hop)):
+                mono_procs[i].process(mono_hop, mono_frame)
+                spectrum = frame.audio if i == 0 else frame.channel_audio[i - 1]
+                np.testing.assert_allclose(mono_frame.audio, spectrum, rtol=1e-6)
+        self.assertFalse(frame.channel_audio[2].any())
+        self.assertTrue(frame.channel_audio[1].any())
+
+    def test_same_as_reference(self):
+        hops = [hop[0] * (i not in (3, 4)) for i, hop in enumerate(self._hops(12, 1))]
+        for projection in ('dense', 'sparse'):
+            config = self._config(projection=projection)
+            np.random.seed(0)
+            expected = list(reference_spectra(config, hops))
+            np.random.seed(0)
+            proc = SmoothingProcessor(config)
+            frame = Frame.from_config(config)
+            for hop, spectrum in zip(hops, expected):
+                proc.process(hop, frame)
+                if projection == 'dense':
+                    np.testing.assert_array_equal(spectrum, frame.audio)
+                else:
+                    # Only the order the products are summed in differs
+                    np.testing.assert_allclose(spectrum, frame.audio, rtol=1e-12)
+
+    def test_hop_apart_from_blocks(self):
+        hops = [hop[0] for hop in self._hops(6, 1)]
+        # Half a block, so the same windows as twice as many blocks of half the size
+        config = self._config()
+        config['Processors']['Smoothing'].update({'Hop': 368, 'WindowLength': 1472})
+        proc = SmoothingProcessor(config)
+        frame = Frame.from_config(config)
+        halves = SmoothingProcessor(config)
+        half_frame = Frame.from_config(config)
+        for hop in hops:
+            proc.process(hop[:736], frame)
+            halves.process(hop[:368], half_frame)
+            halves.process(hop[368:736], half_frame)
+            np.testing.assert_array_equal(half_frame.audio, frame.audio)
+
+        # Two blocks, so every other block leaves the spectrum as it was
+        config['Processors']['Smoothing'].update({'Hop': 1470, 'FFTSize': 4096, 'Window': 'blackman'})
+        proc = SmoothingProcessor(config)
+        frame = Frame.from_config(config)
+        proc.process(hops[0], frame)
+        self.assertIsNone(frame.audio)
+        spectra = []
+        for hop in hops[1:]:
+            proc.process(hop, frame)
+            spectra.append(frame.audio.copy())
+        np.testing.assert_array_equal(spectra[0], spectra[1])
+        self.assertFalse(np.array_equal(spectra[1], spectra[2]))
+
+    def test_fft_size(self):
+        # A 1kHz tone lands in the same mel bin however finely the FFT splits it up
+        t = np.arange(735 * 4) / 44100
+        tone = (np.sin(2 * np.pi * 1000 * t) * 4000).astype(np.float32)
+        peaks = []
+        for fft_size in (2048, 4096, 8192):
+            for projection in ('dense', 'sparse'):
+                config = self._config(projection=projection)
+                config['Processors']['Smoothing'].update({'WindowLength': 1470, 'FFTSize': fft_size})
+                proc = SmoothingProcessor(config)
+                frame = Frame.from_config(config)
+                for i in range(4):
+                    proc.process(tone[i * 735:(i + 1) * 735], frame)
+                peaks.append(np.argmax(frame.audio))
+        self.assertEqual([peaks[0]] * len(peaks), peaks)
+
+    def test_catch_up(self):
+        for projection in ('dense', 'sparse'):
+            config = self._config(channels=2, projection=projection)
+            hops = list(self._hops(9, 2))
+            np.random.seed(0)
+            proc = SmoothingProcessor(config)
+            frame = Frame.from_config(config)
+            for hop in hops:
+                proc.process(hop, frame)
+            # Several hops at once come out the same as one at a time, up to the last one
+            np.random.seed(0)
+            batched = SmoothingProcessor(config)
+            batched_frame = Frame.from_config(config)
+            batched.process(hops[0], batched_frame)
+            batched.process(np.concatenate(hops[1:5], axis=1), batched_frame)
+            batched.process(np.concatenate(hops[5:], axis=1), batched_frame)
+            np.testing.assert_array_equal(frame.audio, batched_frame.audio)
+            np.testing.assert_array_equal(frame.channel_audio, batched_frame.channel_audio)
+            # And silence at the end of a backlog is still silence
+            batched.process(np.concatenate((hops[0], hops[0] * 0, hops[0] * 0), axis=1), batched_frame)
+            self.assertFalse(batched_frame.audio.any())
+
+    def test_mono_has_no_channels(self):
+        config = self._config()
+        proc = SmoothingProcessor(config)
+        frame = Frame.from_config(config)
+        proc.process(next(self._hops(1, 1))[0], frame)
+        self.assertEqual((24,), frame.audio.shape)
+        self.assertIsNone(frame.channel_audio)
+
+
+class TestBeatProcessor(TestCase):
+    def test_catch_up(self):
+        config = {'Capture': {'SampleRate': 44100, 'FPS': 60}}
+        rng = np.random.RandomState(0)
+        # A burst of noise every 10 hops
+        hops = [(rng.randn(735) * (8000 if i % 10 == 5 else 10)).astype(np.float32) for i in range(40)]
+        proc = BeatProcessor(config)
+        frame = Frame.from_config(config)
+        onsets = []
+        for hop in hops:
+            proc.process(hop, frame)
+            onsets.append(frame.is_onset)
+        # Onsets anywhere in a backlog show up in the frame
+        batched = BeatProcessor(config)
+        batched_onsets = []
+        for i in range(0, 40, 4):
+            batched.process(np.concatenate(hops[i:i + 4]), frame)
+            batched_onsets.append(frame.is_onset)
+        self.assertEqual([any(onsets[i:i + 4]) for i in range(0, 40, 4)], batched_onsets)
+        self.assertIn(True, batched_onsets[1:])
+        self.assertIn(False, batched_onsets)
@@ -0,0 +1,55 @@
+from unittest import TestCase
+import threading
+
+import numpy as np
+
+from lib.audio.ring import SampleRing
+
+
+class TestSampleRing(TestCase):
+    def test_blocks_from_any_size_chunks(self):
+        ring = SampleRing(4, size=4)
+        self.assertIsNone(ring.read())
+        ring.write(np.arange(3, dtype=np.int16).tobytes(), timestamp=1.0)
+        self.assertIsNone(ring.read())
+        ring.write(np.arange(3, 5, dtype=np.int16), timestamp=2.0, overflows=1)
+        block = ring.read()
+        self.assertEqual(np.float32, block.dtype)
+        self.assertEqual([0, 1, 2, 3], block.tolist())
+        self.assertEqual(2.0, ring.timestamp)
+        self.assertEqual(1, ring.overflow_count)
+        self.assertIsNone(ring.read())
+
+    def test_newest_block_and_dropped(self):
+        ring = SampleRing(2, size=4)
+        ring.write(np.arange(10))
+        self.assertEqual([8, 9], ring.read().tolist())
+        self.assertEqual(4, ring.dropped)
+
+    def test_catch_up(self):
+        ring = SampleRing(2, size=4)
+        ring.write(np.arange(4))
+        self.assertEqual([0, 1, 2, 3], ring.read(max_blocks=8).tolist())
+        # Across the end of the ring, and only as many as the ring can hold safely
+        ring.write(np.arange(4, 10))
+        self.assertEqual([6, 7, 8, 9], ring.read(max_blocks=8).tolist())
+        self.assertEqual(1, ring.dropped)
+        ring.write(np.arange(10, 14))
+        self.assertEqual([12, 13], ring.read(max_blocks=1).tolist())
+        self.assertEqual(2, ring.dropped)
+
+        ring = SampleRing(3, size=5, channels=2)
+        ring.write(np.arange(24, dtype=np.int16))
+        np.testing.assert_array_equal(np.arange(6, 24).reshape(-1, 2).T, ring.read(max_blocks=3))
+
+    def test_wait(self):
+        ring = SampleRing(2)
+        self.assertIsNone(ring.read(timeout=0.01))
+        threading.Timer(0.01, ring.write, (np.ones(2),)).start()
+        self.assertEqual([1, 1], ring.read(timeout=1).tolist())
+
+    def test_channels(self):
+        ring = SampleRing(3, channels=2)
+        ring.write(np.arange(4, dtype=np.int16).tobytes())
+        ring.write(np.arange(4, 6, dtype=np.int16).tobytes())
+        np.testing.assert_array_equal([[0, 2, 4], [1, 3, 5]], ring.read())
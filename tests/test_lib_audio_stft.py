@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+import numpy as np
+
+from lib.audio.stft import STFT
+
+
+class TestSTFT(TestCase):
+    def setUp(self):
+        self.signal = np.random.RandomState(0).randn(2, 5000).astype(np.float32)
+
+    def _windows(self, stft, chunks):
+        # Each window should end a hop after the one before
+        count, pos = 0, 0
+        for size in chunks:
+            for frame in stft.push(self.signal[:, pos:pos + size]):
+                count += 1
+                self.assertLessEqual(count * stft.hop, pos + size)
+                np.testing.assert_array_equal(self._expected(count * stft.hop, stft.window_length), frame)
+            pos += size
+        return count
+
+    def _expected(self, end, length):
+        padded = np.concatenate((np.zeros((2, length), dtype=np.float32), self.signal[:, :end]), axis=1)
+        return padded[:, -length:]
+
+    def test_hops_independent_of_chunks(self):
+        chunks = [735] * 6
+        # A window per chunk, several per chunk, one every few chunks, and a hop longer than the window
+        for hop, window_length in [(735, 1470), (256, 1024), (2000, 4096), (1500, 1000)]:
+            self.assertEqual(sum(chunks) // hop, self._windows(STFT(window_length, hop, rows=2), chunks))
+        self.assertEqual(11, self._windows(STFT(1024, 300, rows=2), [1, 299, 1000, 7, 593, 1500]))
+
+    def test_history(self):
+        stft = STFT(1000, 500, rows=2, history=self.signal[:, :1200])
+        np.testing.assert_array_equal(self.signal[:, 200:1200], stft.latest(1000))
+        np.testing.assert_array_equal(self.signal[:, 900:1200], stft.latest(300))
+        frame = next(stft.push(self.signal[:, 1200:1700]))
+        np.testing.assert_array_equal(self.signal[:, 700:1700], frame)
+
+    def test_transform(self):
+        for window, function in [('hamming', np.hamming), ('hann', np.hanning), ('blackman', np.blackman)]:
+            stft = STFT(1000, 1000, fft_size=4096, window=window, rows=2)
+            frame = next(stft.push(self.signal[:, :1000]))
+            expected = np.abs(np.fft.rfft(self.signal[:, :1000] * function(1000), n=4096))
+            self.assertEqual((2, 2049), stft.magnitudes.shape)
+            np.testing.assert_allclose(expected, stft.transform(), rtol=1e-4, atol=1e-3)
+
+    def test_invalid(self):
+        with self.assertRaises(RuntimeError):
+            STFT(1000, 100, window='triangle')
+        with self.assertRaises(RuntimeError):
+            STFT(1000, 100, fft_size=512)
@@ -0,0 +1,92 @@
+from unittest import TestCase
+import os
+import glob
+import wave
+import tempfile
+
+import numpy as np
+
+from lib.audio.tee import AudioTee
+
+
+class TestAudioTee(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.hops = [np.arange(100, dtype=np.float32) + i for i in range(10)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_rotates(self):
+        # 3 hops per file, keeping 2 files
+        tee = AudioTee(self.dir.name, 1000, 100, minutes=0.6 / 60, file_seconds=0.3)
+        tee.start()
+        for i, hop in enumerate(self.hops):
+            self.assertTrue(tee.write(hop, timestamp=i))
+        tee.stop()
+        self.assertEqual(10, tee.written)
+        self.assertEqual(0, tee.dropped)
+
+        files = sorted(glob.glob(os.path.join(self.dir.name, 'tee-*.wav')))
+        self.assertEqual(2, len(files))
+        # The newest file has the last hop on its own
+        with wave.open(files[-1], 'rb') as wav:
+            self.assertEqual(100, wav.getnframes())
+            np.testing.assert_array_equal(self.hops[9], np.frombuffer(wav.readframes(100), dtype='<i2'))
+        with open(files[0][:-4] + '.ts', 'rb') as fp:
+            self.assertEqual([6, 7, 8], np.frombuffer(fp.read(), dtype='<f8').tolist())
+
+    def test_drops_when_full(self):
+        tee = AudioTee(self.dir.name, 1000, 50, channels=2, buffer_hops=4)
+        for hop in self.hops[:5]:
+            tee.write(hop.reshape(2, 50))
+        self.assertEqual(1, tee.dropped)
+        tee.start()
+        tee.stop()
+        self.assertEqual(4, tee.written)
+        with wave.open(glob.glob(os.path.join(self.dir.name, 'tee-*.wav'))[0], 'rb') as wav:
+            self.assertEqual(2, wav.getnchannels())
+            frames = np.frombuffer(wav.readframes(200), dtype='<i2').reshape(-1, 2)
+        np.testing.assert_array_equal(self.hops[0].reshape(2, 50).T, frames[:50])
+
+    def test_write_errors(self):
+        # Somewhere the directory can't be made, so every hop fails to write but the writer carries on
+        path = os.path.join(self.dir.name, 'file')
+        open(path, 'w').close()
+        tee = AudioTee(os.path.join(path, 'captures'), 1000, 100)
+        tee.start()
+        for hop in self.hops[:3]:
+            self.assertTrue(tee.write(hop))
+        tee.stop()
+        self.assertEqual(3, tee.failed)
+        self.assertFalse(tee.crashed)
+
+    def test_writer_crash_reported(self):
+        tee = AudioTee(self.dir.name, 1000, 100, buffer_hops=2)
+        def _fail():
+            raise ValueError()
+        tee._drain = _fail
+        with self.assertLogs('lib.audio.tee', 'ERROR'):
+            tee.start()
+            tee.write(self.hops[0])
+            tee.join(5)
+        self.assertTrue(tee.crashed)
+        with self.assertLogs('lib.audio.tee', 'WARNING') as logs:
+            for hop in self.hops:
+                tee.write(hop)
+        self.assertIn('dropped', logs.output[0])
+
+    def test_close_after_failed_open(self):
+        tee = AudioTee(self.dir.name, 1000, 100)
+        tee.fp = open(os.path.join(self.dir.name, 'partial.wav'), 'wb')
+        tee._close_file()
+        self.assertIsNone(tee.fp)
+
+    def test_several_hops(self):
+        tee = AudioTee(self.dir.name, 1000, 100)
+        self.assertTrue(tee.write(np.concatenate(self.hops[:3]), timestamp=1.0))
+        tee.start()
+        tee.stop()
+        self.assertEqual(3, tee.written)
+        with open(glob.glob(os.path.join(self.dir.name, 'tee-*.ts'))[0], 'rb') as fp:
+            self.assertEqual([0.8, 0.9, 1.0], np.frombuffer(fp.read(), dtype='<f8').round(6).tolist())
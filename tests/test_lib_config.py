@@ -0,0 +1,51 @@
+from unittest import TestCase
+import os
+import tempfile
+
+from lib.config import load_config, resolve_mapping
+
+
+class TestLoadConfig(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.main = self._write('main.yaml', "Capture:\n  FPS: 60\nMapping: '@mapping.yaml'\n")
+        self._write('mapping.yaml', "a:\n  Program:\n    - trigger: frequency\n      bins: [[0, 2], 5]\nb:\n  Program: a\n")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _write(self, name, content, mtime=None):
+        filename = os.path.join(self.dir.name, name)
+        with open(filename, 'w') as fp:
+            fp.write(content)
+        if mtime:
+            os.utime(filename, ns=(mtime, mtime))
+        return filename
+
+    def test_resolves_mapping(self):
+        config = load_config(self.main)
+        self.assertEqual([0, 1, 2, 5], config['Mapping']['a']['Program'][0]['bins'])
+        self.assertEqual(config['Mapping']['a']['Program'], config['Mapping']['b']['Program'])
+        self.assertEqual({}, config['Mapping']['b']['Cooldown'])
+        # Resolving again changes nothing
+        self.assertEqual(config, resolve_mapping(load_config(self.main)))
+
+    def test_cache(self):
+        load_config(self.main)
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, '.main.yaml.cache')))
+        self.assertEqual(60, load_config(self.main)['Capture']['FPS'])
+        # A change to an included file is picked up
+        self._write('mapping.yaml', "c: {}\n", mtime=10**18)
+        self.assertEqual(['c'], list(load_config(self.main)['Mapping']))
+        self.assertEqual(['c'], list(load_config(self.main)['Mapping']))
+
+    def test_copied_cache(self):
+        load_config(self.main)
+        copy = tempfile.TemporaryDirectory()
+        self.addCleanup(copy.cleanup)
+        for name in ('main.yaml', 'mapping.yaml', '.main.yaml.cache'):
+            with open(os.path.join(self.dir.name, name), 'rb') as src, open(os.path.join(copy.name, name), 'wb') as dst:
+                dst.write(src.read())
+        with open(os.path.join(copy.name, 'main.yaml'), 'w') as fp:
+            fp.write("Capture:\n  FPS: 30\n")
+        self.assertEqual(30, load_config(os.path.join(copy.name, 'main.yaml'))['Capture']['FPS'])
@@ -0,0 +1,31 @@
+from unittest import TestCase
+import time
+
+from lib.fps import FrameClock
+
+
+class TestFrameClock(TestCase):
+    def test_paces_frames(self):
+        clock = FrameClock('test', 100)
+        start = time.perf_counter()
+        for _ in range(10):
+            with clock:
+                pass
+        elapsed = time.perf_counter() - start
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertLess(elapsed, 0.15)
+        self.assertEqual(0, clock.total_late)
+        self.assertEqual(10, clock.total_frames)
+
+    def test_late_and_missed(self):
+        clock = FrameClock('test', 100)
+        with clock:
+            time.sleep(0.035)
+        self.assertEqual(1, clock.total_late)
+        self.assertEqual(2, clock.total_missed)
+        # The next deadline stays on the original grid
+        start = time.perf_counter()
+        with clock:
+            pass
+        self.assertLess(time.perf_counter() - start, 0.01)
+        self.assertEqual(1, clock.total_late)
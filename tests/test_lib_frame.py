@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+import numpy as np
+
+from lib.frame import Frame
+
+
+class TestFrame(TestCase):
+    def test_audio_buffer_reused(self):
+        frame = Frame(4)
+        buf = frame._audio
+        self.assertIsNone(frame.audio)
+        frame.audio = np.arange(4)
+        self.assertIs(buf, frame.audio)
+        self.assertEqual([0, 1, 2, 3], frame.audio.tolist())
+        frame.reset()
+        self.assertIsNone(frame.audio)
+        self.assertIsNone(frame['is_beat'])
+
+    def test_copy_and_snapshot(self):
+        frame = Frame(2)
+        frame.audio = [0.5, 1]
+        frame.is_onset = True
+        frame.effects_data['x'] = {'value': 1}
+        other = Frame(2)
+        other.copy_from(frame)
+        frame.reset()
+        self.assertEqual([0.5, 1], other.audio.tolist())
+        self.assertTrue(other.get('is_onset'))
+        data = other.to_dict()
+        self.assertEqual([0.5, 1.0], data['audio'])
+        self.assertEqual({'x': {'value': 1}}, data['effects_data'])
+        with self.assertRaises(KeyError):
+            other['nope']
+
+    def test_channel_audio(self):
+        frame = Frame(2, channels=3)
+        self.assertIsNone(frame.channel_audio)
+        frame.audio = [0, 1]
+        frame.channel_audio = np.ones((3, 2))
+        other = Frame(2, channels=3)
+        other.copy_from(frame)
+        self.assertEqual([[1.0, 1.0]] * 3, other.to_dict()['channel_audio'])
+        other.audio = None
+        self.assertIsNone(other.channel_audio)
+        self.assertNotIn('channel_audio', Frame(2).to_dict())
@@ -0,0 +1,65 @@
+from unittest import TestCase
+
+from lib.light import layout
+from lib.light.layout import ChannelLayout, get_layout
+from lib.light.models import Light
+
+
+TYPE = {
+    'RawType': 'dmx',
+    'Channels': 4,
+    'Functions': {
+        'mode': {'channel': 1, 'type': 'static', 'map': {'off': [0, 49], 'static': [50, 99], 'dynamic': [100, 255]}},
+        'pattern': {'channel': 2, 'type': 'static', 'maps': [
+            {'when': ['mode', 'static'], 'map': {'circle': [0, 9], 'line': [10, 19]}},
+            {'when': ['mode', 'dynamic'], 'map': {'spin': [0, 9]}},
+        ]},
+        'speed': {'channel': 3, 'invert': True, 'speed': [10, 1]},
+        'reset': {'channel': 4, 'type': 'boolean', 'resets': True},
+    },
+}
+
+
+class TestChannelLayout(TestCase):
+    def _light(self, address=10):
+        config = {'LightTypes': {'Test': TYPE}}
+        return Light.create_from(config, 'test', {'Type': 'Test', 'Address': address})
+
+    def test_compile(self):
+        compiled = ChannelLayout.compile('Test', TYPE)
+        self.assertEqual(['mode', 'pattern', 'speed', 'reset'], [c.name for c in compiled.order])
+        self.assertEqual(2, compiled.speed.offset)
+        self.assertTrue(compiled.speed.invert)
+        self.assertEqual(layout.BOOLEAN, compiled.channels['reset'].kind)
+        self.assertEqual((compiled.channels['reset'],), compiled.resetting)
+        self.assertEqual(('mode', 50, 99, {'circle': (0, 9), 'line': (10, 19)}), compiled.channels['pattern'].maps[0])
+        self.assertIs(get_layout('Test', TYPE), get_layout('Test', dict(TYPE)))
+
+    def test_errors(self):
+        def bad(**functions):
+            return dict(TYPE, Functions=dict(TYPE['Functions'], **functions))
+        for type_config in (
+            bad(extra={'channel': 5}),
+            bad(extra={'channel': 1, 'type': 'dial'}),
+            bad(extra={'channel': 1, 'type': 'static', 'map': {'on': [0, 300]}}),
+            bad(extra={'channel': 1, 'resets': [10]}),
+            bad(extra={'channel': 1, 'maps': [{'when': ['mode', 'auto'], 'map': {}}]}),
+            bad(extra={'channel': 1, 'maps': [{'when': ['nope', 1], 'map': {}}]}),
+        ):
+            with self.assertRaises(RuntimeError):
+                ChannelLayout.compile('Bad', type_config)
+
+    def test_light_state(self):
+        light = self._light()
+        light.set_state(mode='static', pattern='line', speed=55)
+        self.assertEqual({'mode': 50, 'pattern': 10, 'speed': 55, 'reset': 0}, light.state)
+        self.assertEqual({9: 50, 10: 10, 11: 200, 12: 0}, light.get_dmx())
+        self.assertEqual({11: 200}, light.get_dmx(speed_only=True))
+        light.mark_sent()
+        # Anywhere in the mode's range selects the map
+        light.set_state(mode=120, pattern='spin')
+        self.assertEqual({'mode': 120, 'pattern': 0}, light.diff_state)
+        light.mark_sent()
+        light.set_state(reset=True)
+        light.mark_sent()
+        self.assertEqual(0, light.state['mode'])
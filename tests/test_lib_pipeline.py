@@ -0,0 +1,90 @@
+from unittest import TestCase
+import time
+import threading
+
+import numpy as np
+
+from lib.frame import Frame
+from lib.pipeline import Handoff, Pipeline
+from lib.task import Task
+
+
+def new_frame():
+    return Frame(4)
+
+
+class CountingTask(Task):
+    """Adds one to the first bin of whatever it's given"""
+    def __init__(self):
+        super().__init__({}, {})
+        self.runs = 0
+
+    def run(self, frame):
+        self.runs += 1
+        frame.audio = (frame.audio if frame.audio is not None else np.zeros(4)) + [1, 0, 0, 0]
+        frame.pitch = float(self.runs)
+
+
+class TestHandoff(TestCase):
+    def _frame(self, value):
+        frame = new_frame()
+        frame.audio = np.full(4, value)
+        frame.pitch = value
+        return frame
+
+    def test_newest_wins(self):
+        handoff = Handoff(new_frame())
+        for i in range(3):
+            handoff.put(self._frame(i))
+        out = new_frame()
+        self.assertTrue(handoff.get(out, timeout=0))
+        self.assertEqual(2, out.pitch)
+        self.assertEqual(2, handoff.dropped)
+        # Taken already
+        self.assertFalse(handoff.get(out, timeout=0))
+
+    def test_get_times_out(self):
+        handoff = Handoff(new_frame())
+        start = time.perf_counter()
+        self.assertFalse(handoff.get(new_frame(), timeout=0.05))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.04)
+        # And a put from another thread wakes it up
+        threading.Timer(0.05, handoff.put, args=(self._frame(1),)).start()
+        self.assertTrue(handoff.get(new_frame(), timeout=5))
+
+    def test_frames_isolated(self):
+        handoff = Handoff(new_frame())
+        frame = self._frame(1)
+        frame.effects_data['a'] = 1
+        handoff.put(frame)
+        # Changing the producer's frame after put() doesn't reach the consumer
+        frame.audio[:] = 5
+        frame.effects_data['a'] = 5
+        out = new_frame()
+        handoff.get(out)
+        np.testing.assert_array_equal(np.full(4, 1), out.audio)
+        self.assertEqual({'a': 1}, out.effects_data)
+        # Nor does changing the consumer's copy reach the handoff
+        out.audio[:] = 7
+        self.assertEqual(1, handoff.frame.audio[0])
+
+
+class TestPipeline(TestCase):
+    def test_stages_and_shutdown(self):
+        stop = threading.Event()
+        first, second = CountingTask(), CountingTask()
+        pipeline = Pipeline([(first, 200), (second, None)], stop, new_frame)
+        pipeline.start()
+        out = new_frame()
+        try:
+            self.assertTrue(pipeline.output.get(out, timeout=5))
+        finally:
+            stop.set()
+            pipeline.join()
+        # Every frame went through both stages, starting from a fresh frame in the first
+        self.assertEqual(2, out.audio[0])
+        for worker in pipeline.workers:
+            self.assertFalse(worker.is_alive())
+        runs = first.runs, second.runs
+        time.sleep(0.05)
+        self.assertEqual(runs, (first.runs, second.runs))
@@ -0,0 +1,21 @@
+from unittest import TestCase
+
+from lib.profiler import FrameProfiler
+
+
+class TestFrameProfiler(TestCase):
+    def test_modes(self):
+        profiler = FrameProfiler()
+        self.assertEqual('cprofile', profiler.request(5)['mode'])
+        with self.assertRaises(RuntimeError):
+            profiler.request(5, 'sample')
+        with self.assertRaises(ValueError):
+            FrameProfiler().request(5, 'gprof')
+
+    def test_threaded(self):
+        # cprofile can't see the pipelined stages' threads
+        profiler = FrameProfiler()
+        profiler.threaded = True
+        with self.assertRaises(ValueError):
+            profiler.request(5, 'cprofile')
+        self.assertEqual('sample', profiler.request(5)['mode'])
@@ -0,0 +1,106 @@
+from unittest import TestCase
+import os
+import copy
+import shutil
+import tempfile
+
+from lib.config import load_config
+from lib.reload import ConfigReloader
+from components.lights import LightOutputTask
+from components.mapper import MapperTask
+
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', 'config-example')
+
+
+class TestConfigReloader(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        for name in os.listdir(EXAMPLE_DIR):
+            if name.endswith('.yaml'):
+                shutil.copy(os.path.join(EXAMPLE_DIR, name), self.dir.name)
+        self.main = os.path.join(self.dir.name, 'main.yaml')
+        self.files = []
+        self.config = load_config(self.main, cache=False, files=self.files)
+        self.tasks = {}
+        self.tasks['mapper'] = MapperTask(self.tasks, self.config)
+        self.tasks['lights'] = LightOutputTask(self.tasks, self.config)
+        self.tasks['lights'].setup()
+        self.tasks['mapper'].setup()
+        self.reloader = ConfigReloader(self.main, self.tasks, self.files, cache=False)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _sync(self):
+        for task in self.tasks.values():
+            self.reloader.sync(task)
+
+    def test_only_changed_lights_rebuilt(self):
+        lights = self.tasks['lights']
+        kept = lights.lights['back_1']
+        moved = lights.lights['back_2']
+        lights.create_effect('test', 'back_1', {'function': 'dim', 'end_value': 0, 'duration': 10})
+        lights.create_effect('test', 'back_2', {'function': 'dim', 'end_value': 0, 'duration': 10})
+
+        with open(os.path.join(self.dir.name, 'lights.yaml'), 'a') as fp:
+            fp.write("extra_1:\n  Type: UnnamedGobo\n  Address: 200\n")
+        config = load_config(self.main, cache=False)
+        config['Lights']['back_2']['Address'] = 100
+        del config['Lights']['front_1']
+        lights.apply_reload(lights.prepare_reload(config))
+
+        self.assertIs(kept, lights.lights['back_1'])
+        self.assertIsNot(moved, lights.lights['back_2'])
+        self.assertEqual(100, lights.lights['back_2'].address)
+        self.assertIn('extra_1', lights.lights)
+        self.assertNotIn('front_1', lights.lights)
+        self.assertEqual(['back_1'], [e.light_name for e in lights.effects.values()])
+
+    def test_replaced_devices_closed(self):
+        class _Port:
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        lights = self.tasks['lights']
+        config = copy.deepcopy(self.config)
+        config['DMXDevices']['spare'] = 'sink'
+        lights.apply_reload(lights.prepare_reload(config))
+        ports = {}
+        for name, device in lights.dmx_devices.items():
+            ports[name] = _Port()
+            device.impl = type('_Impl', (), {'serial': ports[name]})()
+        config = copy.deepcopy(config)
+        config['DMXDevices']['default'] = 'vsink'
+        lights.apply_reload(lights.prepare_reload(config))
+        self.assertEqual({name: name == 'default' for name in ports}, {name: port.closed for name, port in ports.items()})
+
+    def test_mapping_reload(self):
+        mapper = self.tasks['mapper']
+        kept = mapper.state_effects['back_1']
+        config = copy.deepcopy(self.config)
+        config['Mapping']['mid_1']['StateEffects'] = {}
+        mapper.apply_reload(mapper.prepare_reload(config))
+        self.assertIs(kept, mapper.state_effects['back_1'])
+        self.assertEqual([], mapper.state_effects['mid_1'])
+
+    def test_watches_files(self):
+        self.assertFalse(self.reloader._changed())
+        path = os.path.join(self.dir.name, 'mapping.yaml')
+        os.utime(path, ns=(10**18, 10**18))
+        self.assertTrue(self.reloader._changed())
+        self.reloader._prepare()
+        self.assertFalse(self.reloader._changed())
+        self.assertEqual({self.tasks['lights'], self.tasks['mapper']}, set(self.reloader.pending))
+        self._sync()
+        self.assertEqual({}, self.reloader.pending)
+
+    def test_bad_config_keeps_running(self):
+        with open(os.path.join(self.dir.name, 'lights.yaml'), 'a') as fp:
+            fp.write("broken: [\n")
+        self.reloader._prepare()
+        self.assertEqual({}, self.reloader.pending)
+        # Not retried until it changes again
+        self.assertFalse(self.reloader._changed())
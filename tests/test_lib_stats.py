@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from lib.stats import LatencyHistogram, TaskTimings
+
+
+class TestLatencyHistogram(TestCase):
+    def test_percentiles(self):
+        hist = LatencyHistogram()
+        for ms in range(1, 101):
+            hist.record(ms / 1000.0)
+        res = hist.summary()
+        self.assertEqual(100, res['count'])
+        self.assertAlmostEqual(100, res['max'])
+        # Buckets are within ~6% of the true value
+        self.assertAlmostEqual(50, res['p50'], delta=3)
+        self.assertAlmostEqual(95, res['p95'], delta=6)
+        self.assertAlmostEqual(99, res['p99'], delta=6)
+
+    def test_small_values_exact(self):
+        hist = LatencyHistogram()
+        for us in (1, 2, 3, 4):
+            hist.record(us / 1e6)
+        res = hist.summary(percentiles=(50,))
+        self.assertEqual(0.002, res['p50'])
+        self.assertEqual(0.004, res['max'])
+
+    def test_window_expiry(self):
+        hist = LatencyHistogram(window=0.01, slots=2)
+        hist.record(0.5)
+        hist._rotate(hist.slot_end + 1)
+        self.assertEqual(0, hist.summary()['count'])
+
+
+class TestTaskTimings(TestCase):
+    def test_snapshot(self):
+        timings = TaskTimings()
+        with timings.timer('Task', 'run'):
+            pass
+        timings.record('Task', 'setup', 0.25)
+        snap = timings.snapshot()
+        self.assertEqual({'run', 'setup'}, set(snap['Task']))
+        self.assertEqual(1, snap['Task']['run']['count'])
+        self.assertEqual(250, snap['Task']['setup']['max'])
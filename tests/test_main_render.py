@@ -0,0 +1,72 @@
+from unittest import TestCase
+import os
+import json
+import wave
+import tempfile
+import threading
+
+import numpy as np
+
+import main
+from lib import clock
+from lib.config import load_config
+from components.capture import AudioCaptureTask
+from components.lights import LightOutputTask
+from components.mapper import MapperTask
+
+
+EXAMPLE_CONFIG = os.path.join(os.path.dirname(__file__), '..', 'config-example', 'main.yaml')
+
+
+class TestRender(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.wav = os.path.join(self.dir.name, 'test.wav')
+        self.trace = os.path.join(self.dir.name, 'trace.jsonl')
+        self.config = load_config(EXAMPLE_CONFIG, cache=False)
+        main.render_config(self.config, self.wav, self.trace)
+        self.hop = int(self.config['Capture']['SampleRate'] / self.config['Capture']['FPS'])
+        # 20 hops and a bit, of a tone that comes and goes
+        rng = np.random.RandomState(0)
+        t = np.arange(self.hop * 20 + 100) / self.config['Capture']['SampleRate']
+        samples = np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 3 * t) > 0) * 12000 + rng.randn(len(t)) * 100
+        with wave.open(self.wav, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.config['Capture']['SampleRate'])
+            wav.writeframes(samples.astype('<i2').tobytes())
+
+    def tearDown(self):
+        clock.set_clock(clock.RealClock())
+        self.dir.cleanup()
+
+    def test_render(self):
+        tasks = {}
+        tasks['audio'] = AudioCaptureTask(tasks, self.config)
+        tasks['mapper'] = MapperTask(tasks, self.config)
+        tasks['lights'] = LightOutputTask(tasks, self.config)
+        for task in tasks.values():
+            task.setup()
+        try:
+            frames = main.run_render(tasks, self.config, threading.Event())
+        finally:
+            for task in tasks.values():
+                task.teardown()
+
+        # Stopped by the end of the file, not anything else
+        self.assertTrue(tasks['audio'].capture.finished)
+        self.assertEqual(20, frames)
+        hop_time = self.hop / self.config['Capture']['SampleRate']
+        self.assertAlmostEqual(frames * hop_time, clock.perf_counter())
+
+        with open(self.trace) as fp:
+            records = [json.loads(line) for line in fp]
+        self.assertEqual(tasks['lights'].trace.frames, len(records))
+        times = [r['t'] for r in records]
+        # Everything starts out being sent, then only changes, in show time order on the hop grid
+        self.assertEqual(0, times[0])
+        self.assertEqual(sorted(times), times)
+        self.assertLessEqual(times[-1], frames * hop_time + 1e-6)
+        for t in times:
+            self.assertAlmostEqual(round(t / hop_time), t / hop_time, places=3)
+        self.assertEqual({'default'}, {r['device'] for r in records})